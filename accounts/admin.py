@@ -55,6 +55,7 @@ class UserAdmin(BaseUserAdmin):
     )
     readonly_fields = ("created_at", "updated_at")
     list_display = ("email", "first_name", "last_name", "user_type", "get_partner_company", "is_staff")
+    list_select_related = ("courier_profile",)  # For get_partner_company
     list_filter = ("user_type", "courier_profile__partner_company", "is_staff", "is_superuser", "is_active", "groups")
     search_fields = ("email", "first_name", "last_name")
     ordering = ("email",)
@@ -1,100 +1,115 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import redirect
 from django.urls import reverse, resolve
 from django.contrib import messages
 from django.http import HttpResponseForbidden
+from core.context import set_current_partner_company
+from core.middleware import HybridMiddleware
 
 
-class RoleBasedAccessMiddleware:
+class RoleBasedAccessMiddleware(HybridMiddleware):
     """
     Middleware to enforce role-based access control.
     Restricts access to views based on user's type (Admin, Courier, Customer).
     """
     
-    def __init__(self, get_response):
-        self.get_response = get_response
-        
-    def __call__(self, request):
-        if not request.user.is_authenticated:
+    def handle(self, request):
+        return self.check_access(request, request.user) or self.get_response(request)
+    
+    async def __acall__(self, request):
+        return self.check_access(request, await request.auser()) or await self.get_response(request)
+    
+    def check_access(self, request, user):
+        """Return a response refusing the request, or None to let it proceed"""
+        if not user.is_authenticated:
             # For unauthenticated users, let Django's auth middleware handle it
-            return self.get_response(request)
+            return None
         
         # Admin users have access to everything
-        if request.user.user_type == 'ADMIN':
-            return self.get_response(request)
+        if user.user_type == 'ADMIN':
+            return None
         
         # Get current URL path
         path = request.path_info
         
         # Paths that start with /admin/ are restricted to admin users only
-        if path.startswith('/admin/') and not request.user.is_staff:
+        if path.startswith('/admin/') and not user.is_staff:
             messages.error(request, "You don't have permission to access the admin area.")
             return redirect('accounts:login')
         
         # Courier-specific sections will be added in Step 7
-        # if path.startswith('/courier/') and not request.user.user_type == 'COURIER':
+        # if path.startswith('/courier/') and not user.user_type == 'COURIER':
         #     return HttpResponseForbidden("You don't have permission to access courier resources.")
         
         # Customer-specific sections will be added in Step 8
-        # if path.startswith('/customer/') and not request.user.user_type == 'CUSTOMER':
+        # if path.startswith('/customer/') and not user.user_type == 'CUSTOMER':
         #     return HttpResponseForbidden("You don't have permission to access customer resources.")
         
-        # Allow the request to proceed
-        return self.get_response(request)
+        return None
 
 
-class PartnerCompanyMiddleware:
+class PartnerCompanyMiddleware(HybridMiddleware):
     """
     Middleware to enforce partner company access control.
     This middleware ensures partner company users can only access their own resources.
     """
     
-    def __init__(self, get_response):
-        self.get_response = get_response
-        
-    def __call__(self, request):
-        # Skip for unauthenticated users or admin users
-        if not request.user.is_authenticated or request.user.user_type == 'ADMIN':
-            return self.get_response(request)
-            
-        # Skip for non-courier users (they don't belong to partner companies)
-        if request.user.user_type != 'COURIER':
-            return self.get_response(request)
-            
-        # Get partner company for the user
+    def handle(self, request):
+        self.set_partner_company(request, self.get_courier_profile(request.user))
+        return self.get_response(request)
+    
+    async def __acall__(self, request):
+        profile = await sync_to_async(self.get_courier_profile)(await request.auser())
+        # Set here rather than in the thread, so it stays in the request's own context
+        self.set_partner_company(request, profile)
+        return await self.get_response(request)
+    
+    def get_courier_profile(self, user):
+        """Return the courier profile of a courier user, or None"""
+        # Skip for unauthenticated users, admin users and other non-courier
+        # users (they don't belong to partner companies)
+        if not user.is_authenticated or user.user_type != 'COURIER':
+            return None
         try:
-            partner_company = request.user.courier_profile.partner_company
-            
-            # Set partner company on request for use in views
-            request.partner_company = partner_company
+            return user.courier_profile
         except:
-            # If there's no courier profile or partner company, just continue
-            pass
-            
-        # Allow the request to proceed - actual filtering will be done at the queryset level
-        return self.get_response(request)
+            # If there's no courier profile, just continue
+            return None
+    
+    def set_partner_company(self, request, profile):
+        if profile is None:
+            return
+        # Set partner company on request for use in views, and on the
+        # request context for code that has no request at hand; actual
+        # filtering will be done at the queryset level
+        request.partner_company = profile.partner_company
+        set_current_partner_company(profile.partner_company)
 
 
-class ActivityTrackingMiddleware:
+class ActivityTrackingMiddleware(HybridMiddleware):
     """
     Middleware to track user activity.
     Records when users last accessed the application.
     """
     
-    def __init__(self, get_response):
-        self.get_response = get_response
-        
-    def __call__(self, request):
+    def handle(self, request):
         response = self.get_response(request)
-        
+        self.track(request, request.user)
+        return response
+    
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self.track(request, await request.auser())
+        return response
+    
+    def track(self, request, user):
         # Update last activity timestamp for authenticated users
         # Skip for AJAX requests and static/media files
-        if (request.user.is_authenticated and 
+        if (user.is_authenticated and 
             not request.headers.get('x-requested-with') == 'XMLHttpRequest' and
             not request.path.startswith(('/static/', '/media/'))):
             
             # Update user's last activity timestamp
             # This will be implemented when we update the User model in future steps
-            # request.user.update_last_activity()
+            # user.update_last_activity()
             pass
-            
-        return response
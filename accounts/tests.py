@@ -1,3 +1,20 @@
 from django.test import TestCase
 
-# Create your tests here.
+from core.testing import ChangelistQueryCountMixin
+
+from .models import User
+
+
+class UserAdminQueryCountTests(ChangelistQueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin@example.com', 'password')
+        # Couriers get a courier profile, read by the partner company column
+        for i in range(25):
+            User.objects.create_user(f'courier{i}@example.com', user_type=User.Types.COURIER)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_changelist_queries(self):
+        self.assertChangelistQueriesConstant(User)
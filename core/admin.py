@@ -1,15 +1,43 @@
+from datetime import timedelta
 from django.contrib import admin
+from django.contrib.admin import SimpleListFilter
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from .exports import audit_log_export_response
 from .models import AuditLogEntry
+from .pagination import ApproximateCountPaginator, KeysetChangeList
 
 # Register your models here.
 
+class RecentPeriodFilter(SimpleListFilter):
+    """Restrict the changelist to recent entries so only recent partitions are scanned"""
+    title = _('Period')
+    parameter_name = 'period'
+    
+    def lookups(self, request, model_admin):
+        return (
+            ('7', _('Last 7 days')),
+            ('30', _('Last 30 days')),
+            ('90', _('Last 90 days')),
+        )
+    
+    def queryset(self, request, queryset):
+        if self.value() in ('7', '30', '90'):
+            return queryset.filter(timestamp__gte=timezone.now() - timedelta(days=int(self.value())))
+        return queryset
+
 @admin.register(AuditLogEntry)
 class AuditLogEntryAdmin(admin.ModelAdmin):
     list_display = ('timestamp', 'user', 'content_type', 'object_repr', 'action', 'ip_address')
-    list_filter = ('action', 'timestamp', 'content_type')
-    search_fields = ('user__username', 'object_repr', 'object_id')
+    list_filter = (RecentPeriodFilter, 'action', 'timestamp', 'content_type')
+    search_fields = ('user__email', 'object_repr', 'object_id')
     date_hierarchy = 'timestamp'
+    # user is nullable, so the admin's automatic select_related() would skip it
+    list_select_related = ('user',)
+    # Keyset pages and planner-estimated counts keep the changelist fast on large tables
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    actions = ['export_as_ndjson', 'export_as_csv']
     readonly_fields = ('timestamp', 'user', 'content_type', 'object_id', 'object_repr', 
                        'action', 'changes', 'ip_address', 'user_agent')
     
@@ -29,6 +57,17 @@ class AuditLogEntryAdmin(admin.ModelAdmin):
         }),
     )
     
+    def export_as_ndjson(self, request, queryset):
+        return audit_log_export_response(queryset, 'ndjson')
+    export_as_ndjson.short_description = _("Export selected entries as NDJSON")
+    
+    def export_as_csv(self, request, queryset):
+        return audit_log_export_response(queryset, 'csv')
+    export_as_csv.short_description = _("Export selected entries as CSV")
+    
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+    
     def has_add_permission(self, request):
         return False
     
@@ -8,3 +8,5 @@ class CoreConfig(AppConfig):
     
     def ready(self):
         import core.signals
+        from core.diff import prepare_tracked_models
+        prepare_tracked_models()
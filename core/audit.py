@@ -0,0 +1,220 @@
+import atexit
+import logging
+import queue
+import threading
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.dispatch import Signal
+
+from .models import AuditLogEntry
+
+logger = logging.getLogger(__name__)
+
+# Entries waiting to be flushed and the buffering scope depth of the current
+# request (or thread, outside of requests). A contextvar rather than a
+# thread-local, so async requests under ASGI each get their own buffer.
+_buffer = ContextVar('audit_log_buffer', default=None)
+
+# Default writer configuration, overridable through settings.AUDIT_LOG
+AUDIT_LOG_DEFAULTS = {
+    'MODE': 'buffered',       # 'buffered', 'background' or 'sync'
+    'FLUSH_SIZE': 500,        # Max entries per bulk_create
+    'FLUSH_INTERVAL': 2.0,    # Seconds the background flusher waits to fill a batch
+    'QUEUE_SIZE': 10000,      # Max batches waiting for the background flusher
+    'RETENTION_DAYS': 365,    # Entries kept in the database by archive_audit_log
+    'ARCHIVE_DIR': 'audit_archive',  # Archive directory, relative to MEDIA_ROOT
+    'COMPRESS_THRESHOLD': 0,  # Compress changes payloads of at least this many bytes (0 = off)
+}
+
+# Sent with the saved AuditLogEntry objects after every write, so read models
+# built from the audit trail itself (see orders.history) can be kept up to
+# date. It follows the write: in sync mode, audited_update and imports it runs
+# inside the writing transaction, and in background mode it runs in the
+# flusher thread, so a failed write takes it with it.
+entries_written = Signal()
+
+# Sent with the entries (saved or not) of changes once they are committed,
+# in the thread that made them and whatever the MODE, for caches and
+# documents that follow the audited objects rather than the audit rows
+# (see orders.statistics and orders.search). In buffered and background
+# mode it is sent, batched, when the entries are flushed.
+entries_committed = Signal()
+
+
+def get_audit_setting(name):
+    """Return an audit log setting, falling back to the defaults"""
+    return getattr(settings, 'AUDIT_LOG', {}).get(name, AUDIT_LOG_DEFAULTS[name])
+
+
+def send_entries(signal, entries):
+    """Send a signal with entries; a failing receiver is logged and never loses audit entries"""
+    for receiver, response in signal.send_robust(sender=AuditLogEntry, entries=entries):
+        if isinstance(response, Exception):
+            logger.error("Audit log receiver %r failed", receiver, exc_info=response)
+
+
+def notify_entries_written(entries):
+    """Send entries_written"""
+    send_entries(entries_written, entries)
+
+
+def notify_entries_committed(entries):
+    """Send entries_committed once the current transaction commits, or now outside of one"""
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: send_entries(entries_committed, entries))
+    else:
+        send_entries(entries_committed, entries)
+
+
+class AuditLogWriter:
+    """
+    Collects AuditLogEntry instances and writes them in batches.
+
+    Entries added inside a transaction are only queued once it commits
+    (through transaction.on_commit), so rolled back changes leave no audit
+    trail. Queued entries are kept in memory while a buffering scope is open
+    (one per request, see AuditMiddleware) and written with a single
+    bulk_create when the scope closes or FLUSH_SIZE is reached.
+
+    Modes:
+        buffered   - flush in the calling thread (default)
+        background - hand batches to a daemon thread through a bounded queue;
+                     when the queue is full the caller writes the batch itself
+        sync       - save every entry immediately, useful for tests
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def _state(self):
+        state = _buffer.get()
+        if state is None:
+            state = _AuditBuffer()
+            _buffer.set(state)
+        return state
+
+    def add(self, entry):
+        """Record an audit entry, deferring the write until commit"""
+        if get_audit_setting('MODE') == 'sync':
+            entry.save()
+            notify_entries_written([entry])
+            notify_entries_committed([entry])
+            return
+
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: self._enqueue(entry))
+        else:
+            self._enqueue(entry)
+
+    def _enqueue(self, entry):
+        state = self._state
+        state.pending.append(entry)
+        if not state.depth or len(state.pending) >= get_audit_setting('FLUSH_SIZE'):
+            self.flush()
+
+    def begin(self):
+        """Open a buffering scope; scopes may be nested"""
+        self._state.depth += 1
+
+    def end(self):
+        """Close a buffering scope, flushing when the outermost one closes"""
+        state = self._state
+        state.depth = max(state.depth - 1, 0)
+        if not state.depth:
+            self.flush()
+
+    def buffering(self):
+        """Context manager wrapping begin()/end()"""
+        return _BufferingScope(self)
+
+    def flush(self):
+        """Write every queued entry of the current context"""
+        state = self._state
+        batch = state.pending
+        if not batch:
+            return
+        state.pending = []
+        # Here rather than after the write, which may be in another thread and may fail
+        notify_entries_committed(batch)
+
+        if get_audit_setting('MODE') == 'background':
+            self._ensure_thread()
+            try:
+                self._queue.put_nowait(batch)
+                return
+            except queue.Full:
+                logger.warning("Audit log queue is full, writing %d entries synchronously", len(batch))
+
+        self._write(batch)
+
+    def _write(self, batch):
+        AuditLogEntry.objects.bulk_create(batch, batch_size=get_audit_setting('FLUSH_SIZE'))
+        notify_entries_written(batch)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=get_audit_setting('QUEUE_SIZE'))
+            self._thread = threading.Thread(target=self._run, name='audit-log-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.drain)
+
+    def _run(self):
+        """Background flusher loop: gather batches up to FLUSH_SIZE or FLUSH_INTERVAL"""
+        flush_size = get_audit_setting('FLUSH_SIZE')
+        flush_interval = get_audit_setting('FLUSH_INTERVAL')
+        while True:
+            batch = list(self._queue.get())
+            try:
+                while len(batch) < flush_size:
+                    try:
+                        batch.extend(self._queue.get(timeout=flush_interval))
+                    except queue.Empty:
+                        break
+                self._write(batch)
+            except Exception:
+                logger.exception("Failed to write %d audit log entries", len(batch))
+            finally:
+                close_old_connections()
+
+    def drain(self):
+        """Write everything still waiting in the background queue"""
+        if self._queue is None:
+            return
+        batch = []
+        while True:
+            try:
+                batch.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+
+class _AuditBuffer:
+    def __init__(self):
+        self.pending = []
+        self.depth = 0
+
+
+class _BufferingScope:
+    def __init__(self, writer):
+        self.writer = writer
+
+    def __enter__(self):
+        self.writer.begin()
+        return self.writer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.writer.end()
+
+
+audit_writer = AuditLogWriter()
@@ -0,0 +1,62 @@
+"""
+Per-request context shared by auditing and partner scoping.
+
+The current request, user and partner company are kept in contextvars
+rather than thread-locals, so they follow a request through async views and
+sync_to_async() calls under ASGI as well as through WSGI worker threads.
+RequestContextMiddleware opens the context for every request; management
+commands and background jobs can open one with request_context().
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_request = ContextVar('request', default=None)
+_user = ContextVar('user', default=None)
+_partner_company = ContextVar('partner_company', default=None)
+
+
+def get_current_request():
+    """Return the request being handled, or None"""
+    return _request.get()
+
+
+def get_current_user():
+    """Return the authenticated user of the current context, or None"""
+    user = _user.get()
+    if user is not None:
+        return user
+    user = getattr(_request.get(), 'user', None)
+    # request.user is resolved lazily, so this only hits the database once
+    # something (usually a sync signal receiver) actually asks for it
+    if user is not None and user.is_authenticated:
+        return user
+    return None
+
+
+def get_current_partner_company():
+    """Return the partner company the current request is scoped to, or None"""
+    return _partner_company.get()
+
+
+def set_current_partner_company(partner_company):
+    """Scope the rest of the current context to a partner company"""
+    _partner_company.set(partner_company)
+
+
+@contextmanager
+def request_context(request=None, user=None, partner_company=None):
+    """
+    Run a block with the given request, user and partner company as the
+    current context, restoring the previous values afterwards. The user
+    defaults to the request's authenticated user.
+    """
+    tokens = (
+        _request.set(request),
+        _user.set(user),
+        _partner_company.set(partner_company),
+    )
+    try:
+        yield
+    finally:
+        for var, token in zip((_request, _user, _partner_company), tokens):
+            var.reset(token)
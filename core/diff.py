@@ -0,0 +1,92 @@
+from django.apps import apps
+
+# Fields that change on every save and carry no audit value
+EXCLUDED_FIELDS = ('created_at', 'updated_at')
+
+
+def compute_tracked_fields(model):
+    """
+    Return the (name, attname) pairs of the columns audited for a model.
+
+    Foreign keys are compared on their raw id (attname) so diffing never
+    loads related objects. The model's derived_fields are left out.
+    """
+    return tuple(
+        (field.name, field.attname)
+        for field in model._meta.concrete_fields
+        if not field.primary_key
+        and not field.name.endswith('_ptr')
+        and field.name not in EXCLUDED_FIELDS
+        and field.name not in getattr(model, 'derived_fields', ())
+    )
+
+
+def get_tracked_fields(model):
+    """Return the cached tracked fields of a model, computing them if needed"""
+    tracked = model.__dict__.get('_tracked_fields')
+    if tracked is None:
+        tracked = compute_tracked_fields(model)
+        model._tracked_fields = tracked
+    return tracked
+
+
+def prepare_tracked_models():
+    """Compute the tracked field list of every change-tracking model once at startup"""
+    from .models import ChangeTrackingMixin
+
+    for model in apps.get_models():
+        if issubclass(model, ChangeTrackingMixin):
+            model._tracked_fields = compute_tracked_fields(model)
+
+
+def take_snapshot(instance, attnames=None):
+    """
+    Store the current column values of an instance as its snapshot.
+
+    The snapshot is a pair of (attnames, values) tuples, the same shape
+    from_db() receives, so loading a row costs no extra copies. When
+    attnames is given only those columns are refreshed.
+    """
+    if attnames is None:
+        attnames = tuple(attname for _, attname in get_tracked_fields(type(instance)))
+        instance._snapshot = (attnames, tuple(getattr(instance, attname) for attname in attnames))
+        return
+
+    snapshot = dict(zip(*instance._snapshot)) if getattr(instance, '_snapshot', None) else {}
+    for attname in attnames:
+        snapshot[attname] = getattr(instance, attname)
+    instance._snapshot = (tuple(snapshot), tuple(snapshot.values()))
+
+
+def get_changes(instance, old_instance=None):
+    """
+    Return {field_name: {'old': ..., 'new': ...}} for the columns that changed.
+
+    Old values come from old_instance when given, otherwise from the snapshot
+    taken when the row was loaded or last saved. Without either (a new
+    instance) every non-empty column is reported with an old value of None.
+    """
+    tracked = get_tracked_fields(type(instance))
+
+    if old_instance is not None:
+        old_values = {attname: getattr(old_instance, attname) for _, attname in tracked}
+    elif getattr(instance, '_snapshot', None):
+        old_values = dict(zip(*instance._snapshot))
+    else:
+        changes = {}
+        for name, attname in tracked:
+            value = getattr(instance, attname)
+            if value not in (None, ''):
+                changes[name] = {'old': None, 'new': value}
+        return changes
+
+    changes = {}
+    for name, attname in tracked:
+        if attname not in old_values or attname not in instance.__dict__:
+            # Deferred columns were never loaded, so they cannot have changed
+            continue
+        old_value = old_values[attname]
+        new_value = instance.__dict__[attname]
+        if old_value != new_value:
+            changes[name] = {'old': old_value, 'new': new_value}
+    return changes
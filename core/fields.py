@@ -0,0 +1,41 @@
+import base64
+import json
+import zlib
+
+from django.db import models
+
+
+class CompressedJSONField(models.JSONField):
+    """
+    JSONField that can store large payloads zlib-compressed.
+
+    Values whose JSON encoding reaches AUDIT_LOG['COMPRESS_THRESHOLD'] bytes
+    are stored as {"__zlib__": "<base64 deflate>"} and inflated again when
+    loaded, so models, the admin and exports only ever see the original
+    value. A threshold of 0 (the default) turns compression off; rows written
+    either way can always be read back. Key lookups into compressed values
+    are not possible.
+    """
+    MARKER = '__zlib__'
+
+    def get_compress_threshold(self):
+        # Imported here: core.audit imports the models that use this field
+        from .audit import get_audit_setting
+        return get_audit_setting('COMPRESS_THRESHOLD')
+
+    def get_prep_value(self, value):
+        threshold = self.get_compress_threshold()
+        if threshold and isinstance(value, (dict, list)):
+            data = json.dumps(value, cls=self.encoder, separators=(',', ':')).encode()
+            if len(data) >= threshold:
+                compressed = base64.b64encode(zlib.compress(data)).decode('ascii')
+                # base64 costs a third; only keep the result when it still saves space
+                if len(compressed) < len(data):
+                    return {self.MARKER: compressed}
+        return super().get_prep_value(value)
+
+    def from_db_value(self, value, expression, connection):
+        value = super().from_db_value(value, expression, connection)
+        if isinstance(value, dict) and len(value) == 1 and self.MARKER in value:
+            return json.loads(zlib.decompress(base64.b64decode(value[self.MARKER])), cls=self.decoder)
+        return value
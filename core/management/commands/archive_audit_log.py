@@ -0,0 +1,119 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from core.audit import get_audit_setting
+from core.exports import EXPORT_FIELDS, EXPORT_LOOKUPS
+from core.models import AuditLogEntry
+from core.partitions import (
+    add_months, drop_partition, ensure_partitions, get_default_partition_months, get_partitions, is_partitioned,
+    month_start,
+)
+
+
+def get_archive_path(archive_dir, label):
+    """
+    The archive file of a month, never an existing one: a month archived again
+    (rows that reached it later, or a run that could not remove it) gets a
+    numbered file next to the first
+    """
+    path = archive_dir / f'auditlog-{label}.ndjson.gz'
+    number = 1
+    while path.exists():
+        number += 1
+        path = archive_dir / f'auditlog-{label}.{number}.ndjson.gz'
+    return path
+
+
+class Command(BaseCommand):
+    help = ('Export audit log months older than the retention window to gzip-compressed NDJSON '
+            'files under MEDIA_ROOT and remove them from the database. Rows that fell into the '
+            'DEFAULT partition are archived with their month.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=get_audit_setting('RETENTION_DAYS'),
+                            help='Keep entries newer than this many days (whole months are archived)')
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Number of future monthly partitions to create (PostgreSQL only)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched per database round trip while exporting')
+        parser.add_argument('--dry-run', action='store_true', help='List the months that would be archived')
+
+    def handle(self, *args, **options):
+        partitioned = is_partitioned()
+        if partitioned:
+            ensure_partitions(options['months_ahead'])
+
+        cutoff = month_start(datetime.now(dt_timezone.utc) - timedelta(days=options['retention_days']))
+        months = self.get_months(cutoff, partitioned)
+        if not months:
+            self.stdout.write(self.style.SUCCESS('No audit log months to archive'))
+            return
+
+        archive_dir = Path(settings.MEDIA_ROOT) / get_audit_setting('ARCHIVE_DIR')
+        archive_dir.mkdir(parents=True, exist_ok=True)
+
+        for month, partition in months:
+            label = month.strftime('%Y-%m')
+            if options['dry_run']:
+                self.stdout.write(f'Would archive {label}')
+                continue
+
+            path = get_archive_path(archive_dir, label)
+            rows = self.export_month(month, path, options['chunk_size'])
+            self.remove_month(month, partition)
+            if rows:
+                self.stdout.write(self.style.SUCCESS(f'Archived {rows} entries for {label} to {path}'))
+            else:
+                self.stdout.write(f'Removed empty month {label}')
+
+    def get_months(self, cutoff, partitioned):
+        """Return [(month_start, partition_name)] of the months older than cutoff"""
+        if partitioned:
+            months = [(month, name) for name, month in get_partitions() if month < cutoff]
+            # Rows outside every monthly partition, e.g. older than the partitioning
+            covered = {month for month, _ in months}
+            months += [(month, None) for month in get_default_partition_months(cutoff) if month not in covered]
+            return sorted(months, key=lambda month: month[0])
+        return [
+            (month_start(month), None)
+            for month in AuditLogEntry.objects.filter(timestamp__lt=cutoff).datetimes(
+                'timestamp', 'month', tzinfo=dt_timezone.utc
+            )
+        ]
+
+    def export_month(self, month, path, chunk_size):
+        """Stream one month of entries to a gzip NDJSON file, returning the row count"""
+        rows = AuditLogEntry.objects.filter(
+            timestamp__gte=month, timestamp__lt=add_months(month, 1)
+        ).order_by('id').values_list(*EXPORT_LOOKUPS)
+
+        # Write to a temporary file so an interrupted run never leaves a truncated archive
+        tmp_path = path.with_suffix('.tmp')
+        count = 0
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as archive:
+            for row in rows.iterator(chunk_size=chunk_size):
+                archive.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder))
+                archive.write('\n')
+                count += 1
+        if count:
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+        return count
+
+    def remove_month(self, month, partition):
+        with transaction.atomic():
+            if partition:
+                drop_partition(partition)
+            # Without a partition, or once it is gone, rows of the month left in the default partition
+            AuditLogEntry.objects.filter(
+                timestamp__gte=month, timestamp__lt=add_months(month, 1)
+            ).delete()
@@ -0,0 +1,101 @@
+import json
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core.models import AuditLogEntry
+from orders.models import Order, OrderState
+
+
+def full_field_changes(instance):
+    """The pre-snapshot behaviour: every field reported as changed"""
+    changes = {}
+    for field in instance._meta.fields:
+        if field.name.endswith('_ptr') or field.name in ['created_at', 'updated_at']:
+            continue
+        value = getattr(instance, field.name)
+        if field.is_relation:
+            value = str(value) if value else None
+        changes[field.name] = {'old': None, 'new': value}
+    return changes
+
+
+class Command(BaseCommand):
+    help = 'Compare audit row size and write latency of full-field dumps against snapshot diffs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000, help='Number of orders to update (minimum 1)')
+
+    def handle(self, *args, **options):
+        count = max(options['orders'], 1)
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Benchmarking audit writes for {count} order updates...'))
+
+        # Everything runs in a transaction that is rolled back at the end
+        with transaction.atomic():
+            now = timezone.now()
+            Order.objects.bulk_create([
+                Order(
+                    order_date=now,
+                    order_id=f'BENCH-{i}',
+                    product_name=f'Benchmark product {i}',
+                    product_category='Furniture',
+                    product_url='https://www.whoppah.com/product/benchmark',
+                    weight=Decimal('12.50'),
+                    total_price=Decimal('149.00'),
+                ) for i in range(count)
+            ])
+
+            results = [
+                self.run('Full-field dump', full_field_changes),
+                self.run('Snapshot diff', lambda order: order.get_changes()),
+                self.run_saves('Model save'),
+            ]
+            transaction.set_rollback(True)
+
+        for label, avg_size, avg_latency in results:
+            self.stdout.write(f'{label:<16} avg changes size: {avg_size:8.1f} bytes   '
+                              f'avg write: {avg_latency * 1000:6.3f} ms')
+        self.stdout.write(self.style.SUCCESS(
+            f'Snapshot diffs are {results[0][1] / max(results[1][1], 1):.1f}x smaller'
+        ))
+
+    def run(self, label, changes_for):
+        orders = list(Order.objects.filter(order_id__startswith='BENCH-'))
+        total_size = 0
+        started = time.perf_counter()
+        for order in orders:
+            order.status = OrderState.SHIPPED if order.status != OrderState.SHIPPED else OrderState.ACCEPTED
+            changes = changes_for(order)
+            total_size += len(json.dumps(changes, cls=DjangoJSONEncoder))
+            AuditLogEntry.objects.create(
+                content_type=order.__class__.__name__,
+                object_id=str(order.pk),
+                object_repr=str(order),
+                action='UPDATE',
+                changes=changes,
+            )
+        elapsed = time.perf_counter() - started
+        return label, total_size / len(orders), elapsed / len(orders)
+
+    def run_saves(self, label):
+        """The whole save path: snapshot diff, pre_save stamping and the audit signal handlers"""
+        orders = list(Order.objects.filter(order_id__startswith='BENCH-'))
+        last_entry = AuditLogEntry.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        # Written as they are recorded, inside the transaction rolled back by handle()
+        with override_settings(AUDIT_LOG={**getattr(settings, 'AUDIT_LOG', {}), 'MODE': 'sync'}):
+            started = time.perf_counter()
+            for order in orders:
+                order.status = OrderState.SHIPPED if order.status != OrderState.SHIPPED else OrderState.ACCEPTED
+                order.save()
+            elapsed = time.perf_counter() - started
+        sizes = [
+            len(json.dumps(changes, cls=DjangoJSONEncoder))
+            for changes in AuditLogEntry.objects.filter(pk__gt=last_entry).values_list('changes', flat=True)
+        ]
+        return label, sum(sizes) / max(len(sizes), 1), elapsed / len(orders)
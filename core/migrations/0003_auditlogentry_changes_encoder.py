@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:24
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_auditlogentry_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditlogentry',
+            name='changes',
+            field=models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Changes'),
+        ),
+    ]
@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+TABLE = 'core_auditlogentry'
+OLD_TABLE = 'core_auditlogentry_unpartitioned'
+SEQUENCE = 'core_auditlogentry_pk_seq'
+MONTHS_AHEAD = 3
+
+
+def month_start(value):
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_auditlogentry(apps, schema_editor):
+    """Turn the audit table into a table partitioned by month on PostgreSQL"""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        # SQLite and other backends keep the plain table
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}')
+        cursor.execute(f'ALTER INDEX {TABLE}_pkey RENAME TO {OLD_TABLE}_pkey')
+        # Left behind by unpartition_auditlogentry; the old table is dropped below anyway
+        cursor.execute(f'DROP INDEX IF EXISTS {TABLE}_user_id_idx')
+        # The partition key has to be part of the primary key
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}')
+        cursor.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, "timestamp")')
+        cursor.execute(
+            f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_user_id_fk_accounts_user_id '
+            f'FOREIGN KEY (user_id) REFERENCES accounts_user (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+        cursor.execute(f'CREATE INDEX {TABLE}_user_id_idx ON {TABLE} (user_id)')
+
+        # One partition per month from the oldest entry up to a few months ahead
+        cursor.execute(f'SELECT MIN("timestamp") FROM {OLD_TABLE}')
+        oldest = cursor.fetchone()[0]
+        now = datetime.now(timezone.utc)
+        month = month_start(oldest or now)
+        last = add_months(month_start(now), MONTHS_AHEAD)
+        while month <= last:
+            cursor.execute(
+                f'CREATE TABLE {TABLE}_y{month.year:04d}m{month.month:02d} PARTITION OF {TABLE} '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            )
+            month = add_months(month, 1)
+        # Catches rows outside the monthly partitions instead of failing the insert
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE}')
+        cursor.execute(f"SELECT setval('{SEQUENCE}', COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)")
+        cursor.execute(f'DROP TABLE {OLD_TABLE}')
+
+
+def unpartition_auditlogentry(apps, schema_editor):
+    """Copy the partitioned audit table back into a plain table"""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {OLD_TABLE} (LIKE {TABLE} INCLUDING DEFAULTS)')
+        cursor.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY {OLD_TABLE}.id')
+        cursor.execute(f'INSERT INTO {OLD_TABLE} SELECT * FROM {TABLE}')
+        cursor.execute(f'DROP TABLE {TABLE}')
+        cursor.execute(f'ALTER TABLE {OLD_TABLE} RENAME TO {TABLE}')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id)')
+        cursor.execute(
+            f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_user_id_fk_accounts_user_id '
+            f'FOREIGN KEY (user_id) REFERENCES accounts_user (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+        cursor.execute(f'CREATE INDEX {TABLE}_user_id_idx ON {TABLE} (user_id)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_auditlogentry_changes_encoder'),
+        ('accounts', '0002_courierprofile_partner_company'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_auditlogentry, unpartition_auditlogentry),
+    ]
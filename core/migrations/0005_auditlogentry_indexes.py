@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_partition_auditlogentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlogentry',
+            index=models.Index(fields=['content_type', 'object_id', 'timestamp'], name='core_audit_object_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlogentry',
+            index=models.Index(fields=['user', 'timestamp'], name='core_audit_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlogentry',
+            index=models.Index(fields=['timestamp', 'id'], name='core_audit_timestamp_idx'),
+        ),
+    ]
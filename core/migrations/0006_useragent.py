@@ -0,0 +1,68 @@
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def intern_user_agents(apps, schema_editor):
+    """Move the distinct user agent strings into core_useragent and point entries at them"""
+    AuditLogEntry = apps.get_model('core', 'AuditLogEntry')
+    UserAgent = apps.get_model('core', 'UserAgent')
+    connection = schema_editor.connection
+
+    if connection.vendor == 'postgresql':
+        # Set-based, so the audit table is scanned twice rather than once per user agent
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO core_useragent (value, digest) "
+                "SELECT DISTINCT user_agent, encode(sha256(convert_to(user_agent, 'UTF8')), 'hex') "
+                "FROM core_auditlogentry WHERE user_agent <> '' "
+                "ON CONFLICT (digest) DO NOTHING"
+            )
+            cursor.execute(
+                "UPDATE core_auditlogentry e SET user_agent_ref_id = u.id "
+                "FROM core_useragent u WHERE e.user_agent <> '' AND u.value = e.user_agent"
+            )
+        return
+
+    values = AuditLogEntry.objects.exclude(user_agent='').values_list('user_agent', flat=True).distinct()
+    for value in list(values):
+        user_agent, _ = UserAgent.objects.get_or_create(
+            digest=hashlib.sha256(value.encode()).hexdigest(), defaults={'value': value}
+        )
+        AuditLogEntry.objects.filter(user_agent=value).update(user_agent_ref=user_agent)
+
+
+def restore_user_agents(apps, schema_editor):
+    AuditLogEntry = apps.get_model('core', 'AuditLogEntry')
+    UserAgent = apps.get_model('core', 'UserAgent')
+    for user_agent in UserAgent.objects.iterator():
+        AuditLogEntry.objects.filter(user_agent_ref=user_agent).update(user_agent=user_agent.value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_auditlogentry_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.TextField(verbose_name='User Agent')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 Digest')),
+            ],
+            options={
+                'verbose_name': 'User Agent',
+                'verbose_name_plural': 'User Agents',
+            },
+        ),
+        migrations.AddField(
+            model_name='auditlogentry',
+            name='user_agent_ref',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.useragent', verbose_name='User Agent'),
+        ),
+        migrations.RunPython(intern_user_agents, restore_user_agents),
+    ]
@@ -0,0 +1,27 @@
+import core.fields
+import django.core.serializers.json
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_useragent'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='auditlogentry',
+            name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='auditlogentry',
+            old_name='user_agent_ref',
+            new_name='user_agent',
+        ),
+        migrations.AlterField(
+            model_name='auditlogentry',
+            name='changes',
+            field=core.fields.CompressedJSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Changes'),
+        ),
+    ]
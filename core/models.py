@@ -1,7 +1,85 @@
-from django.db import models
+import hashlib
+
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-import json
+from django.core.serializers.json import DjangoJSONEncoder
+from . import diff
+from .context import get_current_user
+from .fields import CompressedJSONField
+
+
+def user_agent_digest(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+class UserAgentManager(models.Manager):
+    # value -> pk of committed user agents, shared by the whole process
+    _cache = {}
+    CACHE_SIZE = 1000
+    
+    def resolve(self, values):
+        """Return {value: pk} for the given user agent strings, creating missing rows"""
+        values = {value for value in values if value}
+        ids = {value: self._cache[value] for value in values if value in self._cache}
+        missing = values - ids.keys()
+        if not missing:
+            return ids
+        
+        digests = {user_agent_digest(value): value for value in missing}
+        found = dict(self.filter(digest__in=digests).values_list('digest', 'pk'))
+        new = [self.model(digest=digest, value=value) for digest, value in digests.items() if digest not in found]
+        if new:
+            # Another process may insert the same user agent concurrently
+            self.bulk_create(new, ignore_conflicts=True)
+            found = dict(self.filter(digest__in=digests).values_list('digest', 'pk'))
+        found = {digests[digest]: pk for digest, pk in found.items()}
+        ids.update(found)
+        # Rows created in a transaction that rolls back must not be cached
+        transaction.on_commit(lambda: self._remember(found), using=self.db)
+        return ids
+    
+    def _remember(self, ids):
+        if len(self._cache) + len(ids) > self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache.update(ids)
+
+
+class UserAgent(models.Model):
+    """
+    Distinct User-Agent strings, stored once and referenced by audit entries
+    """
+    value = models.TextField(_('User Agent'))
+    digest = models.CharField(_('SHA-256 Digest'), max_length=64, unique=True)
+    
+    objects = UserAgentManager()
+    
+    class Meta:
+        verbose_name = _('User Agent')
+        verbose_name_plural = _('User Agents')
+    
+    def __str__(self):
+        return self.value
+
+
+class AuditLogEntryQuerySet(models.QuerySet):
+    def for_object(self, instance):
+        """History of one object, newest first (served by the object index)"""
+        return self.filter(
+            content_type=instance.__class__.__name__,
+            object_id=str(instance.pk),
+        ).order_by('-timestamp', '-id')
+    
+    def for_user(self, user):
+        """Entries written by one user, newest first (served by the user index)"""
+        return self.filter(user=user).order_by('-timestamp', '-id')
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        AuditLogEntry.resolve_user_agents(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
 
 class AuditLogEntry(models.Model):
     """
@@ -25,21 +103,120 @@ class AuditLogEntry(models.Model):
     object_id = models.CharField(_('Object ID'), max_length=50)
     object_repr = models.CharField(_('Object Representation'), max_length=255)
     action = models.CharField(_('Action'), max_length=10, choices=ACTION_TYPES)
-    changes = models.JSONField(_('Changes'), default=dict)
-    timestamp = models.DateTimeField(_('Timestamp'), auto_now_add=True)
+    changes = CompressedJSONField(_('Changes'), default=dict, encoder=DjangoJSONEncoder)
+    # Set when the entry is built, not when a buffered batch is flushed
+    timestamp = models.DateTimeField(_('Timestamp'), default=timezone.now, editable=False)
     ip_address = models.GenericIPAddressField(_('IP Address'), null=True, blank=True)
-    user_agent = models.TextField(_('User Agent'), blank=True)
+    # Interned: the same few browser strings repeat across millions of rows
+    user_agent = models.ForeignKey(
+        UserAgent,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name='+',
+        db_index=False,
+        verbose_name=_('User Agent')
+    )
+    
+    objects = AuditLogEntryQuerySet.as_manager()
     
     class Meta:
         verbose_name = _('Audit Log Entry')
         verbose_name_plural = _('Audit Log Entries')
         ordering = ['-timestamp']
+        indexes = [
+            # Per-object history and keyset pagination of the changelist
+            models.Index(fields=['content_type', 'object_id', 'timestamp'], name='core_audit_object_idx'),
+            models.Index(fields=['user', 'timestamp'], name='core_audit_user_idx'),
+            models.Index(fields=['timestamp', 'id'], name='core_audit_timestamp_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_action_display()} {self.object_repr} by {self.user}"
+    
+    @property
+    def user_agent_string(self):
+        """The raw User-Agent header; may be set before the entry is saved"""
+        if getattr(self, '_user_agent_string', None) is not None:
+            return self._user_agent_string
+        return self.user_agent.value if self.user_agent_id else ''
+    
+    @user_agent_string.setter
+    def user_agent_string(self, value):
+        self._user_agent_string = value
+    
+    @classmethod
+    def resolve_user_agents(cls, entries):
+        """Point entries built with a user_agent_string at their interned UserAgent"""
+        pending = [entry for entry in entries
+                   if entry.user_agent_id is None and getattr(entry, '_user_agent_string', None)]
+        if not pending:
+            return
+        ids = UserAgent.objects.resolve(entry._user_agent_string for entry in pending)
+        for entry in pending:
+            entry.user_agent_id = ids[entry._user_agent_string]
+    
+    def save(self, *args, **kwargs):
+        self.resolve_user_agents([self])
+        super().save(*args, **kwargs)
+
+
+class ChangeTrackingMixin(models.Model):
+    """
+    Abstract base model that remembers the column values an instance was
+    loaded or last saved with, so audits can record only real changes.
+
+    derived_fields names columns maintained by set-based UPDATEs elsewhere:
+    they are not audited, and a full save() of a loaded instance leaves
+    them out, so a stale copy cannot overwrite them.
+    """
+    derived_fields = ()
+    # Set by core.signals.AuditRegistry when stamp_save sets updated_by
+    stamps_updated_by = False
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the row as loaded; no extra query, no copy
+        instance._snapshot = (field_names, values)
+        return instance
+
+    def save(self, *args, **kwargs):
+        if self.derived_fields and not args and kwargs.get('update_fields') is None \
+                and not self._state.adding and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.derived_fields
+            ]
+        update_fields = kwargs.get('update_fields')
+        if self.stamps_updated_by and update_fields is not None and get_current_user() is not None \
+                and not {'updated_by', 'updated_by_id'} & set(update_fields):
+            # stamp_save sets it in pre_save, which cannot add it to update_fields
+            kwargs['update_fields'] = [*update_fields, 'updated_by']
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        diff.take_snapshot(self, None if update_fields is None else [
+            self._meta.get_field(name).attname for name in update_fields
+        ])
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        # The reloaded columns are what the database holds now: changes count from there
+        tracked = diff.get_tracked_fields(type(self))
+        if fields is not None:
+            fields = set(fields)
+            tracked = [(name, attname) for name, attname in tracked if name in fields or attname in fields]
+        diff.take_snapshot(self, [attname for _, attname in tracked if attname in self.__dict__])
+
+    def get_changes(self, old_instance=None):
+        """Get a dictionary of changed fields with old and new values"""
+        return diff.get_changes(self, old_instance)
 
 
-class AuditableMixin(models.Model):
+class AuditableMixin(ChangeTrackingMixin):
     """
     Abstract base model that provides audit fields
     """
@@ -64,36 +241,3 @@ class AuditableMixin(models.Model):
     
     class Meta:
         abstract = True
-    
-    def get_changes(self, old_instance=None):
-        """Get a dictionary of changed fields with old and new values"""
-        if not old_instance:
-            # For new instances, return all fields
-            return {
-                field.name: {
-                    'old': None,
-                    'new': getattr(self, field.name)
-                } for field in self._meta.fields
-                if not field.name.endswith('_ptr') and field.name not in ['created_at', 'updated_at']
-            }
-        
-        changes = {}
-        for field in self._meta.fields:
-            if field.name.endswith('_ptr') or field.name in ['created_at', 'updated_at']:
-                continue
-                
-            old_value = getattr(old_instance, field.name)
-            new_value = getattr(self, field.name)
-            
-            # Handle special cases like ForeignKey
-            if field.is_relation:
-                old_value = str(old_value) if old_value else None
-                new_value = str(new_value) if new_value else None
-            
-            if old_value != new_value:
-                changes[field.name] = {
-                    'old': old_value,
-                    'new': new_value
-                }
-        
-        return changes
@@ -0,0 +1,48 @@
+"""
+Migration operations for building indexes without locking writes.
+
+On PostgreSQL AddIndexConcurrently uses CREATE INDEX CONCURRENTLY (and DROP
+INDEX CONCURRENTLY when unapplied), so large tables stay writable while the
+index is built. That cannot run inside a transaction: migrations using it
+must set atomic = False. Other databases get a plain CREATE INDEX.
+
+Unlike django.contrib.postgres.operations this works on every backend and
+does not need psycopg installed, so the same migration runs on SQLite in
+development. A failed concurrent build leaves an INVALID index behind; drop
+it before running the migration again.
+"""
+from django.db import NotSupportedError, migrations
+
+
+def supports_concurrently(schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    if schema_editor.connection.in_atomic_block:
+        raise NotSupportedError(
+            'Concurrent index operations cannot run inside a transaction; set atomic = False on the migration.'
+        )
+    return True
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """AddIndex using CREATE INDEX CONCURRENTLY on PostgreSQL"""
+
+    def describe(self):
+        return f'Concurrently create index {self.index.name} on {self.model_name}'
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            if supports_concurrently(schema_editor):
+                schema_editor.add_index(model, self.index, concurrently=True)
+            else:
+                schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            if supports_concurrently(schema_editor):
+                schema_editor.remove_index(model, self.index, concurrently=True)
+            else:
+                schema_editor.remove_index(model, self.index)
+
@@ -0,0 +1,138 @@
+from datetime import datetime
+
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+OLDER_VAR = 'older'
+NEWER_VAR = 'newer'
+
+# Below this many estimated rows an exact COUNT(*) is cheap enough
+EXACT_COUNT_THRESHOLD = 10000
+
+
+def estimate_count(queryset):
+    """Return the PostgreSQL planner's row estimate for a queryset, or None"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator that uses the planner estimate instead of COUNT(*) for large
+    result sets. Small results (and non-PostgreSQL databases) are counted
+    exactly.
+    """
+
+    is_estimate = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < EXACT_COUNT_THRESHOLD:
+            return super().count
+        self.is_estimate = True
+        return estimate
+
+
+def encode_cursor(obj, field_name):
+    return f'{getattr(obj, field_name).isoformat()}_{obj.pk}'
+
+
+def decode_cursor(value):
+    """Return the (timestamp, pk) of a cursor, or None when it is missing or malformed"""
+    timestamp, _, pk = (value or '').rpartition('_')
+    try:
+        timestamp, pk = datetime.fromisoformat(timestamp), int(pk)
+    except ValueError:
+        return None
+    return None if timezone.is_naive(timestamp) else (timestamp, pk)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList paginating on (keyset_field, pk) instead of OFFSET.
+
+    With the default ordering, pages are fetched with
+    WHERE (keyset_field, pk) < (last seen) ORDER BY keyset_field DESC, pk DESC
+    LIMIT n, so every page costs one index range scan however deep it is.
+    Sorting on another column falls back to numbered pages. A malformed
+    cursor (a hand-edited or truncated link) is ignored: the first page is
+    shown.
+    """
+    keyset_field = 'timestamp'
+
+    def __init__(self, request, *args, **kwargs):
+        self.older = decode_cursor(request.GET.get(OLDER_VAR))
+        self.newer = decode_cursor(request.GET.get(NEWER_VAR))
+        super().__init__(request, *args, **kwargs)
+        # Like the page number, the cursor must not leak into filter and sort links
+        for params in (self.params, self.filter_params):
+            params.pop(OLDER_VAR, None)
+            params.pop(NEWER_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(OLDER_VAR, None)
+        lookup_params.pop(NEWER_VAR, None)
+        return lookup_params
+
+    @property
+    def keyset(self):
+        return ORDER_VAR not in self.params
+
+    def get_results(self, request):
+        if not self.keyset:
+            return super().get_results(request)
+
+        field = self.keyset_field
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        queryset = self.queryset
+        if self.newer:
+            value, pk = self.newer
+            queryset = queryset.filter(
+                Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+            ).order_by(field, 'pk')
+        else:
+            if self.older:
+                value, pk = self.older
+                queryset = queryset.filter(
+                    Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk})
+                )
+            queryset = queryset.order_by(f'-{field}', '-pk')
+
+        # One extra row tells whether there is another page in this direction
+        rows = list(queryset[:self.list_per_page + 1])
+        has_more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if self.newer:
+            rows.reverse()
+
+        self.older_url = self.newer_url = None
+        if rows and (has_more or self.newer):
+            self.older_url = self.get_query_string(
+                {OLDER_VAR: encode_cursor(rows[-1], field)}, remove=[NEWER_VAR]
+            )
+        if rows and (self.older or (self.newer and has_more)):
+            self.newer_url = self.get_query_string(
+                {NEWER_VAR: encode_cursor(rows[0], field)}, remove=[OLDER_VAR]
+            )
+        self.first_url = self.get_query_string(remove=[OLDER_VAR, NEWER_VAR])
+
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = bool(self.older_url or self.newer_url)
+        self.paginator = paginator
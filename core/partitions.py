@@ -0,0 +1,119 @@
+"""
+Monthly range partitions of the audit log table on PostgreSQL.
+
+The audit table is partitioned by month on "timestamp" (see migration
+0004_partition_auditlogentry), with a DEFAULT partition catching rows no
+monthly partition covers. archive_audit_log keeps partitions created a few
+months ahead, so the default partition normally stays empty; rows that
+do land there are archived with their month all the same. On other
+databases the audit table stays a plain table and these helpers report no
+partitions.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection as default_connection
+
+from .models import AuditLogEntry
+
+PARENT_TABLE = AuditLogEntry._meta.db_table
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+PARTITION_NAME_RE = re.compile(r'_y(\d{4})m(\d{2})$')
+
+
+def month_start(value):
+    """Return the first moment (UTC) of the month containing value"""
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value, months):
+    """Return the first moment of the month that is months away from value"""
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}'
+
+
+def is_partitioned(connection=None):
+    """Return True when the audit table is a partitioned PostgreSQL table"""
+    connection = connection or default_connection
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s",
+            [PARENT_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def get_partitions(connection=None):
+    """Return [(name, month_start)] of the monthly partitions, oldest first"""
+    connection = connection or default_connection
+    if not is_partitioned(connection):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits i "
+            "JOIN pg_class parent ON parent.oid = i.inhparent "
+            "JOIN pg_class child ON child.oid = i.inhrelid "
+            "WHERE parent.relname = %s",
+            [PARENT_TABLE],
+        )
+        partitions = []
+        for (name,) in cursor.fetchall():
+            match = PARTITION_NAME_RE.search(name)
+            if match:
+                partitions.append((name, datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def get_default_partition_months(before, connection=None):
+    """Return the starts of the months, before the month of before, with rows in the default partition"""
+    connection = connection or default_connection
+    if not is_partitioned(connection):
+        return []
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', timestamp AT TIME ZONE 'UTC') "
+            f"FROM {quote(DEFAULT_PARTITION)} WHERE timestamp < %s",
+            [month_start(before)],
+        )
+        return sorted(month.replace(tzinfo=dt_timezone.utc) for (month,) in cursor.fetchall())
+
+
+def create_partition(month, connection=None):
+    """Create the partition holding the month starting at month, if missing"""
+    connection = connection or default_connection
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote(partition_name(month))} "
+            f"PARTITION OF {quote(PARENT_TABLE)} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        )
+
+
+def ensure_partitions(months_ahead=3, now=None, connection=None):
+    """Make sure partitions exist from the current month to months_ahead months out"""
+    connection = connection or default_connection
+    if not is_partitioned(connection):
+        return
+    current = month_start(now or datetime.now(dt_timezone.utc))
+    for offset in range(months_ahead + 1):
+        create_partition(add_months(current, offset), connection)
+
+
+def drop_partition(name, connection=None):
+    """Detach and drop a monthly partition"""
+    connection = connection or default_connection
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {quote(PARENT_TABLE)} DETACH PARTITION {quote(name)}")
+        cursor.execute(f"DROP TABLE {quote(name)}")
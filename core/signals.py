@@ -1,94 +1,177 @@
-import json
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-from django.contrib.auth.models import AnonymousUser
-from django.utils.translation import gettext_lazy as _
+from django.db import models, transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.utils import timezone
 
 from .models import AuditLogEntry
-from orders.models import Order, PickupAddress, DropoffAddress, OrderNote
+from .audit import audit_writer, get_audit_setting, notify_entries_committed, notify_entries_written
+from .diff import get_tracked_fields
+from .context import get_current_user, get_current_request
 
-import threading
-_thread_locals = threading.local()
 
-def get_current_user():
-    """Get the current user from thread local storage"""
-    return getattr(_thread_locals, 'user', None)
+def get_client_info(request):
+    """Return the (ip_address, user_agent) pair of a request"""
+    if not request:
+        return None, ""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        ip_address = x_forwarded_for.split(',')[0].strip()
+    else:
+        ip_address = request.META.get('REMOTE_ADDR')
+    return ip_address, request.META.get('HTTP_USER_AGENT', '')
 
-def get_current_request():
-    """Get the current request from thread local storage"""
-    return getattr(_thread_locals, 'request', None)
 
-@receiver(post_save, sender=Order)
-@receiver(post_save, sender=PickupAddress)
-@receiver(post_save, sender=DropoffAddress)
-@receiver(post_save, sender=OrderNote)
-def log_save(sender, instance, created, **kwargs):
-    """Log when an instance is created or updated"""
-    # Get current user and request
-    user = get_current_user()
-    request = get_current_request()
-    
-    # Skip anonymous users and no request
-    if isinstance(user, AnonymousUser) or user is None:
-        return
-    
-    # Get IP address and user agent
-    ip_address = None
-    user_agent = None
-    if request:
-        ip_address = request.META.get('REMOTE_ADDR')
-        user_agent = request.META.get('HTTP_USER_AGENT', '')
-    
-    # Get model changes
-    if created:
-        action = 'CREATE'
-        changes = instance.get_changes() if hasattr(instance, 'get_changes') else {}
-    else:
-        action = 'UPDATE'
-        # We don't have the old instance here, so we'll just log what we know
-        changes = instance.get_changes() if hasattr(instance, 'get_changes') else {}
-    
-    # Create audit log entry
-    AuditLogEntry.objects.create(
-        user=user,
-        content_type=sender.__name__,
+def build_entry(instance, action, changes):
+    """Build an unsaved AuditLogEntry for an instance in the current request context"""
+    ip_address, user_agent = get_client_info(get_current_request())
+    entry = AuditLogEntry(
+        user=get_current_user(),
+        content_type=instance.__class__.__name__,
         object_id=str(instance.pk),
-        object_repr=str(instance),
+        object_repr=str(instance)[:255],
         action=action,
         changes=changes,
         ip_address=ip_address,
-        user_agent=user_agent
+        user_agent_string=user_agent
     )
+    # Not saved; lets entries_written and entries_committed receivers reach the audited object
+    entry.instance = instance
+    return entry
 
-@receiver(post_delete, sender=Order)
-@receiver(post_delete, sender=PickupAddress)
-@receiver(post_delete, sender=DropoffAddress)
-@receiver(post_delete, sender=OrderNote)
-def log_delete(sender, instance, **kwargs):
-    """Log when an instance is deleted"""
-    # Get current user and request
+
+def stamp_save(sender, instance, update_fields=None, **kwargs):
+    """
+    Set created_by/updated_by from the current user before the row is written,
+    so the stamp goes out in the same INSERT/UPDATE as the change itself.
+    A save() with update_fields only stamps the fields it writes;
+    ChangeTrackingMixin.save() adds updated_by to them.
+    """
+    if kwargs.get('raw'):
+        return
     user = get_current_user()
-    request = get_current_request()
-    
-    # Skip anonymous users and no request
-    if isinstance(user, AnonymousUser) or user is None:
+    if user is None:
         return
-    
-    # Get IP address and user agent
-    ip_address = None
-    user_agent = None
-    if request:
-        ip_address = request.META.get('REMOTE_ADDR')
-        user_agent = request.META.get('HTTP_USER_AGENT', '')
-    
-    # Create audit log entry
-    AuditLogEntry.objects.create(
-        user=user,
-        content_type=sender.__name__,
-        object_id=str(instance.pk),
-        object_repr=str(instance),
-        action='DELETE',
-        changes={},  # We don't have the changes here
-        ip_address=ip_address,
-        user_agent=user_agent
-    )
+    if instance._state.adding and getattr(instance, 'created_by_id', None) is None \
+            and (update_fields is None or 'created_by' in update_fields):
+        instance.created_by = user
+    if hasattr(instance, 'updated_by_id') and (update_fields is None or 'updated_by' in update_fields):
+        instance.updated_by = user
+
+
+def log_save(sender, instance, created, **kwargs):
+    """Log when an instance is created or updated"""
+    if kwargs.get('raw'):
+        # Skip fixture loading
+        return
+    changes = instance.get_changes()
+    if not created and not changes:
+        # Nothing changed, nothing to record
+        return
+    audit_writer.add(build_entry(instance, 'CREATE' if created else 'UPDATE', changes))
+
+
+def log_delete(sender, instance, **kwargs):
+    """Log when an instance is deleted"""
+    audit_writer.add(build_entry(instance, 'DELETE', {}))
+
+
+def audited_update(queryset, **values):
+    """
+    Run queryset.update(**values) and write one AuditLogEntry per changed row.
+
+    The affected rows are read (and locked) with a single SELECT, updated
+    with a single UPDATE and their audit entries written with a single
+    bulk_create, all in one transaction, so the query count does not grow
+    with the number of rows. Returns the number of updated rows.
+    """
+    model = queryset.model
+    tracked = dict(get_tracked_fields(model))
+    audited = {}
+    for name, value in values.items():
+        if name not in tracked or hasattr(value, 'resolve_expression'):
+            # Expressions (F(), Case(), ...) have no known value before the UPDATE
+            continue
+        if isinstance(value, models.Model):
+            value = value.pk
+        audited[tracked[name]] = (name, value)
+
+    field_names = {field.name for field in model._meta.concrete_fields}
+    if 'updated_at' in field_names and 'updated_at' not in values:
+        values['updated_at'] = timezone.now()
+
+    with transaction.atomic(using=queryset.db):
+        # Locked in pk order, so concurrent updates cannot deadlock
+        rows = list(queryset.select_related(None).order_by('pk').select_for_update(of=('self',)))
+        if not rows:
+            return 0
+        updated = model._base_manager.using(queryset.db).filter(
+            pk__in=[row.pk for row in rows]
+        ).update(**values)
+
+        entries = []
+        for row in rows:
+            changes = {}
+            for attname, (name, new_value) in audited.items():
+                old_value = getattr(row, attname)
+                if old_value != new_value:
+                    changes[name] = {'old': old_value, 'new': new_value}
+            if changes:
+                entries.append(build_entry(row, 'UPDATE', changes))
+        AuditLogEntry.objects.bulk_create(entries, batch_size=get_audit_setting('FLUSH_SIZE'))
+        notify_entries_written(entries)
+        notify_entries_committed(entries)
+
+    return updated
+
+
+class AuditRegistry:
+    """
+    Registry of the models whose changes are written to the audit log.
+
+    Receivers are connected per registered sender, so saves of any other
+    model (sessions, audit entries themselves, ...) never reach the audit
+    code. Registering a model twice is a no-op.
+    """
+
+    def __init__(self):
+        self._models = set()
+
+    def register(self, *models):
+        for model in models:
+            if model in self._models:
+                continue
+            self._models.add(model)
+            uid = f'audit_{model._meta.label_lower}'
+            post_save.connect(log_save, sender=model, dispatch_uid=f'{uid}_save')
+            post_delete.connect(log_delete, sender=model, dispatch_uid=f'{uid}_delete')
+            if self._has_stamp_fields(model):
+                pre_save.connect(stamp_save, sender=model, dispatch_uid=f'{uid}_stamp')
+                if hasattr(model, 'stamps_updated_by'):
+                    # Lets ChangeTrackingMixin.save() add updated_by to update_fields
+                    model.stamps_updated_by = any(field.name == 'updated_by' for field in model._meta.concrete_fields)
+
+    def unregister(self, *models):
+        for model in models:
+            if model not in self._models:
+                continue
+            self._models.discard(model)
+            uid = f'audit_{model._meta.label_lower}'
+            post_save.disconnect(sender=model, dispatch_uid=f'{uid}_save')
+            post_delete.disconnect(sender=model, dispatch_uid=f'{uid}_delete')
+            pre_save.disconnect(sender=model, dispatch_uid=f'{uid}_stamp')
+            if 'stamps_updated_by' in model.__dict__:
+                del model.stamps_updated_by
+
+    @staticmethod
+    def _has_stamp_fields(model):
+        field_names = {field.name for field in model._meta.concrete_fields}
+        return bool(field_names & {'created_by', 'updated_by'})
+
+    def is_registered(self, model):
+        return model in self._models
+
+    @property
+    def models(self):
+        return frozenset(self._models)
+
+
+audit_registry = AuditRegistry()
@@ -0,0 +1,138 @@
+"""
+Test helpers for query-count regressions in the admin.
+
+Usage in a TestCase with a logged-in superuser and enough rows:
+
+    class OrderAdminTests(ChangelistQueryCountMixin, TestCase):
+        def test_changelist_queries(self):
+            self.assertChangelistQueriesConstant(Order)
+
+or assert_all_changelists_queries_constant(self.client) to check every
+registered ModelAdmin at once. get_admin_form_data() reads the POST data of
+an admin add/change form, to submit it back with some values changed.
+"""
+from html.parser import HTMLParser
+from unittest import mock
+
+from django.contrib import admin
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+def changelist_url(model, site=admin.site):
+    return reverse(f'{site.name}:{model._meta.app_label}_{model._meta.model_name}_changelist')
+
+
+def capture_changelist_queries(client, model, per_page, site=admin.site, params=None, using=DEFAULT_DB_ALIAS):
+    """Request the changelist of model with list_per_page=per_page; return (response, queries)"""
+    model_admin = site._registry[model]
+    with mock.patch.object(model_admin, 'list_per_page', per_page), \
+            CaptureQueriesContext(connections[using]) as context:
+        response = client.get(changelist_url(model, site), params or {})
+    return response, context.captured_queries
+
+
+def assert_changelist_queries_constant(client, model, small=1, large=25, site=admin.site, params=None,
+                                       using=DEFAULT_DB_ALIAS):
+    """
+    Fail when the changelist of model needs more queries for a page of
+    `large` rows than for a page of `small` rows, i.e. when some column
+    loads a relation per row. The database must hold at least `large` rows.
+    """
+    _, few = capture_changelist_queries(client, model, small, site, params, using)
+    response, many = capture_changelist_queries(client, model, large, site, params, using)
+    if response.status_code != 200:
+        raise AssertionError(f'{changelist_url(model, site)} returned {response.status_code}')
+
+    cl = response.context.get('cl') if response.context else None
+    if cl is not None and len(cl.result_list) < large:
+        raise AssertionError(
+            f'{model.__name__} changelist needs at least {large} rows, found {len(cl.result_list)}'
+        )
+
+    if len(many) > len(few):
+        extra = '\n'.join(f'  {query["sql"]}' for query in many[len(few):len(few) + 10])
+        raise AssertionError(
+            f'{model.__name__} changelist ran {len(few)} queries for {small} rows but {len(many)} '
+            f'for {large} rows; some column loads a relation per row. Queries past the first {len(few)}:\n'
+            f'{extra}'
+        )
+
+
+def assert_all_changelists_queries_constant(client, site=admin.site, large=25, using=DEFAULT_DB_ALIAS):
+    """Run assert_changelist_queries_constant for every model with at least `large` rows"""
+    for model in site._registry:
+        if model._default_manager.using(using).count() >= large:
+            assert_changelist_queries_constant(client, model, large=large, site=site, using=using)
+
+
+class ChangelistQueryCountMixin:
+    """TestCase mixin adding assertChangelistQueriesConstant()"""
+
+    def assertChangelistQueriesConstant(self, model, **kwargs):
+        assert_changelist_queries_constant(self.client, model, **kwargs)
+
+
+class _FormDataParser(HTMLParser):
+    """Collects what a browser would submit for the form with the given id"""
+
+    def __init__(self, form_id):
+        super().__init__()
+        self.form_id = form_id
+        self.in_form = False
+        self.data = []
+        self._select = None
+        self._options = []
+        self._textarea = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            self.in_form = attrs.get('id') == self.form_id
+        if not self.in_form or 'disabled' in attrs:
+            return
+        if tag == 'input' and attrs.get('name'):
+            kind = attrs.get('type', 'text')
+            if kind in ('submit', 'button', 'image', 'file', 'reset'):
+                return
+            if kind in ('checkbox', 'radio') and 'checked' not in attrs:
+                return
+            self.data.append((attrs['name'], attrs.get('value', 'on' if kind == 'checkbox' else '')))
+        elif tag == 'select' and attrs.get('name'):
+            self._select, self._options = attrs['name'], []
+        elif tag == 'option' and self._select:
+            self._options.append((attrs.get('value', ''), 'selected' in attrs))
+        elif tag == 'textarea' and attrs.get('name'):
+            self._textarea = [attrs['name'], '']
+
+    def handle_data(self, data):
+        if self._textarea:
+            self._textarea[1] += data
+
+    def handle_endtag(self, tag):
+        if tag == 'form':
+            self.in_form = False
+        elif tag == 'select' and self._select:
+            selected = [value for value, is_selected in self._options if is_selected]
+            if not selected and self._options:
+                selected = [self._options[0][0]]
+            self.data += [(self._select, value) for value in selected]
+            self._select = None
+        elif tag == 'textarea' and self._textarea:
+            # Browsers drop the newline right after <textarea>
+            self.data.append((self._textarea[0], self._textarea[1].removeprefix('\n')))
+            self._textarea = None
+
+
+def get_admin_form_data(response, model):
+    """The POST data of the admin add/change form of model in response, inlines included"""
+    parser = _FormDataParser(f'{model._meta.model_name}_form')
+    parser.feed(response.content.decode())
+    data = {}
+    for name, value in parser.data:
+        if name in data:
+            data[name] = [*data[name], value] if isinstance(data[name], list) else [data[name], value]
+        else:
+            data[name] = value
+    return data
@@ -1,3 +1,683 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from urllib.parse import parse_qsl
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib import admin
+from django.contrib.auth.models import Group, Permission
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.expressions import RawSQL
+from django.http import JsonResponse
+from django.test import TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse, reverse_lazy
+from django.utils import timezone
+
+from accounts.models import PartnerCompany, User
+from orders.models import DropoffAddress, Order, OrderState, OrderTransitionJob, PickupAddress
+
+from .admin import AuditLogEntryAdmin
+from .audit import AuditLogWriter, entries_written
+from .context import get_current_partner_company, get_current_request, get_current_user, request_context
+from .models import AuditLogEntry, UserAgent, UserAgentManager
+from .pagination import EXACT_COUNT_THRESHOLD, ApproximateCountPaginator, estimate_count
+from .signals import audited_update
+from .testing import (
+    ChangelistQueryCountMixin, assert_all_changelists_queries_constant, capture_changelist_queries,
+    get_admin_form_data,
+)
+
+
+def create_order(n=1, **values):
+    values = {
+        # Whole seconds, as the admin's date/time inputs submit them
+        'order_date': timezone.now().replace(microsecond=0),
+        'order_id': f'TEST-{n}',
+        'product_name': f'Test product {n}',
+        'total_price': Decimal('100.00'),
+        **values,
+    }
+    return Order.objects.create(**values)
+
+
+async def current_context_view(request, n):
+    # Hold every request until the test's concurrent requests are all in flight
+    await request.scope['barrier'].wait()
+    user = await sync_to_async(get_current_user)()
+    return JsonResponse({
+        'user': user.email,
+        'path': get_current_request().path,
+        'partner_company': get_current_partner_company(),
+    })
+
+
+urlpatterns = [
+    path('context/<int:n>/', current_context_view),
+]
+
+
+class ChangeTrackingTests(TestCase):
+    def test_loaded_instance_has_no_changes(self):
+        order = Order.objects.get(pk=create_order().pk)
+        self.assertEqual(order.get_changes(), {})
+        order.status = OrderState.ACCEPTED
+        self.assertEqual(order.get_changes(), {'status': {'old': OrderState.NEW, 'new': OrderState.ACCEPTED}})
+
+    def test_refresh_from_db_takes_a_new_snapshot(self):
+        order = Order.objects.get(pk=create_order().pk)
+        Order.objects.filter(pk=order.pk).update(product_name='Changed elsewhere')
+        order.refresh_from_db()
+        self.assertEqual(order.product_name, 'Changed elsewhere')
+        self.assertEqual(order.get_changes(), {})
+
+    def test_refresh_of_some_fields_keeps_other_changes(self):
+        order = Order.objects.get(pk=create_order().pk)
+        Order.objects.filter(pk=order.pk).update(product_name='Changed elsewhere')
+        order.status = OrderState.ACCEPTED
+        order.refresh_from_db(fields=['product_name'])
+        self.assertEqual(order.get_changes(), {'status': {'old': OrderState.NEW, 'new': OrderState.ACCEPTED}})
+
+    @override_settings(AUDIT_LOG={'MODE': 'sync'})
+    def test_a_save_writes_the_row_once_and_audits_only_the_changes(self):
+        order = Order.objects.get(pk=create_order(product_category='Furniture', weight=Decimal('12.50')).pk)
+        order.status = OrderState.ACCEPTED
+        with CaptureQueriesContext(connection) as context:
+            order.save()
+
+        statements = [query['sql'].split()[0] for query in context.captured_queries
+                      if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        # No SELECT of the old row and no second save to stamp it
+        self.assertEqual(statements.count('UPDATE'), 1)
+        self.assertNotIn('SELECT', statements)
+        entry = AuditLogEntry.objects.get(object_id=str(order.pk), action='UPDATE')
+        self.assertEqual(entry.changes, {'status': {'old': OrderState.NEW, 'new': OrderState.ACCEPTED}})
+
+    def test_clean_checks_the_transition_from_the_refreshed_status(self):
+        order = Order.objects.get(pk=create_order().pk)
+        Order.objects.filter(pk=order.pk).update(status=OrderState.ACCEPTED)
+        order.refresh_from_db()
+        order.status = OrderState.SHIPPED
+        # accepted -> shipped is allowed, new -> shipped would not be
+        order.clean()
+
+
+def create_address(model, order, **values):
+    values = {
+        'customer_name': 'Test Customer',
+        'address': 'Keizersgracht 1',
+        'postal_code': '1015CJ',
+        'city': 'Amsterdam',
+        'country': 'Netherlands',
+        'email': 'customer@example.com',
+        'phone_number': '+31201234567',
+        **values,
+    }
+    return model.objects.create(order=order, **values)
+
+
+class StampSaveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('staff@example.com')
+        self.other = User.objects.create_user('other@example.com')
+
+    def get_writes(self, context):
+        table = Order._meta.db_table
+        return [query['sql'].split()[0] for query in context.captured_queries
+                if query['sql'].startswith((f'INSERT INTO "{table}"', f'UPDATE "{table}"'))]
+
+    def test_new_rows_are_stamped_in_their_insert(self):
+        with request_context(user=self.user), CaptureQueriesContext(connection) as context:
+            order = create_order()
+        self.assertEqual(self.get_writes(context), ['INSERT'])
+        order = Order.objects.get(pk=order.pk)
+        self.assertEqual((order.created_by, order.updated_by), (self.user, self.user))
+
+    def test_a_creator_given_is_kept(self):
+        with request_context(user=self.user):
+            order = create_order(created_by=self.other)
+        self.assertEqual(Order.objects.get(pk=order.pk).created_by, self.other)
+
+    def test_updates_are_stamped_in_their_update(self):
+        order = create_order(created_by=self.other)
+        for update_fields in [None, ['product_name']]:
+            with self.subTest(update_fields=update_fields):
+                Order.objects.filter(pk=order.pk).update(updated_by=None)
+                order = Order.objects.get(pk=order.pk)
+                order.product_name = f'Renamed {update_fields}'
+                with request_context(user=self.user), CaptureQueriesContext(connection) as context:
+                    order.save(update_fields=update_fields)
+                self.assertEqual(self.get_writes(context), ['UPDATE'])
+                saved = Order.objects.get(pk=order.pk)
+                self.assertEqual((saved.product_name, saved.created_by, saved.updated_by),
+                                 (f'Renamed {update_fields}', self.other, self.user))
+
+    def test_saves_without_a_user_are_not_stamped(self):
+        order = create_order()
+        order.product_name = 'Renamed'
+        order.save(update_fields=['product_name'])
+        order = Order.objects.get(pk=order.pk)
+        self.assertEqual((order.created_by, order.updated_by), (None, None))
+
+
+class AuditedUpdateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('staff@example.com')
+        self.orders = [create_order(n) for n in range(5)]
+
+    def test_query_count_does_not_grow_with_the_rows(self):
+        with CaptureQueriesContext(connection) as one:
+            audited_update(Order.objects.filter(pk=self.orders[0].pk), status=OrderState.ACCEPTED)
+        with CaptureQueriesContext(connection) as many:
+            audited_update(Order.objects.exclude(pk=self.orders[0].pk), status=OrderState.ACCEPTED)
+        self.assertEqual(len(many), len(one))
+
+    def test_rows_are_stamped_and_audited_with_their_current_values(self):
+        before = timezone.now()
+        # Changed since the caller loaded them: the entries must show the values replaced
+        Order.objects.filter(pk=self.orders[1].pk).update(status=OrderState.ACCEPTED)
+        updated = audited_update(Order.objects.filter(pk__in=[self.orders[0].pk, self.orders[1].pk]),
+                                 status=OrderState.ACCEPTED, updated_by=self.user)
+
+        self.assertEqual(updated, 2)
+        for order in Order.objects.filter(pk__in=[self.orders[0].pk, self.orders[1].pk]):
+            self.assertEqual((order.status, order.updated_by), (OrderState.ACCEPTED, self.user))
+            self.assertGreaterEqual(order.updated_at, before)
+        entries = {entry.object_id: entry.changes for entry in AuditLogEntry.objects.all()}
+        self.assertEqual(entries, {
+            str(self.orders[0].pk): {'status': {'old': OrderState.NEW, 'new': OrderState.ACCEPTED},
+                                     'updated_by': {'old': None, 'new': self.user.pk}},
+            str(self.orders[1].pk): {'updated_by': {'old': None, 'new': self.user.pk}},
+        })
+
+    def test_nothing_selected_writes_nothing(self):
+        self.assertEqual(audited_update(Order.objects.none(), status=OrderState.ACCEPTED), 0)
+        self.assertFalse(AuditLogEntry.objects.exists())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'SQLite has no row locks')
+class ConcurrentAuditedUpdateTests(TransactionTestCase):
+    def test_old_values_are_read_once_a_concurrent_change_commits(self):
+        order = create_order()
+        locked = threading.Event()
+
+        def accept():
+            try:
+                with transaction.atomic():
+                    Order.objects.select_for_update().get(pk=order.pk)
+                    locked.set()
+                    # Long enough for audited_update to be waiting on the lock
+                    time.sleep(0.5)
+                    Order.objects.filter(pk=order.pk).update(status=OrderState.ACCEPTED)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=accept)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.assertTrue(locked.wait(10))
+        audited_update(Order.objects.filter(pk=order.pk), status=OrderState.SHIPPED)
+
+        entry = AuditLogEntry.objects.get(object_id=str(order.pk), action='UPDATE')
+        self.assertEqual(entry.changes, {'status': {'old': OrderState.ACCEPTED, 'new': OrderState.SHIPPED}})
+
+
+class AdminAuditTests(TransactionTestCase):
+    """Real commits: audit entries are only queued once the admin's transaction commits"""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.order = create_order()
+        create_address(PickupAddress, self.order)
+        create_address(DropoffAddress, self.order)
+
+    def test_change_form_writes_audit_entries_in_one_insert(self):
+        url = reverse('admin:orders_order_change', args=[self.order.pk])
+        data = get_admin_form_data(self.client.get(url), Order)
+        data.update({'product_name': 'Renamed product', 'pickup_address-0-city': 'Utrecht'})
+        entries = AuditLogEntry.objects.count()
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, data)
+
+        self.assertEqual(response.status_code, 302)
+        inserts = [query for query in context.captured_queries
+                   if query['sql'].startswith(f'INSERT INTO "{AuditLogEntry._meta.db_table}"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(AuditLogEntry.objects.count() - entries, 2)
+        changes = dict(AuditLogEntry.objects.filter(action='UPDATE').values_list('content_type', 'changes'))
+        self.assertEqual(changes['Order'], {
+            'product_name': {'old': 'Test product 1', 'new': 'Renamed product'},
+            'updated_by': {'old': None, 'new': self.user.pk},
+        })
+        self.assertEqual(changes['PickupAddress'], {
+            'city': {'old': 'Amsterdam', 'new': 'Utrecht'},
+            'updated_by': {'old': None, 'new': self.user.pk},
+        })
+
+
+@override_settings(ROOT_URLCONF=__name__)
+@modify_settings(MIDDLEWARE={'remove': 'debug_toolbar.middleware.DebugToolbarMiddleware'})
+class AsyncRequestContextTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.couriers = []
+        for n, partner_company in enumerate([PartnerCompany.HOEKSTRA, PartnerCompany.MAGIC_MOVERS]):
+            courier = User.objects.create_user(f'courier{n}@example.com', user_type=User.Types.COURIER)
+            # Through the cached profile: saving the user (as logging in does) saves it too
+            courier.courier_profile.partner_company = partner_company
+            courier.courier_profile.save()
+            cls.couriers.append(courier)
+
+    async def test_concurrent_requests_each_see_their_own_context(self):
+        barrier = asyncio.Barrier(len(self.couriers))
+        clients = []
+        for courier in self.couriers:
+            client = self.async_client_class(barrier=barrier)
+            await client.aforce_login(courier)
+            clients.append(client)
+
+        async with asyncio.timeout(10):
+            responses = await asyncio.gather(*[
+                client.get(f'/context/{n}/') for n, client in enumerate(clients)
+            ])
+        self.assertEqual([response.json() for response in responses], [
+            {'user': 'courier0@example.com', 'path': '/context/0/', 'partner_company': PartnerCompany.HOEKSTRA},
+            {'user': 'courier1@example.com', 'path': '/context/1/', 'partner_company': PartnerCompany.MAGIC_MOVERS},
+        ])
+        # Nothing leaks out of the requests
+        self.assertIsNone(get_current_request())
+        self.assertIsNone(get_current_partner_company())
+
+
+class AuditLogWriterTests(TransactionTestCase):
+    """Real commits: entries are only queued once their transaction commits"""
+
+    def setUp(self):
+        self.writer = AuditLogWriter()
+        self.written = []
+        entries_written.connect(self.receive)
+        self.addCleanup(entries_written.disconnect, self.receive)
+
+    def receive(self, sender, entries, **kwargs):
+        self.written.append([entry.object_id for entry in entries])
+
+    def add(self, object_id):
+        self.writer.add(AuditLogEntry(content_type='Test', object_id=object_id, object_repr='Test',
+                                      action='UPDATE', changes={}))
+
+    def get_saved(self):
+        return sorted(AuditLogEntry.objects.values_list('object_id', flat=True))
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'timed out waiting for the background flusher')
+            time.sleep(0.01)
+
+    @override_settings(AUDIT_LOG={'MODE': 'buffered'})
+    def test_entries_of_a_rolled_back_transaction_are_dropped(self):
+        with self.writer.buffering():
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.add('1')
+                raise ValueError
+            with transaction.atomic():
+                self.add('2')
+            self.assertEqual(self.get_saved(), [])
+        self.assertEqual(self.get_saved(), ['2'])
+
+    @override_settings(AUDIT_LOG={'MODE': 'buffered', 'FLUSH_SIZE': 2})
+    def test_entries_written_is_sent_once_per_flush(self):
+        with self.writer.buffering():
+            for object_id in '123':
+                with transaction.atomic():
+                    self.add(object_id)
+            self.assertEqual(self.written, [['1', '2']])
+        self.assertEqual(self.written, [['1', '2'], ['3']])
+        self.assertEqual(self.get_saved(), ['1', '2', '3'])
+
+    @override_settings(AUDIT_LOG={'MODE': 'sync'})
+    def test_sync_mode_writes_each_entry_immediately(self):
+        with self.writer.buffering(), transaction.atomic():
+            self.add('1')
+            self.assertEqual(self.get_saved(), ['1'])
+            self.add('2')
+            self.assertEqual(self.written, [['1'], ['2']])
+
+    @override_settings(AUDIT_LOG={'MODE': 'background', 'FLUSH_INTERVAL': 0})
+    def test_background_flusher_survives_a_failed_write(self):
+        bulk_create = AuditLogEntry.objects.bulk_create
+        calls = []
+
+        def fail_first(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise DatabaseError('disk full')
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(AuditLogEntry.objects, 'bulk_create', side_effect=fail_first), \
+                self.assertLogs('core.audit', 'ERROR'):
+            self.add('1')
+            self.wait_for(lambda: calls)
+            self.add('2')
+            self.wait_for(lambda: self.written)
+        self.assertTrue(self.writer._thread.is_alive())
+        # The failed batch is lost, and logged; later batches are written
+        self.assertEqual(self.get_saved(), ['2'])
+        self.assertEqual(self.written, [['2']])
+
+
+class UserAgentTests(TestCase):
+    BROWSER = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_4) AppleWebKit/605.1.15 Safari/605.1.15'
+
+    def setUp(self):
+        # The cache outlives each test's rolled back rows
+        self.addCleanup(UserAgentManager._cache.clear)
+        UserAgentManager._cache.clear()
+
+    def build_entry(self, object_id='1', user_agent=BROWSER, **values):
+        return AuditLogEntry(content_type='Order', object_id=object_id, object_repr='Order', action='UPDATE',
+                             user_agent_string=user_agent, **values)
+
+    def test_user_agents_are_stored_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            AuditLogEntry.objects.bulk_create([self.build_entry('1'), self.build_entry('2'),
+                                               self.build_entry('3', user_agent='')])
+        self.build_entry('4').save()
+
+        self.assertEqual(list(UserAgent.objects.values_list('value', flat=True)), [self.BROWSER])
+        entries = AuditLogEntry.objects.select_related('user_agent').order_by('object_id')
+        self.assertEqual([entry.user_agent_string for entry in entries], [self.BROWSER, self.BROWSER, '', self.BROWSER])
+
+    def test_known_user_agents_are_resolved_from_the_cache_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = UserAgent.objects.resolve([self.BROWSER])
+        with self.assertNumQueries(0):
+            self.assertEqual(UserAgent.objects.resolve([self.BROWSER]), ids)
+
+    def test_rolled_back_user_agents_are_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                UserAgent.objects.resolve([self.BROWSER])
+                raise ValueError
+        self.assertEqual(UserAgentManager._cache, {})
+
+        # Inserted again rather than pointing at the rolled back row
+        with self.captureOnCommitCallbacks(execute=True):
+            self.build_entry().save()
+        self.assertEqual(UserAgentManager._cache, {self.BROWSER: UserAgent.objects.get().pk})
+
+    def test_large_changes_are_compressed_and_read_back(self):
+        changes = {f'field_{n}': {'old': 'x' * 50, 'new': 'y' * 50} for n in range(20)}
+        with override_settings(AUDIT_LOG={'COMPRESS_THRESHOLD': 200}):
+            large = self.build_entry('1', changes=changes)
+            large.save()
+            small = self.build_entry('2', changes={'status': {'old': 'new', 'new': 'accepted'}})
+            small.save()
+
+        stored = dict(AuditLogEntry.objects.values_list('object_id', RawSQL('changes', [])))
+        self.assertIn('__zlib__', stored['1'])
+        self.assertNotIn('__zlib__', stored['2'])
+        # Readable whatever the current threshold
+        self.assertEqual(AuditLogEntry.objects.get(pk=large.pk).changes, changes)
+        self.assertEqual(AuditLogEntry.objects.get(pk=small.pk).changes, small.changes)
+
+
+@unittest.skipIf(connection.vendor == 'postgresql', 'PostgreSQL interns user agents with set-based SQL')
+class UserAgentMigrationTests(TransactionTestCase):
+    before = [('core', '0005_auditlogentry_indexes')]
+    after = [('core', '0006_useragent')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_existing_user_agents_are_interned(self):
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes('core'))
+        apps = self.migrate(self.before)
+        Entry = apps.get_model('core', 'AuditLogEntry')
+        for n, user_agent in enumerate(['Firefox', 'Safari', 'Firefox', '']):
+            Entry.objects.create(content_type='Order', object_id=str(n), object_repr='Order', action='UPDATE',
+                                 user_agent=user_agent)
+
+        apps = self.migrate(self.after)
+        UserAgent = apps.get_model('core', 'UserAgent')
+        Entry = apps.get_model('core', 'AuditLogEntry')
+        self.assertEqual(sorted(UserAgent.objects.values_list('value', flat=True)), ['Firefox', 'Safari'])
+        self.assertEqual(
+            list(Entry.objects.order_by('object_id').values_list('user_agent', 'user_agent_ref__value')),
+            [('Firefox', 'Firefox'), ('Safari', 'Safari'), ('Firefox', 'Firefox'), ('', None)],
+        )
+
+
+class AuditLogExportTests(TestCase):
+    url = reverse_lazy('core:audit_log_export')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin@example.com', 'password')
+        timestamp = timezone.now().replace(microsecond=0) - timedelta(days=2)
+        cls.entries = [
+            AuditLogEntry.objects.create(user=cls.user, content_type='Order', object_id='1', object_repr='Order 1',
+                                         action='UPDATE', changes={'status': {'old': 'new', 'new': 'accepted'}},
+                                         timestamp=timestamp, ip_address='10.0.0.1', user_agent_string='Firefox'),
+            AuditLogEntry.objects.create(content_type='PickupAddress', object_id='1', object_repr='Keizersgracht 1',
+                                         action='CREATE', changes={}, timestamp=timestamp + timedelta(days=1)),
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_staff_without_the_view_permission_is_refused(self):
+        staff = User.objects.create_user('staff@example.com', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        staff.user_permissions.add(Permission.objects.get(codename='view_auditlogentry'))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_bad_parameters_are_rejected(self):
+        for params in [{'date_from': 'yesterday'}, {'date_to': '2025-13-01'}, {'format': 'xml'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_ndjson_export(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertTrue(response['Content-Disposition'].endswith('.ndjson"'))
+        rows = [json.loads(line) for line in content.splitlines()]
+        first, second = self.entries
+        self.assertEqual(rows[0], {
+            'id': first.pk, 'timestamp': first.timestamp.isoformat().replace('+00:00', 'Z'),
+            'user_id': self.user.pk, 'content_type': 'Order', 'object_id': '1', 'object_repr': 'Order 1',
+            'action': 'UPDATE', 'changes': {'status': {'old': 'new', 'new': 'accepted'}},
+            'ip_address': '10.0.0.1', 'user_agent': 'Firefox',
+        })
+        self.assertEqual((rows[1]['id'], rows[1]['user_id'], rows[1]['user_agent']), (second.pk, None, None))
+
+    def test_csv_export(self):
+        response, content = self.export(format='csv', content_type='Order')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['object_repr'], 'Order 1')
+        self.assertEqual(json.loads(rows[0]['changes']), {'status': {'old': 'new', 'new': 'accepted'}})
+        self.assertEqual(rows[0]['user_agent'], 'Firefox')
+
+    def test_date_filters_include_whole_days(self):
+        day = timezone.localdate(self.entries[1].timestamp)
+        _response, content = self.export(date_from=day.isoformat(), date_to=day.isoformat())
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [self.entries[1].pk])
+
+
+class ArchiveAuditLogTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.archive_dir = Path(media_root.name) / 'audit_archive'
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+    def create_entry(self, timestamp, object_id='1'):
+        return AuditLogEntry.objects.create(content_type='Order', object_id=object_id, object_repr='Order',
+                                            action='UPDATE', changes={}, timestamp=timestamp)
+
+    def read_archive(self, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            return [json.loads(line)['object_id'] for line in archive]
+
+    def test_archiving_a_month_again_never_overwrites_its_archive(self):
+        timestamp = timezone.now() - timedelta(days=400)
+        label = timestamp.astimezone(dt_timezone.utc).strftime('%Y-%m')
+        self.create_entry(timestamp, '1')
+        call_command('archive_audit_log', retention_days=90, stdout=StringIO())
+        self.create_entry(timestamp, '2')
+        call_command('archive_audit_log', retention_days=90, stdout=StringIO())
+
+        self.assertEqual(self.read_archive(self.archive_dir / f'auditlog-{label}.ndjson.gz'), ['1'])
+        self.assertEqual(self.read_archive(self.archive_dir / f'auditlog-{label}.2.ndjson.gz'), ['2'])
+        self.assertFalse(AuditLogEntry.objects.filter(timestamp__lte=timestamp).exists())
+
+
+class AuditLogEntryAdminQueryCountTests(ChangelistQueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin@example.com', 'password')
+        for i in range(25):
+            user = User.objects.create_user(f'user{i}@example.com')
+            AuditLogEntry.objects.create(user=user, content_type='Order', object_id=str(i), object_repr=f'Order {i}',
+                                         action='UPDATE', changes={}, ip_address='10.0.0.1')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_changelist_queries(self):
+        self.assertChangelistQueriesConstant(AuditLogEntry)
+
+
+class AllChangelistsQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin@example.com', 'password')
+        permissions = list(Permission.objects.all()[:3])
+        for i in range(25):
+            courier = User.objects.create_user(f'courier{i}@example.com', user_type=User.Types.COURIER)
+            customer = User.objects.create_user(f'customer{i}@example.com', user_type=User.Types.CUSTOMER)
+            order = create_order(i, assigned_courier=courier, created_by=customer)
+            create_address(PickupAddress, order)
+            create_address(DropoffAddress, order)
+            OrderTransitionJob.objects.create(target=OrderState.DELIVERED, order_ids=[order.pk], total=1,
+                                              created_by=customer)
+            Group.objects.create(name=f'Group {i}').permissions.set(permissions)
+            AuditLogEntry.objects.create(user=customer, content_type='Order', object_id=str(order.pk),
+                                         object_repr=str(order), action='UPDATE', changes={})
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_every_changelist_has_a_constant_query_count(self):
+        # assert_all_changelists_queries_constant skips models with fewer rows
+        for model in admin.site._registry:
+            with self.subTest(model=model.__name__):
+                self.assertGreaterEqual(model._default_manager.count(), 25)
+        assert_all_changelists_queries_constant(self.client)
+
+
+class AuditLogEntryChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin@example.com', 'password')
+        timestamp = timezone.now() - timedelta(hours=1)
+        for i in range(25):
+            # Pairs of entries share a timestamp, so pages must break ties on the pk
+            AuditLogEntry.objects.create(user=cls.user if i == 7 else None, content_type='Order', object_id=str(i),
+                                         object_repr=f'Order {i:02d}', action='UPDATE', changes={},
+                                         timestamp=timestamp + timedelta(minutes=i // 2))
+        cls.newest_first = list(AuditLogEntry.objects.order_by('-timestamp', '-pk').values_list('pk', flat=True))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_changelist(self, **params):
+        response, _queries = capture_changelist_queries(self.client, AuditLogEntry, 10, params=params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def get_params(self, url):
+        return dict(parse_qsl(url.lstrip('?')))
+
+    def test_keyset_pages_walk_every_entry_once_in_both_directions(self):
+        pages = [self.get_changelist()]
+        while pages[-1].older_url:
+            pages.append(self.get_changelist(**self.get_params(pages[-1].older_url)))
+        self.assertEqual([[entry.pk for entry in cl.result_list] for cl in pages],
+                         [self.newest_first[:10], self.newest_first[10:20], self.newest_first[20:]])
+        self.assertIsNone(pages[0].newer_url)
+
+        cl = self.get_changelist(**self.get_params(pages[-1].newer_url))
+        self.assertEqual([entry.pk for entry in cl.result_list], self.newest_first[10:20])
+        cl = self.get_changelist(**self.get_params(cl.newer_url))
+        self.assertEqual([entry.pk for entry in cl.result_list], self.newest_first[:10])
+        self.assertIsNone(cl.newer_url)
+
+    def test_malformed_cursor_shows_the_first_page(self):
+        for cursor in ['garbage', '2025-03-10T12:00:00_1', '2025-03-10T12:00:00+00:00_x']:
+            with self.subTest(cursor=cursor):
+                cl = self.get_changelist(older=cursor)
+                self.assertEqual([entry.pk for entry in cl.result_list], self.newest_first[:10])
+
+    def test_sorting_on_a_column_falls_back_to_numbered_pages(self):
+        column = AuditLogEntryAdmin.list_display.index('object_repr') + 1
+        cl = self.get_changelist(o=f'-{column}', p='2')
+        self.assertFalse(cl.keyset)
+        self.assertEqual([entry.object_repr for entry in cl.result_list],
+                         [f'Order {i:02d}' for i in range(14, 4, -1)])
+
+    def test_search_on_the_user_email(self):
+        cl = self.get_changelist(q='admin@example.com')
+        self.assertEqual([entry.object_id for entry in cl.result_list], ['7'])
+
+
+class ApproximateCountPaginatorTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            AuditLogEntry.objects.create(content_type='Order', object_id=str(i), object_repr='Order',
+                                         action='UPDATE', changes={})
+        self.queryset = AuditLogEntry.objects.order_by('-timestamp', '-pk')
+
+    def test_small_results_are_counted_exactly(self):
+        paginator = ApproximateCountPaginator(self.queryset, 10)
+        self.assertEqual(paginator.count, 3)
+        self.assertFalse(paginator.is_estimate)
+
+    def test_large_results_use_the_planner_estimate(self):
+        with mock.patch('core.pagination.estimate_count', return_value=EXACT_COUNT_THRESHOLD * 5):
+            paginator = ApproximateCountPaginator(self.queryset, 10)
+            self.assertEqual(paginator.count, EXACT_COUNT_THRESHOLD * 5)
+        self.assertTrue(paginator.is_estimate)
+
+    def test_estimate_is_read_from_the_plan(self):
+        estimate = estimate_count(self.queryset)
+        if connection.vendor == 'postgresql':
+            self.assertIsInstance(estimate, int)
+        else:
+            self.assertIsNone(estimate)
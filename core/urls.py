@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import admin_dashboard
+from .views import admin_dashboard, audit_log_export
 
 app_name = 'core'
 
 urlpatterns = [
     path('dashboard/', admin_dashboard, name='admin_dashboard'),
+    path('audit-log/export/', audit_log_export, name='audit_log_export'),
 ]
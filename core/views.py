@@ -3,13 +3,21 @@ from django.shortcuts import render
 from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Count, Sum, Q
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from django.urls import reverse
+from django.http import HttpResponseBadRequest, HttpResponseForbidden
+from .exports import EXPORT_FORMATS, ExportFilterError, audit_log_export_response, filter_audit_log
+from .models import AuditLogEntry
 from orders.models import Order, OrderState
 from accounts.models import CourierProfile
 
 # Create your views here.
 
+def day_start(day):
+    """Midnight starting day in the current time zone, for index-friendly created_at ranges"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
 @staff_member_required
 def admin_dashboard(request):
     """
@@ -27,7 +35,7 @@ def admin_dashboard(request):
     orders_delivered = Order.objects.filter(status=OrderState.DELIVERED).count()
     
     # Weekly orders data
-    last_week_orders = Order.objects.filter(created_at__date__gte=week_ago)
+    last_week_orders = Order.objects.filter(created_at__gte=day_start(week_ago))
     orders_last_week = last_week_orders.count()
     
     # Orders by status
@@ -36,11 +44,11 @@ def admin_dashboard(request):
     # Orders without courier
     unassigned_orders = Order.objects.filter(assigned_courier__isnull=True).count()
     
-    # Orders by city (top 5)
-    orders_by_pickup_city = Order.objects.values('pickup_address__city').annotate(
+    # Orders by city (top 5), grouped on the orders' indexed city columns
+    orders_by_pickup_city = Order.objects.exclude(pickup_city='').values('pickup_city').annotate(
         count=Count('id')).order_by('-count')[:5]
     
-    orders_by_dropoff_city = Order.objects.values('dropoff_address__city').annotate(
+    orders_by_dropoff_city = Order.objects.exclude(dropoff_city='').values('dropoff_city').annotate(
         count=Count('id')).order_by('-count')[:5]
     
     # Orders requiring 2-man delivery
@@ -88,7 +96,8 @@ def admin_dashboard(request):
     daily_order_data = []
     for i in range(7, 0, -1):
         day = today - timedelta(days=i - 1)
-        count = Order.objects.filter(created_at__date=day).count()
+        count = Order.objects.filter(
+            created_at__gte=day_start(day), created_at__lt=day_start(day + timedelta(days=1))).count()
         daily_order_data.append({
             'date': day.strftime('%Y-%m-%d'),
             'label': day.strftime('%a'),
@@ -116,3 +125,24 @@ def admin_dashboard(request):
     }
     
     return render(request, 'admin/dashboard.html', context)
+
+
+@staff_member_required
+def audit_log_export(request):
+    """
+    Stream audit log entries as NDJSON (default) or CSV.
+    Filters: date_from, date_to, content_type, object_id; format: ndjson or csv.
+    """
+    if not request.user.has_perm('core.view_auditlogentry'):
+        return HttpResponseForbidden("You don't have permission to export the audit log.")
+    
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f'Unknown export format: {export_format}')
+    
+    try:
+        queryset = filter_audit_log(AuditLogEntry.objects.all(), request.GET)
+    except ExportFilterError as e:
+        return HttpResponseBadRequest(str(e))
+    
+    return audit_log_export_response(queryset, export_format)
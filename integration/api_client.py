@@ -0,0 +1,426 @@
+"""
+Client for the Whoppah CMS API, built on http.client so it needs no extra
+dependency.
+
+- Connections are HTTP/1.1 keep-alive and reused through a pool of at most
+  MAX_CONNECTIONS per client. A client is thread-safe; share one for a whole
+  run instead of creating one per request.
+- Idempotent requests are retried on connection errors, 429 and 5xx
+  responses with exponential backoff and jitter, honouring Retry-After.
+- List endpoints are paged with ?page=N&page_size=M and answer
+  {"count": ..., "next": ..., "results": [...]}. iter_page() streams the
+  results of a page item by item off the socket (gzip-decoded), so a page is
+  never held in memory as a whole; iter_items() walks every page in turn and
+  map_pages() processes pages in a thread pool, fetching up to
+  MAX_CONNECTIONS of them at once.
+
+Usage:
+
+    with WhoppahClient() as client:
+        for order in client.iter_orders(updated_since=since):
+            ...
+
+integration.testing.StubCMSServer stands in for the API offline.
+"""
+import base64
+import codecs
+import http.client
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode, urlsplit
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+from .exceptions import (
+    WhoppahAPIAuthenticationError,
+    WhoppahAPIConnectionError,
+    WhoppahAPIDecodeError,
+    WhoppahAPINotFound,
+    WhoppahAPIResponseError,
+)
+
+# Default client configuration, overridable through settings.WHOPPAH_API
+WHOPPAH_API_DEFAULTS = {
+    'URL': 'https://api.whoppah.com',
+    'KEY': '',
+    'SECRET': '',
+    'TIMEOUT': 30.0,        # Seconds to connect, and to wait for each read
+    'MAX_CONNECTIONS': 8,   # Pooled connections, and pages map_pages() fetches at once
+    'MAX_RETRIES': 3,       # Retries of an idempotent request
+    'BACKOFF': 0.5,         # Seconds before the first retry, doubled for every next one
+    'PAGE_SIZE': 100,       # Items requested per page
+    'WEBHOOK_SECRET': '',   # Signs incoming webhooks (see integration.webhooks)
+    'WEBHOOK_COALESCE_WINDOW': 5.0,  # Seconds webhook events wait to be merged with later ones
+}
+
+ORDERS_PATH = '/orders/'
+
+# Rate limiting and transient server errors
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+MAX_BACKOFF = 30.0
+
+# Bytes read off the socket at a time while streaming
+CHUNK_SIZE = 64 * 1024
+
+
+def get_api_setting(name):
+    """Return a Whoppah API setting, falling back to the defaults"""
+    return getattr(settings, 'WHOPPAH_API', {}).get(name, WHOPPAH_API_DEFAULTS[name])
+
+
+def get_error_class(status):
+    if status in (401, 403):
+        return WhoppahAPIAuthenticationError
+    if status == 404:
+        return WhoppahAPINotFound
+    return WhoppahAPIResponseError
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to one host. At most maxsize connections are in
+    use at a time; acquire() blocks until one is released.
+    """
+
+    def __init__(self, url, maxsize, timeout):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported API URL: {url}')
+        self.connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        )
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxsize)
+
+    def acquire(self):
+        """Return an idle connection, or a new one if none is idle"""
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def release(self, conn, reusable=True):
+        """Give a connection back; one in an unknown state must not be reused"""
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class StreamingResponse:
+    """
+    A response whose body is read incrementally. Closing it gives the
+    connection back to the pool: for reuse if the body was read to the end,
+    otherwise the connection is dropped.
+    """
+
+    def __init__(self, pool, conn, response):
+        self.pool = pool
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._conn = conn
+        self._response = response
+        self._exhausted = False
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        # wbits=47 accepts both gzip and zlib framing
+        self._decompressor = zlib.decompressobj(wbits=47) if encoding in ('gzip', 'deflate') else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, size=CHUNK_SIZE):
+        """Return the next decoded bytes of the body as they arrive, b'' at its end"""
+        while True:
+            data = self._response.read1(size)
+            if not data:
+                self._exhausted = True
+            if self._decompressor is None:
+                return data
+            if not data:
+                return self._decompressor.flush()
+            data = self._decompressor.decompress(data)
+            if data:
+                return data
+
+    def read_all(self):
+        return b''.join(iter(self.read, b''))
+
+    def json(self):
+        """Read and decode the whole body; for single resources, not pages"""
+        try:
+            return json.loads(self.read_all())
+        except ValueError as e:
+            raise WhoppahAPIDecodeError(f'Invalid JSON in the response: {e}') from e
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        # read1() does not mark a response closed at the end of its body
+        reusable = self._exhausted or self._response.isclosed()
+        self._response.close()
+        self.pool.release(conn, reusable)
+
+
+def iter_json_items(read, key='results'):
+    """
+    Yield the items of the list under key in a JSON object, read in chunks
+    with read(size), decoding each item as soon as it has fully arrived.
+    The first "key": [ in the body is taken to start the list, as in the
+    API's page envelope; what follows the list is left unread.
+    """
+    marker = re.compile(rf'"{re.escape(key)}"\s*:\s*\[')
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+
+    def fill():
+        """Append the next chunk to buffer; False at the end of the body"""
+        nonlocal buffer
+        data = read(CHUNK_SIZE)
+        buffer += text.decode(data, final=not data)
+        return bool(data)
+
+    while (match := marker.search(buffer)) is None:
+        if not fill():
+            raise WhoppahAPIDecodeError(f'No "{key}" list in the response')
+    pos = match.end()
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buffer):
+            if fill():
+                continue
+            raise WhoppahAPIDecodeError('The response ended inside the list')
+        if buffer[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            # Most likely an item cut off at the end of the chunk
+            if fill():
+                continue
+            raise WhoppahAPIDecodeError(f'Invalid JSON in the response: {e}') from e
+        if end == len(buffer) and fill():
+            # A number or literal may go on in the next chunk
+            continue
+        yield item
+        pos = end
+        if pos > CHUNK_SIZE:
+            buffer, pos = buffer[pos:], 0
+
+
+class WhoppahClient:
+    """
+    Whoppah CMS API client; arguments left out are taken from
+    settings.WHOPPAH_API. The key and secret are sent with HTTP Basic auth.
+    """
+
+    def __init__(self, url=None, api_key=None, api_secret=None, timeout=None, max_connections=None,
+                 max_retries=None, backoff=None, page_size=None):
+        self.url = (url or get_api_setting('URL')).rstrip('/')
+        self.timeout = timeout or get_api_setting('TIMEOUT')
+        self.max_connections = max_connections or get_api_setting('MAX_CONNECTIONS')
+        self.max_retries = get_api_setting('MAX_RETRIES') if max_retries is None else max_retries
+        self.backoff = get_api_setting('BACKOFF') if backoff is None else backoff
+        self.page_size = page_size or get_api_setting('PAGE_SIZE')
+        self.pool = ConnectionPool(self.url, self.max_connections, self.timeout)
+        self.base_path = urlsplit(self.url).path
+
+        self.headers = {
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip',
+            'User-Agent': 'WhoppahBridge',
+        }
+        api_key = api_key or get_api_setting('KEY')
+        if api_key:
+            api_secret = api_secret or get_api_setting('SECRET')
+            credentials = base64.b64encode(f'{api_key}:{api_secret}'.encode()).decode()
+            self.headers['Authorization'] = f'Basic {credentials}'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the idle pooled connections"""
+        self.pool.close()
+
+    def get_backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retrying: Retry-After if given, else exponential with jitter"""
+        if retry_after and retry_after.strip().isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+        delay = min(self.backoff * 2 ** attempt, MAX_BACKOFF)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def request(self, method, path, params=None, data=None):
+        """
+        Send a request and return the StreamingResponse of a successful
+        answer; close it (or use it as a context manager) to give its
+        connection back. Error statuses raise WhoppahAPIResponseError or a
+        subclass, unreachable servers WhoppahAPIConnectionError.
+        """
+        url = self.base_path + path
+        params = {name: value for name, value in (params or {}).items() if value is not None}
+        if params:
+            url += '?' + urlencode(params, doseq=True)
+        headers = dict(self.headers)
+        body = None
+        if data is not None:
+            body = json.dumps(data, cls=DjangoJSONEncoder).encode()
+            headers['Content-Type'] = 'application/json'
+
+        retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+        for attempt in itertools.count():
+            conn = self.pool.acquire()
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                response = StreamingResponse(self.pool, conn, conn.getresponse())
+            except (OSError, http.client.HTTPException) as e:
+                # Also what a keep-alive connection the server closed meanwhile raises
+                self.pool.release(conn, reusable=False)
+                if attempt >= retries:
+                    raise WhoppahAPIConnectionError(f'{method} {url}: {e!r}') from e
+                time.sleep(self.get_backoff(attempt))
+                continue
+
+            if response.status < 300:
+                return response
+            with response:
+                error_body = response.read_all().decode('utf-8', 'replace')
+            if response.status in RETRY_STATUSES and attempt < retries:
+                time.sleep(self.get_backoff(attempt, response.headers.get('Retry-After')))
+                continue
+            raise get_error_class(response.status)(response.status, response.reason, error_body)
+
+    def get_json(self, path, params=None):
+        with self.request('GET', path, params) as response:
+            return response.json()
+
+    def iter_page(self, path, page, params=None):
+        """Yield the items of one page as they arrive; nothing for a page past the last"""
+        params = {**(params or {}), 'page': page, 'page_size': self.page_size}
+        try:
+            response = self.request('GET', path, params)
+        except WhoppahAPINotFound:
+            # Asking for a page past the last answers 404
+            if page > 1:
+                return
+            raise
+        with response:
+            yield from iter_json_items(response.read)
+            # The rest of the envelope, so the connection can be reused
+            response.read_all()
+
+    def iter_items(self, path, params=None):
+        """Yield the items of every page, one page after the other"""
+        for page in itertools.count(1):
+            count = 0
+            for count, item in enumerate(self.iter_page(path, page, params), start=1):
+                yield item
+            if count < self.page_size:
+                return
+
+    def map_pages(self, func, path, params=None, max_workers=None):
+        """
+        Call func(items) for every page in a thread pool and yield the
+        results in page order. items streams the items of the page while it
+        is still being received, so func runs in the worker thread; database
+        connections it opens are closed after each page.
+
+        Up to max_workers pages (at most MAX_CONNECTIONS) are requested ahead.
+        A page with fewer than page_size items ends the run; pages requested
+        past it that turn out to hold items anyway are still processed and
+        their results yielded.
+        """
+        max_workers = min(max_workers or self.max_connections, self.max_connections)
+        with ThreadPoolExecutor(max_workers, thread_name_prefix='whoppah-api') as executor:
+            pending = {}
+            pages = itertools.count(1)
+            try:
+                for page in itertools.count(1):
+                    while len(pending) < max_workers:
+                        next_page = next(pages)
+                        pending[next_page] = executor.submit(self.process_page, func, path, next_page, params)
+                    count, result = pending.pop(page).result()
+                    if count:
+                        yield result
+                    if count < self.page_size:
+                        break
+                for page in sorted(pending):
+                    future = pending.pop(page)
+                    if not future.cancel():
+                        count, result = future.result()
+                        if count:
+                            yield result
+            finally:
+                for future in pending.values():
+                    future.cancel()
+
+    def process_page(self, func, path, page, params=None):
+        """Return (item count, func(items)) for one page; func is not called for an empty page"""
+        items = self.iter_page(path, page, params)
+        count = 0
+
+        def counted(first):
+            nonlocal count
+            for item in itertools.chain([first], items):
+                count += 1
+                yield item
+
+        try:
+            first = next(items, None)
+            if first is None:
+                return 0, None
+            stream = counted(first)
+            result = func(stream)
+            # Whatever func left unread still counts towards the page length
+            for _ in stream:
+                pass
+            return count, result
+        finally:
+            items.close()
+            connections.close_all()
+
+    def iter_orders(self, updated_since=None, **params):
+        """Yield the orders, optionally only those updated since a datetime"""
+        if updated_since is not None:
+            params['updated_since'] = updated_since.isoformat()
+        return self.iter_items(ORDERS_PATH, params)
+
+    def map_order_pages(self, func, updated_since=None, max_workers=None, **params):
+        """map_pages() over the orders, optionally only those updated since a datetime"""
+        if updated_since is not None:
+            params['updated_since'] = updated_since.isoformat()
+        return self.map_pages(func, ORDERS_PATH, params, max_workers)
+
+    def get_order(self, order_id):
+        return self.get_json(f'{ORDERS_PATH}{quote(order_id, safe="")}/')
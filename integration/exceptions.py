@@ -0,0 +1,31 @@
+"""Errors raised by the Whoppah CMS API client"""
+
+
+class WhoppahAPIError(Exception):
+    """Base class of every error raised by integration.api_client"""
+
+
+class WhoppahAPIConnectionError(WhoppahAPIError):
+    """The API could not be reached, or the connection broke, after all retries"""
+
+
+class WhoppahAPIResponseError(WhoppahAPIError):
+    """The API answered with an error status"""
+
+    def __init__(self, status, reason, body=''):
+        self.status = status
+        self.reason = reason
+        self.body = body
+        super().__init__(f'{status} {reason}: {body[:200]}' if body else f'{status} {reason}')
+
+
+class WhoppahAPIAuthenticationError(WhoppahAPIResponseError):
+    """401 or 403: the API key or secret is wrong or lacks permissions"""
+
+
+class WhoppahAPINotFound(WhoppahAPIResponseError):
+    """404 for a resource or page"""
+
+
+class WhoppahAPIDecodeError(WhoppahAPIError):
+    """The response body is not the JSON the client expected"""
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from accounts.models import User
+from core.context import request_context
+from integration.webhooks import BATCH_SIZE, WebhookProcessor
+
+
+class Command(BaseCommand):
+    help = ('Apply pending Whoppah CMS webhook events from the inbox in batches; several '
+            'workers can run side by side')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Events claimed per transaction')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new events instead of exiting once the inbox is empty')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait between polls of an empty inbox with --loop')
+        parser.add_argument('--window', type=float,
+                            help='Seconds events wait to be merged with later events of the same order '
+                                 '(default: WEBHOOK_COALESCE_WINDOW)')
+        parser.add_argument('--user', help='Email of the user the changes are recorded for')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(email__iexact=options['user']).first()
+            if user is None:
+                raise CommandError(f'Unknown user: {options["user"]}')
+
+        processor = WebhookProcessor(user=user, batch_size=max(options['batch_size'], 1), window=options['window'])
+        self.stdout.write(self.style.MIGRATE_HEADING('Processing webhook events...'))
+        start = time.perf_counter()
+        try:
+            with request_context(user=user):
+                while True:
+                    if processor.process_batch():
+                        continue
+                    if not options['loop']:
+                        break
+                    # Like the end of a request: drop connections past CONN_MAX_AGE or broken
+                    close_old_connections()
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Interrupted')
+        duration = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{processor.processed} events processed, {processor.coalesced} coalesced, {processor.failed} failed, '
+            f'{processor.retried} to retry in {duration:.1f} s'
+        ))
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from core.context import request_context
+from integration.exceptions import WhoppahAPIError
+from integration.sync import BATCH_SIZE, OrderSync
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = ('Fetch the orders updated in the Whoppah CMS since the last run and upsert the ones '
+            'whose content changed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Fetch every order and re-apply it, ignoring the watermark and content hashes')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Orders upserted per transaction')
+        parser.add_argument('--workers', type=int, help='Pages fetched concurrently (default: MAX_CONNECTIONS)')
+        parser.add_argument('--user', help='Email of the user the changes are recorded for')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Fetch and diff, then roll every batch back and keep the watermark')
+        parser.add_argument('--max-errors', type=int, default=20, help='Number of order errors printed')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(email__iexact=options['user']).first()
+            if user is None:
+                raise CommandError(f'Unknown user: {options["user"]}')
+
+        sync = OrderSync(user=user, batch_size=max(options['batch_size'], 1), full=options['full'],
+                         dry_run=options['dry_run'], max_workers=options['workers'])
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Synchronizing orders from {sync.client.url}{" (dry run)" if options["dry_run"] else ""}...'
+        ))
+        start = time.perf_counter()
+        last_report = start
+
+        def progress(sync):
+            nonlocal last_report
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                self.stdout.write(f'  {sync.fetched} orders fetched, {sync.skipped} unchanged')
+
+        with request_context(user=user), sync.client:
+            try:
+                sync.run(progress)
+            except WhoppahAPIError as e:
+                raise CommandError(f'Whoppah CMS API error: {e}')
+        duration = time.perf_counter() - start
+
+        summary = sync.get_summary()
+        self.stdout.write(self.style.SUCCESS(
+            f'{summary["fetched"]} orders fetched in {duration:.1f} s: {summary["skipped"]} skipped by hash, '
+            f'{summary["created"]} created, {summary["updated"]} updated, {summary["unchanged"]} unchanged, '
+            f'{summary["errors"]} errors; watermark {sync.watermark.isoformat() if sync.watermark else "not set"}'
+        ))
+        errors = sync.result.errors
+        for order_id, message in sorted(errors)[:options['max_errors']]:
+            self.stderr.write(f'  {order_id}: {message}')
+        if len(errors) > options['max_errors']:
+            self.stderr.write(f'  ... and {len(errors) - options["max_errors"]} more')
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('orders', '0009_address_postal_code_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncedOrder',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sync_record', serialize=False, to='orders.order')),
+                ('order_hash', models.CharField(max_length=32, verbose_name='Order Hash')),
+                ('pickup_hash', models.CharField(blank=True, max_length=32, verbose_name='Pickup Address Hash')),
+                ('dropoff_hash', models.CharField(blank=True, max_length=32, verbose_name='Dropoff Address Hash')),
+                ('synced_at', models.DateTimeField(auto_now=True, verbose_name='Synced At')),
+            ],
+            options={
+                'verbose_name': 'Synced Order',
+                'verbose_name_plural': 'Synced Orders',
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, unique=True, verbose_name='Source')),
+                ('watermark', models.DateTimeField(blank=True, null=True, verbose_name='Watermark')),
+                ('last_run_at', models.DateTimeField(blank=True, null=True, verbose_name='Last Run At')),
+                ('last_result', models.JSONField(blank=True, default=dict, verbose_name='Last Result')),
+            ],
+            options={
+                'verbose_name': 'Sync State',
+                'verbose_name_plural': 'Sync States',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(max_length=255, unique=True, verbose_name='Idempotency Key')),
+                ('event_type', models.CharField(max_length=100, verbose_name='Event Type')),
+                ('payload', models.JSONField(verbose_name='Payload')),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Received At')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('failed', 'Failed')], default='pending', max_length=20, verbose_name='Status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Processed At')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+            ],
+            options={
+                'verbose_name': 'Webhook Event',
+                'verbose_name_plural': 'Webhook Events',
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='integration_pending_idx')],
+            },
+        ),
+    ]
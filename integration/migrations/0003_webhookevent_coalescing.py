@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def set_order_ids(apps, schema_editor):
+    """Fill in order_id for the events still pending, so they coalesce like new ones"""
+    WebhookEvent = apps.get_model('integration', 'WebhookEvent')
+    events = list(WebhookEvent.objects.filter(status='pending', order_id=''))
+    for event in events:
+        data = event.payload.get('data') if isinstance(event.payload, dict) else None
+        order_id = data.get('order_id') if isinstance(data, dict) else None
+        event.order_id = str(order_id)[:50] if order_id else ''
+    WebhookEvent.objects.bulk_update(events, ['order_id'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integration', '0002_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='order_id',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Order ID'),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='superseded_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='coalesced_events', to='integration.webhookevent'),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('failed', 'Failed'), ('coalesced', 'Coalesced')], default='pending', max_length=20, verbose_name='Status'),
+        ),
+        migrations.RunPython(set_order_ids, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['order_id', 'id'], name='integration_pending_order_idx'),
+        ),
+    ]
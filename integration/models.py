@@ -0,0 +1,102 @@
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from orders.models import Order
+
+
+class SyncState(models.Model):
+    """
+    Progress of incremental synchronization from one Whoppah CMS source:
+    the next run only asks for items updated since the watermark
+    """
+    source = models.CharField(_('Source'), max_length=50, unique=True)
+    watermark = models.DateTimeField(_('Watermark'), null=True, blank=True)
+    last_run_at = models.DateTimeField(_('Last Run At'), null=True, blank=True)
+    last_result = models.JSONField(_('Last Result'), default=dict, blank=True)
+    
+    class Meta:
+        verbose_name = _('Sync State')
+        verbose_name_plural = _('Sync States')
+    
+    def __str__(self):
+        return f"{self.source} (since {self.watermark or 'the beginning'})"
+
+
+class SyncedOrder(models.Model):
+    """
+    Content hashes of the order and address data last applied from the CMS,
+    so items that come back unchanged are skipped without touching the
+    order tables
+    """
+    order = models.OneToOneField(
+        Order,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="sync_record"
+    )
+    order_hash = models.CharField(_('Order Hash'), max_length=32)
+    pickup_hash = models.CharField(_('Pickup Address Hash'), max_length=32, blank=True)
+    dropoff_hash = models.CharField(_('Dropoff Address Hash'), max_length=32, blank=True)
+    synced_at = models.DateTimeField(_('Synced At'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('Synced Order')
+        verbose_name_plural = _('Synced Orders')
+    
+    def __str__(self):
+        return f"Sync record for order {self.order_id}"
+
+
+class WebhookEvent(models.Model):
+    """
+    Inbox of Whoppah CMS webhook deliveries. Rows are only appended by the
+    webhook endpoint, which returns as soon as the row is stored;
+    process_webhooks applies them afterwards and records the outcome.
+    """
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    COALESCED = 'coalesced'
+    STATUS_CHOICES = [
+        (PENDING, _('Pending')),
+        (PROCESSED, _('Processed')),
+        (FAILED, _('Failed')),
+        (COALESCED, _('Coalesced')),
+    ]
+    
+    # The sender's event ID, or a digest of the event when it has none
+    idempotency_key = models.CharField(_('Idempotency Key'), max_length=255, unique=True)
+    event_type = models.CharField(_('Event Type'), max_length=100)
+    order_id = models.CharField(_('Order ID'), max_length=50, blank=True)
+    payload = models.JSONField(_('Payload'))
+    received_at = models.DateTimeField(_('Received At'), default=timezone.now)
+    status = models.CharField(_('Status'), max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(_('Attempts'), default=0)
+    processed_at = models.DateTimeField(_('Processed At'), null=True, blank=True)
+    error = models.TextField(_('Error'), blank=True)
+    # The later event of the same order whose merged state was applied instead
+    superseded_by = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='coalesced_events'
+    )
+    
+    class Meta:
+        verbose_name = _('Webhook Event')
+        verbose_name_plural = _('Webhook Events')
+        indexes = [
+            # The worker's queue: oldest pending events first, processed ones never scanned
+            models.Index(fields=['id'], condition=models.Q(status='pending'), name='integration_pending_idx'),
+            # The rest of a claimed order's burst
+            models.Index(
+                fields=['order_id', 'id'],
+                condition=models.Q(status='pending'),
+                name='integration_pending_order_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} {self.idempotency_key} ({self.status})"
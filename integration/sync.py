@@ -0,0 +1,273 @@
+"""
+Incremental order synchronization from the Whoppah CMS.
+
+A run only asks the API for the orders updated since the watermark kept in
+SyncState, less WATERMARK_OVERLAP to allow for clock skew and for orders
+that changed while the previous run was paging. Pages are fetched ahead in
+the client's thread pool while this thread applies them.
+
+Every order is split into its order, pickup address and dropoff address
+parts, each hashed over the columns the importer reads. SyncedOrder keeps
+the hashes last applied: parts whose hash is unchanged are left out of the
+row and orders without a changed part are skipped altogether. Webhooks may
+send partial parts (a status change, a new price): those are applied and
+leave UNKNOWN_HASH behind, so the next complete copy is applied again, and
+parts an item leaves out keep their stored hash. The rest goes
+through orders.imports.OrderImporter (bulk upserts plus audit entries) with
+the new hashes, in one transaction per batch. A sync that finds nothing new
+costs one SELECT per batch and the update of the SyncState row. Edits made
+locally since are kept until the CMS changes the order again; --full
+re-applies everything.
+
+The watermark only moves once every page has been applied: to the newest
+updated_at seen, but never past the start of the run nor past the oldest
+order that failed to apply, so the next run fetches that order again. A
+failed run is repeated, cheaply, by the next one.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from orders.imports import (
+    ADDRESS_FIELDS, ADDRESS_MODELS, BATCH_SIZE, ORDER_FIELDS, REQUIRED_FIELDS, OrderImporter, flatten_row,
+)
+from orders.models import Order
+
+from .api_client import WhoppahClient
+from .models import SyncedOrder, SyncState
+
+ORDER_SOURCE = 'orders'
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+ORDER_COLUMNS = tuple(field.name for field in ORDER_FIELDS)
+ADDRESS_COLUMNS = tuple(field.name for field in ADDRESS_FIELDS)
+# A part carrying all of these is a complete copy from the CMS; webhooks may send fewer
+REQUIRED_ORDER_COLUMNS = REQUIRED_FIELDS
+REQUIRED_ADDRESS_COLUMNS = tuple(field.name for field in ADDRESS_FIELDS if not field.blank)
+# The stored hash of a part last applied from a partial payload: it matches nothing
+UNKNOWN_HASH = ''
+
+
+def content_hash(values):
+    """Hex digest of a canonical JSON rendering of values, for change detection only"""
+    data = json.dumps(values, sort_keys=True, cls=DjangoJSONEncoder).encode()
+    return hashlib.md5(data, usedforsecurity=False).hexdigest()
+
+
+def split_item(item):
+    """Return (order values, {prefix: address values}) of an API order, limited to the imported columns"""
+    row = flatten_row(dict(item))
+    values = {name: row[name] for name in ORDER_COLUMNS if name in row}
+    addresses = {
+        prefix: {name: row[f'{prefix}_{name}'] for name in ADDRESS_COLUMNS if f'{prefix}_{name}' in row}
+        for prefix in ADDRESS_MODELS
+    }
+    return values, addresses
+
+
+def get_part_hash(values, required, key=()):
+    """
+    The content hash of a complete part, UNKNOWN_HASH for a partial one
+    and None when the item leaves the part out (only the key columns)
+    """
+    if not values.keys() - set(key):
+        return None
+    if not all(name in values for name in required):
+        return UNKNOWN_HASH
+    return content_hash(values)
+
+
+def min_datetime(*values):
+    """The earliest of the values that are not None, or None"""
+    return min((value for value in values if value is not None), default=None)
+
+
+def get_updated_at(item):
+    value = item.get('updated_at')
+    updated_at = parse_datetime(value) if isinstance(value, str) else None
+    if updated_at is not None and timezone.is_naive(updated_at):
+        updated_at = timezone.make_aware(updated_at)
+    return updated_at
+
+
+class OrderApplier:
+    """
+    Applies API order payloads in batches, skipping the parts whose content
+    hash is unchanged since they were last applied. full=True applies every
+    part an item carries; the importer still only writes what differs from
+    the database.
+    """
+
+    def __init__(self, user=None, batch_size=BATCH_SIZE, full=False, dry_run=False):
+        # Not in dry-run mode itself: a batch is rolled back here, hashes included
+        self.importer = OrderImporter(user=user, batch_size=batch_size)
+        self.result = self.importer.result
+        self.batch_size = batch_size
+        self.full = full
+        self.dry_run = dry_run
+        self.skipped = 0
+
+    def apply_batch(self, items):
+        """
+        Upsert the orders of a batch whose content changed, and their new
+        hashes. Returns {order_id: error} for the orders that failed.
+        """
+        errors = len(self.result.errors)
+        parts = {}
+        for item in items:
+            order_id = item.get('order_id') if isinstance(item, dict) else None
+            if not order_id:
+                self.result.errors.append(('?', f'No order_id: {str(item)[:100]}'))
+                continue
+            values, addresses = split_item(item)
+            hashes = (get_part_hash(values, REQUIRED_ORDER_COLUMNS, key=('order_id',)),) + tuple(
+                get_part_hash(addresses[prefix], REQUIRED_ADDRESS_COLUMNS) for prefix in ADDRESS_MODELS
+            )
+            # A later copy of the same order in the batch wins
+            parts[str(order_id)] = (values, addresses, hashes)
+
+        # Also with full=True: the hashes of parts an item leaves out are kept
+        stored = {
+            order_id: tuple(hashes) for order_id, *hashes in SyncedOrder.objects.filter(
+                order__order_id__in=list(parts)
+            ).values_list('order__order_id', 'order_hash', 'pickup_hash', 'dropoff_hash')
+        }
+
+        rows, hashes = [], {}
+        for order_id, (values, addresses, item_hashes) in parts.items():
+            previous = stored.get(order_id) or (None,) * len(item_hashes)
+            # A partial part is always applied: what it leaves out is not known to match
+            changed = [
+                item_hash is not None and (self.full or item_hash == UNKNOWN_HASH or item_hash != previous_hash)
+                for item_hash, previous_hash in zip(item_hashes, previous)
+            ]
+            if not any(changed):
+                self.skipped += 1
+                continue
+            row = dict(values) if changed[0] else {'order_id': order_id}
+            for prefix, address_changed in zip(ADDRESS_MODELS, changed[1:]):
+                if address_changed:
+                    row[f'{prefix}_address'] = addresses[prefix]
+            # The order ID doubles as the "line" of import errors
+            rows.append((order_id, row))
+            hashes[order_id] = tuple(
+                (previous_hash or UNKNOWN_HASH) if item_hash is None else item_hash
+                for item_hash, previous_hash in zip(item_hashes, previous)
+            )
+        if not rows:
+            return dict(self.result.errors[errors:])
+
+        self.result.rows += len(rows)
+        with transaction.atomic():
+            self.importer.import_batch(rows)
+            for order_id, _ in self.result.errors[errors:]:
+                hashes.pop(order_id, None)
+            self.write_hashes(hashes)
+            if self.dry_run:
+                transaction.set_rollback(True)
+        return dict(self.result.errors[errors:])
+
+    def write_hashes(self, hashes):
+        if not hashes:
+            return
+        pks = dict(Order.objects.filter(order_id__in=list(hashes)).values_list('order_id', 'pk'))
+        SyncedOrder.objects.bulk_create(
+            [
+                SyncedOrder(order_id=pks[order_id], order_hash=order_hash, pickup_hash=pickup_hash,
+                            dropoff_hash=dropoff_hash)
+                for order_id, (order_hash, pickup_hash, dropoff_hash) in hashes.items() if order_id in pks
+            ],
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=['order'],
+            update_fields=['order_hash', 'pickup_hash', 'dropoff_hash', 'synced_at'],
+        )
+
+
+class OrderSync:
+    """
+    One synchronization run. full=True ignores the watermark, and the stored
+    hashes in OrderApplier.
+    """
+
+    def __init__(self, client=None, user=None, batch_size=BATCH_SIZE, full=False, dry_run=False,
+                 max_workers=None, source=ORDER_SOURCE):
+        self.client = client or WhoppahClient()
+        self.applier = OrderApplier(user=user, batch_size=batch_size, full=full, dry_run=dry_run)
+        self.result = self.applier.result
+        self.batch_size = batch_size
+        self.full = full
+        self.dry_run = dry_run
+        self.max_workers = max_workers
+        self.source = source
+        self.fetched = 0
+        self.watermark = None
+
+    @property
+    def skipped(self):
+        return self.applier.skipped
+
+    def run(self, progress=None):
+        """Fetch and apply the changed orders; progress(sync) is called after each batch"""
+        state, _ = SyncState.objects.get_or_create(source=self.source)
+        started_at = timezone.now()
+        since = None
+        if state.watermark and not self.full:
+            since = state.watermark - WATERMARK_OVERLAP
+        newest = oldest_failed = None
+
+        batch = []
+        # Each page is read into a list in its worker thread and applied here, in page order
+        for page in self.client.map_order_pages(list, updated_since=since, max_workers=self.max_workers):
+            for item in page:
+                self.fetched += 1
+                batch.append(item)
+                updated_at = get_updated_at(item) if isinstance(item, dict) else None
+                if updated_at and (newest is None or updated_at > newest):
+                    newest = updated_at
+            if len(batch) >= self.batch_size:
+                oldest_failed = min_datetime(oldest_failed, self.apply(batch))
+                batch = []
+                if progress:
+                    progress(self)
+        if batch:
+            oldest_failed = min_datetime(oldest_failed, self.apply(batch))
+            if progress:
+                progress(self)
+
+        self.watermark = state.watermark
+        if newest is not None:
+            # Never past the start of the run, nor past an order that failed: the next run fetches it again
+            newest = min_datetime(newest, started_at, oldest_failed)
+            if self.watermark is None or newest > self.watermark:
+                self.watermark = newest
+        if not self.dry_run:
+            state.watermark = self.watermark
+            state.last_run_at = started_at
+            state.last_result = self.get_summary()
+            state.save(update_fields=['watermark', 'last_run_at', 'last_result'])
+        return self
+
+    def apply(self, batch):
+        """Apply a batch; returns the oldest updated_at of its orders that failed, if any"""
+        errors = self.applier.apply_batch(batch)
+        failed = [
+            get_updated_at(item) for item in batch
+            if isinstance(item, dict) and str(item.get('order_id')) in errors
+        ]
+        return min_datetime(*failed)
+
+    def get_summary(self):
+        return {
+            'fetched': self.fetched,
+            'skipped': self.skipped,
+            'created': self.result.created,
+            'updated': self.result.updated,
+            'unchanged': self.result.unchanged,
+            'errors': len(self.result.errors),
+        }
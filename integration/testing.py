@@ -0,0 +1,188 @@
+"""
+A stand-in for the Whoppah CMS API, to exercise the client offline.
+
+    with StubCMSServer([make_order_payload(n) for n in range(250)]) as server:
+        client = WhoppahClient(url=server.url, page_size=100)
+        assert len(list(client.iter_orders())) == 250
+        assert server.connections == 1
+
+The server speaks HTTP/1.1 keep-alive and pages /orders/ like the API,
+gzips responses when asked to, and counts the connections it accepted and
+the requests it served. fail_next(2, 503) makes the next two requests fail,
+to exercise retries; delay slows every response down, to exercise
+concurrency.
+"""
+import gzip
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from orders.models import OrderState
+
+from .api_client import ORDERS_PATH
+
+
+def make_order_payload(n, **overrides):
+    """An order as the API returns it, in the field layout of the order import"""
+    now = timezone.now().replace(microsecond=0)
+    payload = {
+        'order_id': f'WH-{n:06d}',
+        'order_date': (now - timedelta(hours=n)).isoformat(),
+        'product_name': f'Vintage chair {n}',
+        'product_category': 'Chairs',
+        'weight': '12.50',
+        'number_of_parcels': 1,
+        'total_price': f'{100 + n % 900}.00',
+        'status': OrderState.NEW,
+        'updated_at': now.isoformat(),
+        'pickup_address': {
+            'customer_name': f'Seller {n}',
+            'address': f'Keizersgracht {n % 500 + 1}',
+            'postal_code': f'{1000 + n % 9000}AB',
+            'city': 'Amsterdam',
+            'country': 'Netherlands',
+            'email': f'seller{n}@example.com',
+            'phone_number': '+31201234567',
+        },
+        'dropoff_address': {
+            'customer_name': f'Buyer {n}',
+            'address': f'Rue Neuve {n % 300 + 1}',
+            'postal_code': f'{1000 + n % 9000}',
+            'city': 'Brussels',
+            'country': 'Belgium',
+            'email': f'buyer{n}@example.com',
+            'phone_number': '+3221234567',
+        },
+    }
+    payload.update(overrides)
+    return payload
+
+
+class StubCMSRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; don't hold the body back on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.stub.connection_opened()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        failure = stub.request_received(self.path)
+        if stub.delay:
+            time.sleep(stub.delay)
+        if failure:
+            return self.send_json(failure, {'detail': 'Stub failure.'}, {'Retry-After': '0'})
+        if stub.credentials and self.headers.get('Authorization') != stub.credentials:
+            return self.send_json(401, {'detail': 'Invalid credentials.'})
+
+        parts = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+        if parts.path == ORDERS_PATH:
+            return self.send_order_page(params)
+        if parts.path.startswith(ORDERS_PATH):
+            order = stub.orders.get(unquote(parts.path[len(ORDERS_PATH):].strip('/')))
+            if order is not None:
+                return self.send_json(200, order)
+        self.send_json(404, {'detail': 'Not found.'})
+
+    def send_order_page(self, params):
+        orders = self.server.stub.get_orders(params.get('updated_since'))
+        page, page_size = int(params.get('page', 1)), int(params.get('page_size', 100))
+        start = (page - 1) * page_size
+        if page > 1 and start >= len(orders):
+            return self.send_json(404, {'detail': 'Invalid page.'})
+        following = None
+        if start + page_size < len(orders):
+            following = f'{ORDERS_PATH}?{urlencode({**params, "page": page + 1})}'
+        self.send_json(200, {
+            'count': len(orders),
+            'next': following,
+            'results': orders[start:start + page_size],
+        })
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, cls=DjangoJSONEncoder).encode()
+        headers = dict(headers or {})
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubCMSServer:
+    """Serves orders (payloads like make_order_payload's) on a free local port from a thread"""
+
+    def __init__(self, orders=(), credentials=None, delay=0):
+        self.orders = {order['order_id']: order for order in orders}
+        # The expected Authorization header, if any
+        self.credentials = credentials
+        self.delay = delay
+        self.connections = 0
+        self.requests = []
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), StubCMSRequestHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def fail_next(self, count, status=503):
+        """Answer the next count requests with status"""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections += 1
+
+    def request_received(self, path):
+        """Record a request; returns the status to fail it with, if any"""
+        with self._lock:
+            self.requests.append(path)
+            return self._failures.pop(0) if self._failures else None
+
+    def get_orders(self, updated_since=None):
+        orders = sorted(self.orders.values(), key=lambda order: (order['updated_at'], order['order_id']))
+        if updated_since:
+            since = parse_datetime(updated_since)
+            orders = [order for order in orders if parse_datetime(order['updated_at']) > since]
+        return orders
@@ -0,0 +1,305 @@
+import hashlib
+import hmac
+import json
+import threading
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from orders.models import Order, OrderState
+
+from .api_client import ORDERS_PATH, WhoppahClient
+from .exceptions import WhoppahAPIResponseError
+from .models import SyncedOrder, SyncState, WebhookEvent
+from .sync import ORDER_SOURCE, UNKNOWN_HASH, WATERMARK_OVERLAP, OrderApplier, OrderSync
+from .testing import StubCMSServer, make_order_payload
+from .webhooks import SIGNATURE_HEADER, WebhookProcessor
+
+
+class WhoppahClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = StubCMSServer([make_order_payload(n) for n in range(250)])
+        self.enterContext(self.server)
+        self.client = WhoppahClient(url=self.server.url, page_size=100, backoff=0)
+        self.addCleanup(self.client.close)
+
+    def test_pages_are_fetched_over_one_reused_connection(self):
+        orders = list(self.client.iter_orders())
+        self.assertEqual(len(orders), 250)
+        self.assertEqual(len({order['order_id'] for order in orders}), 250)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_503_is_retried(self):
+        self.server.fail_next(2, 503)
+        self.assertEqual(len(list(self.client.iter_orders())), 250)
+        self.assertEqual(len(self.server.requests), 5)
+        # Error responses are read to the end, so the connection is kept
+        self.assertEqual(self.server.connections, 1)
+
+    def test_503_is_raised_once_the_retries_are_used_up(self):
+        self.server.fail_next(3, 503)
+        client = WhoppahClient(url=self.server.url, max_retries=2, backoff=0)
+        self.addCleanup(client.close)
+        with self.assertRaises(WhoppahAPIResponseError) as context:
+            client.get_order('WH-000001')
+        self.assertEqual(context.exception.status, 503)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_gzipped_responses_are_decoded(self):
+        with self.client.request('GET', f'{ORDERS_PATH}WH-000007/') as response:
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(response.json()['order_id'], 'WH-000007')
+
+    def test_map_pages_yields_results_in_page_order(self):
+        pages = list(self.client.map_order_pages(lambda items: [item['order_id'] for item in items],
+                                                 max_workers=4))
+        self.assertEqual([len(page) for page in pages], [100, 100, 50])
+        self.assertEqual([order_id for page in pages for order_id in page],
+                         [order['order_id'] for order in self.server.get_orders()])
+
+    def test_map_pages_stops_after_a_full_last_page(self):
+        for n in range(200, 250):
+            del self.server.orders[f'WH-{n:06d}']
+        pages = list(self.client.map_order_pages(lambda items: sum(1 for _ in items), max_workers=2))
+        self.assertEqual(pages, [100, 100])
+
+
+class OrderSyncTests(TestCase):
+    def setUp(self):
+        self.server = StubCMSServer([make_order_payload(n) for n in range(30)])
+        self.enterContext(self.server)
+        self.client = WhoppahClient(url=self.server.url, page_size=10, backoff=0)
+        self.addCleanup(self.client.close)
+
+    def sync(self, **kwargs):
+        return OrderSync(client=self.client, batch_size=20, **kwargs).run()
+
+    def test_sync_imports_the_orders_then_skips_them_while_unchanged(self):
+        sync = self.sync()
+        self.assertEqual(sync.result.errors, [])
+        self.assertEqual(sync.result.created, 30)
+        self.assertEqual(Order.objects.filter(status=OrderState.NEW).count(), 30)
+
+        sync = self.sync()
+        self.assertEqual(sync.fetched, 30)
+        self.assertEqual(sync.skipped, 30)
+        self.assertEqual(sync.result.rows, 0)
+
+    def set_orders(self, *updated_ats, **overrides):
+        self.server.orders = {}
+        for n, updated_at in enumerate(updated_ats):
+            payload = make_order_payload(n, updated_at=updated_at.isoformat(), **overrides)
+            self.server.orders[payload['order_id']] = payload
+
+    def test_runs_fetch_from_the_watermark_less_the_overlap(self):
+        watermark = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        SyncState.objects.create(source=ORDER_SOURCE, watermark=watermark)
+        self.set_orders(watermark - WATERMARK_OVERLAP - timedelta(minutes=1),
+                        watermark - WATERMARK_OVERLAP + timedelta(minutes=1),
+                        watermark + timedelta(minutes=1))
+        sync = self.sync()
+        self.assertEqual(sync.fetched, 2)
+        self.assertEqual(sync.watermark, watermark + timedelta(minutes=1))
+        self.assertEqual(SyncState.objects.get().watermark, sync.watermark)
+
+    def test_watermark_never_passes_the_start_of_the_run(self):
+        started = timezone.now()
+        self.set_orders(started + timedelta(hours=1))
+        sync = self.sync()
+        self.assertEqual(sync.fetched, 1)
+        self.assertGreaterEqual(sync.watermark, started)
+        self.assertLess(sync.watermark, started + timedelta(minutes=1))
+
+    def test_orders_that_failed_are_fetched_again(self):
+        now = timezone.now().replace(microsecond=0)
+        failed_at, applied_at = now - timedelta(hours=2), now - timedelta(hours=1)
+        self.set_orders(failed_at, applied_at)
+        self.server.orders['WH-000000']['status'] = 'BOGUS'
+        sync = self.sync()
+        self.assertEqual([order_id for order_id, _error in sync.result.errors], ['WH-000000'])
+        self.assertEqual(sync.watermark, failed_at)
+
+        # Fixed on our side (a new status, say) without the CMS editing the order
+        self.server.orders['WH-000000']['status'] = OrderState.NEW
+        sync = self.sync()
+        self.assertEqual(sync.result.errors, [])
+        self.assertEqual(sync.result.created, 1)
+        self.assertEqual(sync.skipped, 1)
+        self.assertEqual(sync.watermark, applied_at)
+
+
+class OrderApplierTests(TestCase):
+    def setUp(self):
+        self.payload = make_order_payload(1)
+        self.apply(self.payload)
+        self.synced = self.get_hashes()
+
+    def apply(self, *items):
+        applier = OrderApplier()
+        errors = applier.apply_batch(items)
+        self.assertEqual(errors, {})
+        return applier
+
+    def get_hashes(self):
+        return SyncedOrder.objects.values_list('order_hash', 'pickup_hash', 'dropoff_hash').get()
+
+    def test_partial_payload_leaves_the_hashes_of_other_parts(self):
+        self.apply({'order_id': self.payload['order_id'], 'status': OrderState.ACCEPTED})
+        self.assertEqual(Order.objects.get().status, OrderState.ACCEPTED)
+        self.assertEqual(self.get_hashes(), (UNKNOWN_HASH, *self.synced[1:]))
+
+        applier = self.apply({**self.payload, 'status': OrderState.ACCEPTED})
+        # Only the order part is applied again, and it is complete again
+        self.assertEqual(applier.result.unchanged, 1)
+        self.assertNotIn(self.get_hashes()[0], (UNKNOWN_HASH, self.synced[0]))
+        self.assertEqual(self.get_hashes()[1:], self.synced[1:])
+
+    def test_complete_payload_after_a_partial_one_is_applied(self):
+        self.apply({'order_id': self.payload['order_id'], 'status': OrderState.ACCEPTED})
+        # The CMS state is the first payload again: its hash is the one stored before
+        applier = self.apply(self.payload)
+        self.assertEqual(applier.skipped, 0)
+        self.assertEqual(Order.objects.get().status, OrderState.NEW)
+        self.assertEqual(self.get_hashes(), self.synced)
+
+    def test_partial_address_is_applied_and_leaves_its_hash_unknown(self):
+        self.apply({'order_id': self.payload['order_id'], 'pickup_address': {'city': 'Utrecht'}})
+        self.assertEqual(Order.objects.get().pickup_city, 'Utrecht')
+        self.assertEqual(self.get_hashes(), (self.synced[0], UNKNOWN_HASH, self.synced[2]))
+
+
+class WebhookCoalescingTests(TestCase):
+    def setUp(self):
+        self.payload = make_order_payload(1)
+        self.server = StubCMSServer([self.payload])
+        self.enterContext(self.server)
+        self.client = WhoppahClient(url=self.server.url, backoff=0)
+        self.addCleanup(self.client.close)
+        self.sync()
+        self.synced = SyncedOrder.objects.values_list('order_hash', 'pickup_hash', 'dropoff_hash').get()
+
+    def sync(self):
+        sync = OrderSync(client=self.client).run()
+        self.assertEqual(sync.result.errors, [])
+        return sync
+
+    def receive(self, key, **data):
+        return WebhookEvent.objects.create(idempotency_key=key, event_type='order.updated',
+                                           order_id=self.payload['order_id'],
+                                           payload={'id': key, 'data': {'order_id': self.payload['order_id'], **data}})
+
+    def test_coalesced_status_and_price_events_then_resync(self):
+        status_event = self.receive('evt-1', status=OrderState.ACCEPTED)
+        price_event = self.receive('evt-2', total_price='250.00')
+        processor = WebhookProcessor(window=0)
+        self.assertEqual(processor.process_batch(), 2)
+
+        status_event.refresh_from_db()
+        price_event.refresh_from_db()
+        self.assertEqual((status_event.status, status_event.superseded_by), (WebhookEvent.COALESCED, price_event))
+        self.assertEqual(price_event.status, WebhookEvent.PROCESSED)
+        self.assertEqual(processor.applier.result.rows, 1)
+        order = Order.objects.get()
+        self.assertEqual((order.status, order.total_price), (OrderState.ACCEPTED, Decimal('250.00')))
+        # The merged event is still partial: the order part is unknown, the addresses untouched
+        self.assertEqual(SyncedOrder.objects.values_list('order_hash', 'pickup_hash', 'dropoff_hash').get(),
+                         (UNKNOWN_HASH, *self.synced[1:]))
+
+        # The CMS now has both changes; only the order part is applied again, and changes nothing
+        self.server.orders[self.payload['order_id']] = {**self.payload, 'status': OrderState.ACCEPTED,
+                                                        'total_price': '250.00'}
+        sync = self.sync()
+        self.assertEqual((sync.skipped, sync.result.unchanged), (0, 1))
+        self.assertEqual(self.sync().skipped, 1)
+
+
+@override_settings(WHOPPAH_API={'WEBHOOK_SECRET': 'webhook-secret'})
+class WebhookEndpointTests(TestCase):
+    def post(self, events, secret='webhook-secret', **headers):
+        body = json.dumps(events).encode()
+        if secret:
+            headers[SIGNATURE_HEADER] = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post(reverse('integration:whoppah_webhook'), body, content_type='application/json',
+                                headers=headers)
+
+    def event(self, key, order_id='WH-000001'):
+        return {'id': key, 'type': 'order.updated', 'data': {'order_id': order_id, 'status': OrderState.ACCEPTED}}
+
+    def test_events_are_stored_and_acknowledged(self):
+        response = self.post([self.event('evt-1'), self.event('evt-2', 'WH-000002')])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'accepted': 2})
+        self.assertEqual(list(WebhookEvent.objects.order_by('pk').values_list('idempotency_key', 'order_id', 'status')),
+                         [('evt-1', 'WH-000001', WebhookEvent.PENDING), ('evt-2', 'WH-000002', WebhookEvent.PENDING)])
+
+    def test_missing_or_bad_signature_is_rejected(self):
+        for secret in ['', 'other-secret']:
+            with self.subTest(secret=secret):
+                response = self.post(self.event('evt-1'), secret=secret)
+                self.assertEqual(response.status_code, 403)
+                self.assertEqual(response.json(), {'detail': 'Invalid signature.'})
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_redelivered_event_is_acknowledged_and_stored_once(self):
+        self.post(self.event('evt-1'))
+        response = self.post([self.event('evt-1'), self.event('evt-2')])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(list(WebhookEvent.objects.order_by('pk').values_list('idempotency_key', flat=True)),
+                         ['evt-1', 'evt-2'])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'SQLite has no row locks to skip')
+class WebhookClaimTests(TransactionTestCase):
+    def receive(self, key, order_id):
+        return WebhookEvent.objects.create(idempotency_key=key, event_type='order.updated', order_id=order_id,
+                                           payload={'id': key, 'data': {'order_id': order_id}})
+
+    def lock(self, *events):
+        """Hold row locks on events from another connection until the test ends"""
+        locked, release = threading.Event(), threading.Event()
+
+        def worker():
+            try:
+                with transaction.atomic():
+                    list(WebhookEvent.objects.select_for_update().filter(pk__in=[event.pk for event in events]))
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        self.assertTrue(locked.wait(10))
+
+    def claim(self, **kwargs):
+        with transaction.atomic():
+            return [event.idempotency_key for event in WebhookProcessor(window=0, **kwargs).claim()]
+
+    def test_events_locked_by_another_worker_are_skipped(self):
+        first = self.receive('evt-1', 'WH-000001')
+        self.receive('evt-2', 'WH-000002')
+        self.lock(first)
+        self.assertEqual(self.claim(), ['evt-2'])
+
+    def test_orders_with_locked_older_events_are_passed_over(self):
+        first = self.receive('evt-1', 'WH-000001')
+        self.receive('evt-2', 'WH-000001')
+        self.receive('evt-3', 'WH-000001')
+        self.receive('evt-4', 'WH-000002')
+        self.lock(first)
+        # The first candidates all belong to the blocked order; the claim moves on past them
+        self.assertEqual(self.claim(batch_size=2), ['evt-4'])
+
+    def test_nothing_is_claimed_while_every_order_is_blocked(self):
+        first = self.receive('evt-1', 'WH-000001')
+        self.receive('evt-2', 'WH-000001')
+        self.lock(first)
+        self.assertEqual(self.claim(), [])
@@ -0,0 +1,8 @@
+from django.urls import path
+from .webhooks import whoppah_webhook
+
+app_name = 'integration'
+
+urlpatterns = [
+    path('webhooks/whoppah/', whoppah_webhook, name='whoppah_webhook'),
+]
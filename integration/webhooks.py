@@ -0,0 +1,236 @@
+"""
+Whoppah CMS webhooks.
+
+The endpoint only verifies and stores: it checks the HMAC-SHA256 signature
+of the body against WEBHOOK_SECRET, appends the events to the WebhookEvent
+inbox with a single INSERT that ignores idempotency keys it already has (a
+redelivered event is acknowledged again, not stored twice) and answers 202.
+
+Applying them - order upserts, address writes, audit entries - is left to
+process_webhooks. Its WebhookProcessor claims pending events in batches with
+SELECT ... FOR UPDATE SKIP LOCKED, so several workers drain the inbox in
+parallel without waiting on each other's batches, and applies each order's
+burst of events as one merged upsert. SQLite has no row locks; run a single
+worker there.
+
+Events look like {"id": "...", "type": "order.updated", "data": {...}}, the
+data being an order in the layout of the API (see integration.sync); a
+delivery may also be a list of events.
+"""
+import hashlib
+import hmac
+import json
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from orders.imports import flatten_row
+from orders.models import Order
+
+from .api_client import get_api_setting
+from .models import WebhookEvent
+from .sync import OrderApplier
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Whoppah-Signature'
+UPSERT_EVENTS = ('order.created', 'order.updated')
+DELETE_EVENTS = ('order.deleted',)
+
+# Events claimed per transaction by the worker
+BATCH_SIZE = 100
+# Attempts before an event that keeps raising is marked failed
+MAX_ATTEMPTS = 5
+
+
+def verify_signature(body, signature, secret):
+    """Check a hex HMAC-SHA256 of the body, optionally prefixed with "sha256=" """
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.removeprefix('sha256='))
+
+
+def get_idempotency_key(event):
+    if event.get('id'):
+        return str(event['id'])[:255]
+    return 'sha256:' + hashlib.sha256(json.dumps(event, sort_keys=True).encode()).hexdigest()
+
+
+def get_order_id(event):
+    """The order an event is about, by which process_webhooks coalesces events"""
+    data = event.get('data')
+    order_id = data.get('order_id') if isinstance(data, dict) else None
+    return str(order_id)[:50] if order_id else ''
+
+
+@csrf_exempt
+@require_POST
+def whoppah_webhook(request):
+    """Store the delivered events in the inbox and acknowledge them"""
+    if not verify_signature(request.body, request.headers.get(SIGNATURE_HEADER, ''),
+                            get_api_setting('WEBHOOK_SECRET')):
+        return JsonResponse({'detail': 'Invalid signature.'}, status=403)
+    try:
+        events = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid JSON.'}, status=400)
+    if isinstance(events, dict):
+        events = [events]
+    if not isinstance(events, list) or not all(
+            isinstance(event, dict) and isinstance(event.get('type'), str) for event in events):
+        return JsonResponse({'detail': 'Expected an event or a list of events.'}, status=400)
+
+    WebhookEvent.objects.bulk_create(
+        [
+            WebhookEvent(idempotency_key=get_idempotency_key(event), event_type=event['type'][:100],
+                         order_id=get_order_id(event), payload=event)
+            for event in events
+        ],
+        ignore_conflicts=True,
+    )
+    return JsonResponse({'accepted': len(events)}, status=202)
+
+
+class WebhookProcessor:
+    """
+    Applies pending inbox events a batch at a time, coalescing the events of
+    each order into one upsert of their merged state. Keeps one OrderApplier
+    (and so one importer with its courier cache) for its whole run.
+
+    Only events at least window seconds old are claimed, together with
+    every other pending event of the same orders however recent, so a burst
+    of updates is applied once. The events merged into a later one are
+    marked coalesced, pointing at it. An order with older events locked by
+    another worker is left for a later batch, so its states are never
+    applied out of order.
+    """
+
+    def __init__(self, user=None, batch_size=BATCH_SIZE, window=None):
+        self.batch_size = batch_size
+        self.window = get_api_setting('WEBHOOK_COALESCE_WINDOW') if window is None else window
+        self.applier = OrderApplier(user=user, batch_size=batch_size)
+        self.processed = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.retried = 0
+
+    def claim(self):
+        """
+        Lock and return the next events to apply, in id order. Candidates of
+        blocked orders are passed over for later ones, so an empty list means
+        no event is ready.
+        """
+        pending = WebhookEvent.objects.select_for_update(skip_locked=True).filter(status=WebhookEvent.PENDING)
+        cutoff = timezone.now() - timedelta(seconds=self.window)
+        candidates = pending.filter(received_at__lte=cutoff).order_by('pk')
+        blocked = set()
+        while True:
+            events = list(candidates.exclude(order_id__in=blocked)[:self.batch_size])
+            if not events:
+                return events
+            order_ids = {event.order_id for event in events if event.order_id}
+            if not order_ids:
+                return events
+            events += pending.filter(order_id__in=order_ids).exclude(pk__in=[event.pk for event in events])
+
+            newest = {}
+            for event in events:
+                if event.order_id:
+                    newest[event.order_id] = max(event.pk, newest.get(event.order_id, 0))
+            # Pending events of these orders that are not ours are locked by another worker
+            blocked.update(
+                order_id for order_id, pk in WebhookEvent.objects.filter(
+                    status=WebhookEvent.PENDING, order_id__in=order_ids
+                ).exclude(pk__in=[event.pk for event in events]).values_list('order_id', 'pk')
+                if pk < newest[order_id]
+            )
+            events = [event for event in events if event.order_id not in blocked]
+            if events:
+                return sorted(events, key=lambda event: event.pk)
+
+    def process_batch(self):
+        """Claim, apply and mark a batch of events; returns how many were handled, 0 when none are ready"""
+        with transaction.atomic():
+            events = self.claim()
+            if not events:
+                return 0
+            retry_error = None
+            try:
+                with transaction.atomic():
+                    errors, superseded = self.apply(events)
+            except Exception as e:
+                logger.exception('Applying webhook events %s to %s failed', events[0].pk, events[-1].pk)
+                errors, superseded, retry_error = {}, {}, repr(e)
+
+            now = timezone.now()
+            for event in events:
+                event.attempts += 1
+                event.processed_at = now
+                # A superseded event shares the fate of the event it was merged into
+                event.superseded_by_id = superseded.get(event.pk)
+                event.error = retry_error or errors.get(event.superseded_by_id or event.pk, '')
+                if retry_error and event.attempts < MAX_ATTEMPTS:
+                    event.status = WebhookEvent.PENDING
+                    event.superseded_by_id = None
+                    self.retried += 1
+                elif event.error:
+                    event.status = WebhookEvent.FAILED
+                    self.failed += 1
+                elif event.superseded_by_id:
+                    event.status = WebhookEvent.COALESCED
+                    self.coalesced += 1
+                else:
+                    event.status = WebhookEvent.PROCESSED
+                    self.processed += 1
+            WebhookEvent.objects.bulk_update(
+                events, ['status', 'attempts', 'processed_at', 'error', 'superseded_by']
+            )
+        return len(events)
+
+    def apply(self, events):
+        """
+        Apply the final state of every order among events. Returns
+        ({event pk: error}, {superseded event pk: pk of the event applied in its place}).
+        """
+        errors, superseded, bursts = {}, {}, {}
+        for event in events:
+            data = event.payload.get('data')
+            if not isinstance(data, dict) or not data.get('order_id'):
+                errors[event.pk] = 'No order_id in the event data'
+            elif event.event_type not in UPSERT_EVENTS + DELETE_EVENTS:
+                errors[event.pk] = f'Unsupported event type: {event.event_type}'
+            else:
+                bursts.setdefault(str(data['order_id']), []).append(event)
+
+        deletes, upserts = [], {}
+        for order_id, burst in bursts.items():
+            deleted = [index for index, event in enumerate(burst) if event.event_type in DELETE_EVENTS]
+            if deleted:
+                # Nothing before the last deletion matters
+                deletes.append(order_id)
+                for event in burst[:deleted[-1]]:
+                    superseded[event.pk] = burst[deleted[-1]].pk
+                burst = burst[deleted[-1] + 1:]
+            if burst:
+                final = burst[-1]
+                merged = {}
+                for event in burst:
+                    merged.update(flatten_row(dict(event.payload['data'])))
+                    if event is not final:
+                        superseded[event.pk] = final.pk
+                upserts[order_id] = (final, merged)
+
+        if deletes:
+            Order.objects.filter(order_id__in=deletes).delete()
+        if upserts:
+            order_errors = self.applier.apply_batch([merged for _, merged in upserts.values()])
+            for order_id, error in order_errors.items():
+                if order_id in upserts:
+                    errors[upserts[order_id][0].pk] = error
+        return errors, superseded
@@ -1,36 +1,31 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils.translation import gettext_lazy as _
-from django.urls import path
-from django.http import HttpResponse
+from django.urls import path, reverse
 from django.template.response import TemplateResponse
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
+from django.utils.formats import date_format
+from django.utils.timezone import localtime
 from django.contrib.admin import SimpleListFilter
-from django.db.models import Q
-import csv
-from datetime import datetime
-from .models import Order, PickupAddress, DropoffAddress, OrderNote, OrderState
+from django.utils.dateparse import parse_date
+from accounts.models import PartnerCompany
+from core.context import get_current_partner_company
+from .exports import order_export_response
+from .search import search_orders
+from .transitions import get_bulk_action_setting, queue_transition, transition_orders
+from .statistics import WEIGHT_CLASSES, get_order_statistics
+from .models import Order, PickupAddress, DropoffAddress, OrderNote, OrderState, OrderHistoryEvent, OrderTransitionJob
 
 class WeightFilter(SimpleListFilter):
     title = _('Weight')
     parameter_name = 'weight'
     
     def lookups(self, request, model_admin):
-        return (
-            ('light', _('Light (0-5kg)')),
-            ('medium', _('Medium (5-20kg)')),
-            ('heavy', _('Heavy (20-50kg)')),
-            ('very_heavy', _('Very Heavy (50kg+)')),
-        )
+        return [(code, label) for code, label, _condition in WEIGHT_CLASSES]
     
     def queryset(self, request, queryset):
-        if self.value() == 'light':
-            return queryset.filter(weight__lte=5)
-        if self.value() == 'medium':
-            return queryset.filter(weight__gt=5, weight__lte=20)
-        if self.value() == 'heavy':
-            return queryset.filter(weight__gt=20, weight__lte=50)
-        if self.value() == 'very_heavy':
-            return queryset.filter(weight__gt=50)
+        for code, _label, condition in WEIGHT_CLASSES:
+            if self.value() == code:
+                return queryset.filter(condition)
         return queryset
 
 class TwoManDeliveryFilter(SimpleListFilter):
@@ -99,13 +94,17 @@ class OrderNoteInline(admin.TabularInline):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('order_id', 'product_name_display', 'order_date', 'status_badge', 'weight_display', 
-                    'assigned_courier_display', 'pickup_city', 'dropoff_city', 'two_man_delivery_icon')
+                    'assigned_courier_display', 'pickup_city_display', 'dropoff_city_display', 'two_man_delivery_icon')
     list_filter = ('status', 'order_date', WeightFilter, TwoManDeliveryFilter, CourierFilter)
-    search_fields = ('order_id', 'product_name', 'pickup_address__customer_name', 'pickup_address__city',
-                     'dropoff_address__customer_name', 'dropoff_address__city')
+    # Searched through orders.search, see get_search_results
+    search_fields = ('order_id', 'product_name', 'pickup_address__customer_name', 'pickup_city',
+                     'dropoff_address__customer_name', 'dropoff_city')
+    search_help_text = _('Order ID, product, customer names, cities, postal codes and notes')
     date_hierarchy = 'order_date'
     list_per_page = 25
-    actions = ['export_as_csv', 'mark_as_accepted', 'mark_as_shipped', 'mark_as_delivered', 'mark_as_canceled']
+    # Joined into the changelist query for assigned_courier_display; the cities are Order columns
+    list_select_related = ('assigned_courier',)
+    actions = ['export_as_csv', 'export_as_csv_gz', 'export_with_addresses_as_csv', 'export_with_addresses_as_csv_gz', 'mark_as_accepted', 'mark_as_shipped', 'mark_as_delivered', 'mark_as_canceled']
     
     fieldsets = (
         (_('Order Information'), {
@@ -124,15 +123,26 @@ class OrderAdmin(admin.ModelAdmin):
             'fields': ('created_by', 'created_at', 'updated_by', 'updated_at'),
             'classes': ('collapse',)
         }),
+        (_('History'), {
+            'fields': ('history_timeline',),
+            'classes': ('collapse',)
+        }),
     )
     
-    readonly_fields = ('created_by', 'created_at', 'updated_by', 'updated_at')
+    readonly_fields = ('created_by', 'created_at', 'updated_by', 'updated_at', 'history_timeline')
     inlines = [PickupAddressInline, DropoffAddressInline, OrderNoteInline]
     save_on_top = True
     
     class Media:
         js = ('admin/js/order_admin.js',)
     
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search through orders.search: order ID and postal code lookups first,
+        then the search documents. Neither joins, so no DISTINCT is needed.
+        """
+        return search_orders(queryset, search_term), False
+    
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
@@ -141,31 +151,35 @@ class OrderAdmin(admin.ModelAdmin):
         return custom_urls + urls
     
     def order_statistics_view(self, request):
+        try:
+            date_from = parse_date(request.GET.get('date_from') or '')
+            date_to = parse_date(request.GET.get('date_to') or '')
+        except ValueError:
+            # Well-formed but impossible dates such as 2025-02-30
+            date_from = date_to = None
+        partner_company = request.GET.get('partner_company') or None
+        if partner_company not in PartnerCompany.values:
+            partner_company = None
+        # Partner users only ever see their own company's orders
+        partner_company = get_current_partner_company() or partner_company
+        
+        statistics = get_order_statistics(date_from, date_to, partner_company)
         context = {
             **self.admin_site.each_context(request),
             'title': _('Order Statistics'),
-            'orders_by_status': self._get_orders_by_status(),
-            'orders_by_weight': self._get_orders_by_weight(),
-            'two_man_delivery_count': Order.objects.filter(two_man_delivery=True).count(),
+            'orders_by_status': statistics['orders_by_status'],
+            'orders_by_status_total': statistics['total'],
+            'orders_by_weight': statistics['orders_by_weight'],
+            'orders_by_weight_total': sum(statistics['orders_by_weight'].values()),
+            'two_man_delivery_count': statistics['two_man_delivery_count'],
+            'date_from': date_from,
+            'date_to': date_to,
+            'partner_company': partner_company,
+            'partner_companies': PartnerCompany.choices,
             'opts': self.model._meta,
         }
         return TemplateResponse(request, 'admin/orders/order/order_statistics.html', context)
     
-    def _get_orders_by_status(self):
-        result = {}
-        for status_code, status_name in OrderState.CHOICES:
-            result[status_name] = Order.objects.filter(status=status_code).count()
-        return result
-    
-    def _get_orders_by_weight(self):
-        result = {
-            _('Light (0-5kg)'): Order.objects.filter(weight__lte=5).count(),
-            _('Medium (5-20kg)'): Order.objects.filter(weight__gt=5, weight__lte=20).count(),
-            _('Heavy (20-50kg)'): Order.objects.filter(weight__gt=20, weight__lte=50).count(),
-            _('Very Heavy (50kg+)'): Order.objects.filter(weight__gt=50).count(),
-        }
-        return result
-    
     def product_name_display(self, obj):
         if obj.product_url:
             return format_html('<a href="{}" target="_blank">{}</a>', obj.product_url, obj.product_name)
@@ -199,24 +213,42 @@ class OrderAdmin(admin.ModelAdmin):
     
     def assigned_courier_display(self, obj):
         if obj.assigned_courier:
-            return format_html('<span class="courier-tag">{}</span>', obj.assigned_courier.get_full_name() or obj.assigned_courier.username)
+            return format_html('<span class="courier-tag">{}</span>', obj.assigned_courier.get_full_name() or obj.assigned_courier.email)
         return format_html('<span class="unassigned-tag">-</span>')
     assigned_courier_display.short_description = _('Courier')
     assigned_courier_display.admin_order_field = 'assigned_courier'
     
-    def pickup_city(self, obj):
-        try:
-            return obj.pickup_address.city
-        except PickupAddress.DoesNotExist:
-            return '-'
-    pickup_city.short_description = _('Pickup City')
+    def pickup_city_display(self, obj):
+        return obj.pickup_city or '-'
+    pickup_city_display.short_description = _('Pickup City')
+    pickup_city_display.admin_order_field = 'pickup_city'
     
-    def dropoff_city(self, obj):
-        try:
-            return obj.dropoff_address.city
-        except DropoffAddress.DoesNotExist:
+    def dropoff_city_display(self, obj):
+        return obj.dropoff_city or '-'
+    dropoff_city_display.short_description = _('Dropoff City')
+    dropoff_city_display.admin_order_field = 'dropoff_city'
+    
+    def history_timeline(self, obj):
+        """The order's history, including its addresses and notes, from one indexed query"""
+        if not obj.pk:
             return '-'
-    dropoff_city.short_description = _('Dropoff City')
+        # The admin template renders readonly fields more than once
+        if not hasattr(obj, '_history_events'):
+            obj._history_events = list(OrderHistoryEvent.objects.for_order(obj))
+        events = obj._history_events
+        rows = format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>', (
+            (date_format(localtime(event.timestamp), 'DATETIME_FORMAT'), event.user or '-',
+             event.get_action_display(), event.object_repr, event.describe_changes())
+            for event in events
+        ))
+        if not rows:
+            return _('No history recorded yet.')
+        return format_html(
+            '<table class="order-history"><thead><tr><th>{}</th><th>{}</th><th>{}</th><th>{}</th><th>{}</th></tr>'
+            '</thead><tbody>{}</tbody></table>',
+            _('When'), _('User'), _('Action'), _('Object'), _('Changes'), rows
+        )
+    history_timeline.short_description = _('Order History')
     
     def two_man_delivery_icon(self, obj):
         if obj.two_man_delivery:
@@ -224,44 +256,69 @@ class OrderAdmin(admin.ModelAdmin):
         return ''
     two_man_delivery_icon.short_description = ''
     
+    def transition_selected(self, request, queryset, target):
+        """
+        Move the selected orders to target in short chunked transactions, or
+        queue a job for process_order_transitions if there are too many
+        """
+        threshold = get_bulk_action_setting('BACKGROUND_THRESHOLD')
+        if threshold and queryset[:threshold + 1].count() > threshold:
+            job = queue_transition(queryset, target, user=request.user)
+            url = reverse('admin:orders_ordertransitionjob_change', args=[job.pk])
+            self.message_user(request, format_html(
+                _('{} orders queued for a background job, <a href="{}">#{}</a>.'), job.total, url, job.pk
+            ))
+            return
+        result = transition_orders(queryset, target, user=request.user,
+                                   chunk_size=get_bulk_action_setting('CHUNK_SIZE'))
+        label = dict(OrderState.CHOICES)[target]
+        self.message_user(request, _(f"{len(result.changed)} orders marked as {label.lower()}."))
+        if result.rejected:
+            self.message_user(
+                request,
+                _(f"{len(result.rejected)} orders were left unchanged: their status does not allow it."),
+                messages.WARNING,
+            )
+        if result.skipped:
+            self.message_user(
+                request,
+                _(f"{len(result.skipped)} orders were skipped as they were being changed elsewhere; "
+                  f"run the action again to move them."),
+                messages.WARNING,
+            )
+    
     def mark_as_accepted(self, request, queryset):
-        updated = queryset.update(status=OrderState.ACCEPTED, updated_by=request.user)
-        self.message_user(request, _(f"{updated} orders marked as accepted."))
+        self.transition_selected(request, queryset, OrderState.ACCEPTED)
     mark_as_accepted.short_description = _("Mark selected orders as accepted")
     
     def mark_as_shipped(self, request, queryset):
-        updated = queryset.update(status=OrderState.SHIPPED, updated_by=request.user)
-        self.message_user(request, _(f"{updated} orders marked as shipped."))
+        self.transition_selected(request, queryset, OrderState.SHIPPED)
     mark_as_shipped.short_description = _("Mark selected orders as shipped")
     
     def mark_as_delivered(self, request, queryset):
-        updated = queryset.update(status=OrderState.DELIVERED, updated_by=request.user)
-        self.message_user(request, _(f"{updated} orders marked as delivered."))
+        self.transition_selected(request, queryset, OrderState.DELIVERED)
     mark_as_delivered.short_description = _("Mark selected orders as delivered")
     
     def mark_as_canceled(self, request, queryset):
-        updated = queryset.update(status=OrderState.CANCELED, updated_by=request.user)
-        self.message_user(request, _(f"{updated} orders marked as canceled."))
+        self.transition_selected(request, queryset, OrderState.CANCELED)
     mark_as_canceled.short_description = _("Mark selected orders as canceled")
     
     def export_as_csv(self, request, queryset):
-        meta = self.model._meta
-        field_names = [field.name for field in meta.fields]
-        
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename={meta.verbose_name_plural.lower()}-{datetime.now().strftime("%Y%m%d")}.csv'
-        writer = csv.writer(response)
-        
-        # Write header row
-        writer.writerow(field_names)
-        
-        # Write data rows
-        for obj in queryset:
-            writer.writerow([getattr(obj, field) for field in field_names])
-            
-        return response
+        return order_export_response(queryset)
     export_as_csv.short_description = _("Export selected orders as CSV")
     
+    def export_as_csv_gz(self, request, queryset):
+        return order_export_response(queryset, compress=True)
+    export_as_csv_gz.short_description = _("Export selected orders as gzipped CSV")
+    
+    def export_with_addresses_as_csv(self, request, queryset):
+        return order_export_response(queryset, include_addresses=True)
+    export_with_addresses_as_csv.short_description = _("Export selected orders with addresses as CSV")
+    
+    def export_with_addresses_as_csv_gz(self, request, queryset):
+        return order_export_response(queryset, include_addresses=True, compress=True)
+    export_with_addresses_as_csv_gz.short_description = _("Export selected orders with addresses as gzipped CSV")
+    
     def save_model(self, request, obj, form, change):
         """Set the created_by and updated_by fields when saved from admin"""
         if not change:  # New object
@@ -284,3 +341,32 @@ class OrderAdmin(admin.ModelAdmin):
             obj.delete()
         
         formset.save_m2m()
+
+
+@admin.register(OrderTransitionJob)
+class OrderTransitionJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'target', 'status', 'progress', 'changed', 'rejected', 'skipped',
+                    'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'target')
+    list_select_related = ('created_by',)
+    readonly_fields = ('target', 'status', 'progress', 'total', 'changed', 'rejected', 'skipped', 'skipped_ids',
+                       'error', 'created_by', 'created_at', 'started_at', 'heartbeat_at', 'finished_at')
+    # order_ids can hold tens of thousands of ids
+    exclude = ('order_ids',)
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('order_ids')
+    
+    def progress(self, obj):
+        return f"{obj.done} / {obj.total}"
+    progress.short_description = _('Progress')
+    
+    def skipped(self, obj):
+        return len(obj.skipped_ids)
+    skipped.short_description = _('Skipped')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
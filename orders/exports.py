@@ -0,0 +1,53 @@
+"""
+Streaming CSV export of orders.
+
+Related users are exported through explicit joins in values_list() and
+rows are read with iterator(), so an export costs a single query (one per
+chunk on backends without server-side cursors) and memory stays flat
+however many orders are selected.
+"""
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from core.exports import CHUNK_SIZE, iter_csv_chunks, iter_gzip
+
+from .locations import LOCATION_COLUMNS
+from .models import Order
+
+ADDRESS_FIELDS = ('customer_name', 'address', 'postal_code', 'city', 'country', 'phone_number', 'email')
+
+
+def get_export_columns(include_addresses=False):
+    """Return [(header, values_list lookup)] for an order export"""
+    columns = []
+    for field in Order._meta.fields:
+        if field.name in LOCATION_COLUMNS:
+            continue
+        if field.is_relation:
+            # Users are exported by email, which is also their str()
+            columns.append((field.name, f'{field.name}__email'))
+        else:
+            columns.append((field.name, field.name))
+    if include_addresses:
+        for prefix in ('pickup', 'dropoff'):
+            columns += [(f'{prefix}_{name}', f'{prefix}_address__{name}') for name in ADDRESS_FIELDS]
+    return columns
+
+
+def iter_order_csv(queryset, include_addresses=False, chunk_size=CHUNK_SIZE):
+    columns = get_export_columns(include_addresses)
+    rows = queryset.order_by('pk').values_list(*(lookup for _, lookup in columns)).iterator(chunk_size=chunk_size)
+    return iter_csv_chunks([header for header, _ in columns], rows, chunk_size)
+
+
+def order_export_response(queryset, include_addresses=False, compress=False):
+    """Return a StreamingHttpResponse with the orders as CSV, optionally gzipped"""
+    chunks = iter_order_csv(queryset, include_addresses)
+    filename = f'{Order._meta.verbose_name_plural.lower()}-{timezone.now():%Y%m%d}.csv'
+    if compress:
+        response = StreamingHttpResponse(iter_gzip(chunks), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
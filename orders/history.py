@@ -0,0 +1,49 @@
+"""
+Incremental maintenance of OrderHistoryEvent from the audit log.
+
+Every batch of audit entries written by core.audit is turned into history
+events for the entries that belong to an order (the order itself, its
+addresses and its notes) and stored with a single bulk_create.
+"""
+from .models import Order, PickupAddress, DropoffAddress, OrderNote, OrderHistoryEvent
+
+ORDER_CHILD_MODELS = (PickupAddress, DropoffAddress, OrderNote)
+HISTORY_CONTENT_TYPES = {model.__name__ for model in (Order, *ORDER_CHILD_MODELS)}
+
+
+def get_order_id(entry):
+    """Return the id of the order an audit entry belongs to, or None"""
+    if entry.content_type not in HISTORY_CONTENT_TYPES:
+        return None
+    if entry.content_type == Order.__name__:
+        # Not instance.pk, which Django clears once a delete is done
+        return int(entry.object_id)
+    instance = getattr(entry, 'instance', None)
+    if isinstance(instance, ORDER_CHILD_MODELS):
+        return instance.order_id
+    return None
+
+
+def build_event(entry, order_id):
+    return OrderHistoryEvent(
+        order_id=order_id,
+        timestamp=entry.timestamp,
+        user_id=entry.user_id,
+        content_type=entry.content_type,
+        object_id=entry.object_id,
+        object_repr=entry.object_repr,
+        action=entry.action,
+        changes=entry.changes,
+        audit_entry_id=entry.pk,
+    )
+
+
+def record_order_history(sender, entries, **kwargs):
+    """entries_written receiver storing the history events of a batch of audit entries"""
+    events = []
+    for entry in entries:
+        order_id = get_order_id(entry)
+        if order_id is not None:
+            events.append(build_event(entry, order_id))
+    if events:
+        OrderHistoryEvent.objects.bulk_create(events)
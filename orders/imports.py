@@ -0,0 +1,313 @@
+"""
+Bulk import of orders, the inverse of orders.exports.
+
+Rows use the column names of the order export (with addresses): the Order
+field names plus pickup_<field> and dropoff_<field> for the address
+fields, with the courier given by email. JSONL rows may nest the addresses
+as "pickup_address" / "dropoff_address" objects instead.
+
+Rows are upserted on order_id a batch at a time, in one transaction per
+batch: one SELECT loads the existing orders and one their addresses, then
+Order and both address tables are written with
+bulk_create(update_conflicts=True) and the audit entries with a single
+bulk_create. Unchanged rows are not written at all, so reconciling a file
+that is mostly in sync is cheap. Model signals do not run for bulk writes;
+what they would do (partner company from the courier, created_by /
+updated_by, audit entries, the order's copy of the address locations) is
+done here for the whole batch.
+"""
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import User
+from core.audit import get_audit_setting, notify_entries_committed, notify_entries_written
+from core.context import get_current_user
+from core.models import AuditLogEntry
+from core.signals import build_entry
+
+from .locations import LOCATION_COLUMNS, refresh_locations
+from .models import Order, PickupAddress, DropoffAddress
+
+# Set by the importer or the database, never taken from the input
+SKIPPED_FIELDS = ('id', 'created_by', 'updated_by', 'created_at', 'updated_at')
+
+ORDER_FIELDS = tuple(
+    field for field in Order._meta.concrete_fields if field.name not in SKIPPED_FIELDS + LOCATION_COLUMNS
+)
+ADDRESS_MODELS = {'pickup': PickupAddress, 'dropoff': DropoffAddress}
+ADDRESS_FIELDS = tuple(
+    field for field in PickupAddress._meta.concrete_fields if field.name not in SKIPPED_FIELDS + ('order',)
+)
+
+# Required to create an order; updates may leave any column out
+REQUIRED_FIELDS = ('order_id', 'order_date', 'product_name', 'total_price')
+
+BATCH_SIZE = 1000
+
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+
+class ImportRowError(ValueError):
+    """Raised for an input row that cannot be imported"""
+
+
+class ImportResult:
+    """Counters of an import run"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []
+
+
+def iter_csv_rows(file):
+    """Yield (line number, row) from a CSV file with a header row"""
+    reader = csv.DictReader(file)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_jsonl_rows(file):
+    """Yield (line number, row) from a file with one JSON object per line"""
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            # Reported like any other bad row by OrderImporter.import_batch
+            row = e
+        yield line, row
+
+
+def flatten_row(row):
+    """Turn nested "pickup_address" / "dropoff_address" objects into prefixed columns"""
+    for prefix in ADDRESS_MODELS:
+        nested = row.pop(f'{prefix}_address', None)
+        if isinstance(nested, dict):
+            row.update({f'{prefix}_{name}': value for name, value in nested.items()})
+    return row
+
+
+def convert(field, value):
+    """
+    Convert an input value to the field's Python type and validate it
+    (choices, max_length, the field's validators); '' counts as missing
+    """
+    if value is None or value == '':
+        if field.null:
+            return None
+        if field.has_default():
+            return field.get_default()
+        if field.empty_strings_allowed:
+            return ''
+        raise ValidationError('This field cannot be empty.')
+    # Bulk writes skip full_clean(), so this is the only check the value gets
+    value = field.clean(value, None)
+    if field.get_internal_type() == 'DateTimeField' and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+class OrderImporter:
+    """
+    Upserts batches of order rows. Keeps the couriers it has looked up, so
+    one importer should be used for a whole run.
+    """
+
+    def __init__(self, user=None, batch_size=BATCH_SIZE, dry_run=False):
+        self.user = user or get_current_user()
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.result = ImportResult()
+        self._couriers = {}
+
+    def run(self, rows, progress=None):
+        """Import an iterable of (line number, row dict); progress(result) is called after each batch"""
+        batch = []
+        for line, row in rows:
+            self.result.rows += 1
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+                if progress:
+                    progress(self.result)
+        if batch:
+            self.import_batch(batch)
+            if progress:
+                progress(self.result)
+        return self.result
+
+    def get_courier(self, value):
+        """Return (id, partner company) of a courier given by email or id"""
+        if value not in self._couriers:
+            lookup = {'pk': int(value)} if str(value).isdigit() else {'email__iexact': value}
+            courier = User.objects.filter(**lookup).values_list('pk', 'courier_profile__partner_company').first()
+            if courier is None:
+                raise ImportRowError(f'Unknown courier: {value}')
+            self._couriers[value] = courier
+        return self._couriers[value]
+
+    def parse_row(self, row):
+        """Return (order values, {prefix: address values}) for one input row"""
+        row = flatten_row(dict(row))
+        columns = [(None, field, field.name) for field in ORDER_FIELDS]
+        columns += [(prefix, field, f'{prefix}_{field.name}') for prefix in ADDRESS_MODELS for field in ADDRESS_FIELDS]
+        values, addresses = {}, {}
+        for prefix, field, column in columns:
+            if column not in row:
+                continue
+            target = values if prefix is None else addresses.setdefault(prefix, {})
+            try:
+                if field.name == 'assigned_courier' and prefix is None:
+                    target[field.attname] = self.get_courier(row[column])[0] if row[column] else None
+                else:
+                    target[field.attname] = convert(field, row[column])
+            except ValidationError as e:
+                raise ImportRowError(f'{column}: {"; ".join(e.messages)}')
+        if not values.get('order_id'):
+            raise ImportRowError('order_id is required')
+        return values, addresses
+
+    def import_batch(self, batch):
+        parsed = {}
+        for line, row in batch:
+            try:
+                if not isinstance(row, dict):
+                    raise ImportRowError(f'Not an object: {row}')
+                values, addresses = self.parse_row(row)
+            except ImportRowError as e:
+                self.result.errors.append((line, str(e)))
+                continue
+            if values['order_id'] in parsed:
+                # Later rows for the same order update it, as they would row by row
+                _, previous_values, previous_addresses = parsed[values['order_id']]
+                values = {**previous_values, **values}
+                for prefix, address in previous_addresses.items():
+                    addresses[prefix] = {**address, **addresses.get(prefix, {})}
+            parsed[values['order_id']] = (line, values, addresses)
+        if not parsed:
+            return
+
+        with transaction.atomic():
+            self.write(parsed)
+            if self.dry_run:
+                transaction.set_rollback(True)
+
+    def write(self, parsed):
+        existing = Order.objects.in_bulk(list(parsed), field_name='order_id')
+        orders = []
+        for order_id, (line, values, addresses) in parsed.items():
+            order = existing.get(order_id)
+            if order is None:
+                missing = [name for name in REQUIRED_FIELDS if values.get(name) in (None, '')]
+                if missing:
+                    self.result.errors.append((line, f'missing {", ".join(missing)} for a new order'))
+                    continue
+                order = Order(**values)
+            else:
+                for attname, value in values.items():
+                    setattr(order, attname, value)
+            self.set_partner_company(order)
+            orders.append(order)
+
+        # Sets of order_id: unsaved instances are not hashable
+        new_orders = {order.order_id for order in orders if order.pk is None}
+        changed_orders = {order.order_id for order in orders if order.pk is None or order.get_changes()}
+        entries = self.write_orders([order for order in orders if order.order_id in changed_orders], new_orders)
+
+        # Addresses of the orders that already existed, one query per table
+        existing_pks = [order.pk for order in orders if order.order_id not in new_orders]
+        located = set()
+        for prefix, model in ADDRESS_MODELS.items():
+            current = {address.order_id: address for address in model.objects.filter(order_id__in=existing_pks)}
+            rows = []
+            for order in orders:
+                address_values = parsed[order.order_id][2].get(prefix)
+                if not address_values:
+                    continue
+                address = current.get(order.pk)
+                if address is None:
+                    address = model(order=order, created_by=self.user, **address_values)
+                else:
+                    for attname, value in address_values.items():
+                        setattr(address, attname, value)
+                    if not address.get_changes():
+                        continue
+                rows.append(address)
+                changed_orders.add(order.order_id)
+                located.add(order.pk)
+            entries += self.write_addresses(model, rows)
+        if located:
+            refresh_locations(Order.objects.filter(pk__in=located))
+
+        if entries:
+            AuditLogEntry.objects.bulk_create(entries, batch_size=get_audit_setting('FLUSH_SIZE'))
+            notify_entries_written(entries)
+            notify_entries_committed(entries)
+
+        self.result.created += len(new_orders)
+        self.result.updated += len(changed_orders) - len(new_orders)
+        self.result.unchanged += len(orders) - len(changed_orders)
+
+    def write_orders(self, orders, new_orders):
+        """Upsert changed orders; returns their audit entries"""
+        if not orders:
+            return []
+        for order in orders:
+            order.updated_by = self.user
+            if order.pk is None:
+                order.created_by = self.user
+        entries_changes = [order.get_changes() for order in orders]
+        Order.objects.bulk_create(
+            orders,
+            update_conflicts=True,
+            unique_fields=['order_id'],
+            update_fields=[field.name for field in ORDER_FIELDS] + ['updated_by', 'updated_at'],
+        )
+        fetch_missing_pks(Order, orders)
+        return [
+            build_entry(order, 'CREATE' if order.order_id in new_orders else 'UPDATE', changes)
+            for order, changes in zip(orders, entries_changes)
+        ]
+
+    def write_addresses(self, model, addresses):
+        """Upsert new and changed addresses of one table; returns their audit entries"""
+        if not addresses:
+            return []
+        for address in addresses:
+            address.updated_by = self.user
+        actions = [('CREATE' if address.pk is None else 'UPDATE', address.get_changes()) for address in addresses]
+        model.objects.bulk_create(
+            addresses,
+            update_conflicts=True,
+            unique_fields=['order'],
+            update_fields=[field.name for field in ADDRESS_FIELDS] + ['updated_by', 'updated_at'],
+        )
+        fetch_missing_pks(model, addresses)
+        return [build_entry(address, action, changes) for address, (action, changes) in zip(addresses, actions)]
+
+    def set_partner_company(self, order):
+        """What the pre_save signal does: take the partner company of the assigned courier"""
+        if order.assigned_courier_id and not order.partner_company:
+            order.partner_company = self.get_courier(order.assigned_courier_id)[1]
+
+
+def fetch_missing_pks(model, objs):
+    """
+    Set the pks bulk_create could not return, on backends without RETURNING
+    for upserts. Orders and addresses both have a unique order_id: the order
+    number and the order's pk respectively.
+    """
+    missing = {obj.order_id: obj for obj in objs if obj.pk is None}
+    if missing:
+        for order_id, pk in model.objects.filter(order_id__in=list(missing)).values_list('order_id', 'pk'):
+            missing[order_id].pk = pk
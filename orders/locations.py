@@ -0,0 +1,75 @@
+"""
+Denormalized pickup and dropoff locations of orders.
+
+Order.pickup_city, pickup_postal_code, dropoff_city and dropoff_postal_code
+copy the city and postal code of the order's addresses, so the changelist,
+postal code searches and the dashboard's top cities read one indexed table
+instead of joining both address tables. They are kept in step:
+
+- when an address is saved or deleted (the receivers below, connected in
+  orders.signals), with one UPDATE of the order row;
+- when addresses are bulk-written by orders.imports (and so by the CMS sync
+  and webhooks), with one set-based UPDATE per batch (refresh_locations).
+
+They are the Order's derived_fields: not audited, and left out of a full
+Order.save(), so saving a stale order never undoes a newer location.
+Address writes that bypass both, such as QuerySet.update() on the address
+tables, leave them stale; rebuild_order_locations repairs them.
+"""
+from django.db.models import OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Order, PickupAddress, DropoffAddress
+
+# {address model: {address field: Order field}}
+LOCATION_FIELDS = {
+    PickupAddress: {'city': 'pickup_city', 'postal_code': 'pickup_postal_code'},
+    DropoffAddress: {'city': 'dropoff_city', 'postal_code': 'dropoff_postal_code'},
+}
+# Never exported or imported as order columns: their names are those of address columns
+LOCATION_COLUMNS = tuple(name for fields in LOCATION_FIELDS.values() for name in fields.values())
+
+
+def get_location_expressions():
+    """{Order field: expression reading it from the order's address}, for UPDATEs"""
+    expressions = {}
+    for address_model, fields in LOCATION_FIELDS.items():
+        addresses = address_model._base_manager.filter(order=OuterRef('pk'))
+        for address_field, order_field in fields.items():
+            expressions[order_field] = Coalesce(Subquery(addresses.values(address_field)[:1]), Value(''))
+    return expressions
+
+
+def refresh_locations(queryset):
+    """
+    Copy the address cities and postal codes onto the orders of queryset
+    that differ, with one UPDATE; returns the number of orders updated
+    """
+    expressions = get_location_expressions()
+    stale = Q()
+    for order_field, expression in expressions.items():
+        stale |= ~Q(**{order_field: expression})
+    return queryset.filter(stale).update(**expressions)
+
+
+def set_order_location(address, values):
+    Order._base_manager.using(address._state.db).filter(pk=address.order_id).update(**values)
+    if type(address).order.is_cached(address) and address.order is not None:
+        # Keep a loaded order in step
+        for order_field, value in values.items():
+            setattr(address.order, order_field, value)
+
+
+def copy_location_on_save(sender, instance, created, raw=False, **kwargs):
+    """post_save receiver copying a new or changed address's city and postal code onto its order"""
+    if raw:
+        return
+    fields = LOCATION_FIELDS[sender]
+    if created or fields.keys() & instance.get_changes().keys():
+        set_order_location(instance, {order_field: getattr(instance, address_field)
+                                      for address_field, order_field in fields.items()})
+
+
+def clear_location_on_delete(sender, instance, **kwargs):
+    """post_delete receiver blanking the location of a deleted address on its order"""
+    set_order_location(instance, {order_field: '' for order_field in LOCATION_FIELDS[sender].values()})
@@ -0,0 +1,101 @@
+import csv
+import io
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import User
+from orders.exports import iter_order_csv
+from orders.models import Order, PickupAddress, DropoffAddress
+
+
+def legacy_export(queryset):
+    """The previous export: every row through the ORM, FKs loaded lazily one by one"""
+    field_names = [field.name for field in Order._meta.fields]
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(field_names)
+    for obj in queryset:
+        writer.writerow([getattr(obj, field) for field in field_names])
+    return len(output.getvalue())
+
+
+def streaming_export(queryset, **kwargs):
+    return sum(len(chunk) for chunk in iter_order_csv(queryset, **kwargs))
+
+
+class Command(BaseCommand):
+    help = 'Measure query count, peak memory and duration of the order CSV export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Number of orders to export')
+        parser.add_argument('--skip-legacy', action='store_true',
+                            help='Only run the streaming exporter (the legacy one issues a query per FK per row)')
+
+    def handle(self, *args, **options):
+        count = max(options['rows'], 1)
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Benchmarking order export for {count} orders...'))
+
+        # Everything runs in a transaction that is rolled back at the end
+        with transaction.atomic():
+            self.create_orders(count)
+            queryset = Order.objects.filter(order_id__startswith='BENCH-')
+
+            runs = [('Streaming', lambda: streaming_export(queryset)),
+                    ('Streaming + addresses', lambda: streaming_export(queryset, include_addresses=True))]
+            if not options['skip_legacy']:
+                runs.insert(0, ('Legacy', lambda: legacy_export(queryset)))
+            results = [(label, *self.measure(export)) for label, export in runs]
+            transaction.set_rollback(True)
+
+        for label, size, queries, peak, duration in results:
+            self.stdout.write(f'{label:<22} {queries:>7} queries   peak memory: {peak / 2**20:7.1f} MiB   '
+                              f'{duration:6.2f} s   {size / 2**20:6.1f} MiB of CSV')
+
+    def create_orders(self, count):
+        courier = User.objects.filter(user_type=User.Types.COURIER).first() or User.objects.create_user(
+            email='benchmark-courier@example.com', password=None, user_type=User.Types.COURIER
+        )
+        now = timezone.now()
+        orders = Order.objects.bulk_create([
+            Order(
+                order_date=now,
+                order_id=f'BENCH-{i}',
+                product_name=f'Benchmark product {i}',
+                total_price=Decimal('149.00'),
+                assigned_courier=courier,
+                created_by=courier,
+                updated_by=courier,
+            ) for i in range(count)
+        ], batch_size=5000)
+        address = dict(customer_name='Benchmark', address='Keizersgracht 1', postal_code='1015CJ',
+                       city='Amsterdam', country='NL', phone_number='0201234567', email='bench@example.com')
+        for model in (PickupAddress, DropoffAddress):
+            model.objects.bulk_create([model(order=order, **address) for order in orders], batch_size=5000)
+        if connection.vendor == 'postgresql':
+            # Give the planner real statistics for the freshly loaded rows
+            with connection.cursor() as cursor:
+                for model in (User, Order, PickupAddress, DropoffAddress):
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+    def measure(self, export):
+        """Return (bytes, queries, peak traced memory, seconds) of one export"""
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            size = export()
+        duration = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return size, queries, peak, duration
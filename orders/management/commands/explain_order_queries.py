@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from accounts.models import PartnerCompany
+from orders.models import Order, OrderState
+from orders.statistics import filter_orders
+
+
+def get_checked_queries():
+    """(description, queryset, index it must use) for the hot order queries"""
+    now = timezone.now()
+    week_ago = now - timedelta(days=7)
+    # Counts drop the default ordering, so unordered querysets stand in for them
+    orders = Order.objects.order_by()
+    # The changelist appends -pk to make its ordering deterministic
+    changelist = Order.objects.order_by('-order_date', '-pk')
+    return [
+        ('Admin changelist', changelist[:100], 'orders_order_date_idx'),
+        ('Admin date hierarchy', changelist.filter(order_date__gte=week_ago, order_date__lt=now)[:100],
+         'orders_order_date_idx'),
+        ('Admin status filter', changelist.filter(status=OrderState.NEW)[:100], 'orders_status_date_idx'),
+        ('Admin unassigned filter', changelist.filter(assigned_courier__isnull=True)[:100],
+         'orders_unassigned_date_idx'),
+        ('Admin partner scope', changelist.filter(partner_company=PartnerCompany.values[0])[:100],
+         'orders_partner_date_idx'),
+        ('Admin weight filter', orders.filter(weight__gt=50), 'orders_weight_idx'),
+        ('Dashboard status count', orders.filter(status=OrderState.NEW), 'orders_status_date_idx'),
+        ('Dashboard unassigned count', orders.filter(assigned_courier__isnull=True), 'orders_unassigned_date_idx'),
+        ('Dashboard last week', orders.filter(created_at__gte=week_ago), 'orders_created_at_idx'),
+        ('Dashboard recent orders', orders.order_by('-created_at')[:5], 'orders_created_at_idx'),
+        ('Dashboard top pickup cities', orders.exclude(pickup_city='').values('pickup_city').annotate(count=Count('id')),
+         'orders_pickup_city_idx'),
+        ('Dashboard top dropoff cities', orders.exclude(dropoff_city='').values('dropoff_city').annotate(count=Count('id')),
+         'orders_dropoff_city_idx'),
+        ('Search pickup postal code', orders.filter(pickup_postal_code__startswith='1015'), 'orders_pickup_code_idx'),
+        ('Search dropoff postal code', orders.filter(dropoff_postal_code__startswith='1015'),
+         'orders_dropoff_code_idx'),
+        ('Statistics partner range',
+         filter_orders(orders, timezone.localdate(week_ago), timezone.localdate(now), PartnerCompany.values[0]),
+         'orders_partner_date_idx'),
+        ('Courier orders', orders.filter(assigned_courier=0).order_by('-order_date'), 'orders_courier_date_idx'),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN the admin, dashboard and courier order queries and fail when one '
+            'does not use the index planned for it on PostgreSQL')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every query plan')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Explaining order queries on {connection.vendor}...'))
+
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Small development tables are cheaper to scan sequentially;
+                # ask whether the index can be used, not whether it pays off yet
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for description, queryset, index in get_checked_queries():
+                plan = queryset.explain()
+                used = index in plan
+                status = self.style.SUCCESS('OK') if used else self.style.ERROR('MISSING')
+                self.stdout.write(f'{description:<28} {index:<28} {status}')
+                if options['verbose_plans'] or not used:
+                    self.stdout.write(f'    {plan}'.replace('\n', '\n    '))
+                if not used:
+                    failures.append(description)
+
+        if not failures:
+            return
+        message = f'Not using their planned index: {", ".join(failures)}'
+        if connection.vendor != 'postgresql':
+            # Without table statistics other planners pick between equally
+            # usable indexes arbitrarily; only the production database is binding
+            self.stdout.write(self.style.WARNING(message))
+            return
+        raise CommandError(message)
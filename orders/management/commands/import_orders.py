@@ -0,0 +1,83 @@
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from core.context import request_context
+from orders.imports import BATCH_SIZE, IMPORT_FORMATS, OrderImporter, iter_csv_rows, iter_jsonl_rows
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = ('Upsert orders and their addresses from a CSV or JSONL file (optionally gzipped) in '
+            'the column layout of the order export, in bulk')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for stdin')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help='Input format; by default taken from the file extension')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Orders upserted per transaction')
+        parser.add_argument('--user', help='Email of the user the changes are recorded for')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and diff, then roll every batch back')
+        parser.add_argument('--max-errors', type=int, default=20, help='Number of row errors printed')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        export_format = options['format'] or self.guess_format(path)
+        user = None
+        if options['user']:
+            user = User.objects.filter(email__iexact=options['user']).first()
+            if user is None:
+                raise CommandError(f'Unknown user: {options["user"]}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Importing orders from {path} ({export_format}){" (dry run)" if options["dry_run"] else ""}...'
+        ))
+        start = time.perf_counter()
+        last_report = start
+
+        def progress(result):
+            nonlocal last_report
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                self.stdout.write(f'  {result.rows} rows, {result.rows / (now - start):.0f} rows/s')
+
+        with self.open(path) as file, request_context(user=user):
+            rows = iter_csv_rows(file) if export_format == 'csv' else iter_jsonl_rows(file)
+            importer = OrderImporter(user=user, batch_size=max(options['batch_size'], 1),
+                                     dry_run=options['dry_run'])
+            result = importer.run(rows, progress)
+        duration = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.rows} rows in {duration:.1f} s ({result.rows / max(duration, 1e-9):.0f} rows/s): '
+            f'{result.created} created, {result.updated} updated, {result.unchanged} unchanged, '
+            f'{len(result.errors)} errors'
+        ))
+        for line, message in sorted(result.errors)[:options['max_errors']]:
+            self.stderr.write(f'  line {line}: {message}')
+        if len(result.errors) > options['max_errors']:
+            self.stderr.write(f'  ... and {len(result.errors) - options["max_errors"]} more')
+
+    def guess_format(self, path):
+        name = path[:-3] if path.endswith('.gz') else path
+        for export_format in IMPORT_FORMATS:
+            if name.endswith(f'.{export_format}'):
+                return export_format
+        if name.endswith('.ndjson'):
+            return 'jsonl'
+        raise CommandError('Cannot tell the format from the file name; pass --format')
+
+    def open(self, path):
+        if path == '-':
+            return open(sys.stdin.fileno(), encoding='utf-8-sig', newline='', closefd=False)
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            return opener(path, 'rt', encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(f'Cannot open {path}: {e}')
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.context import request_context
+from orders.transitions import JobLeaseLost, claim_job, get_bulk_action_setting, run_job
+
+
+class Command(BaseCommand):
+    help = ('Run the order status changes queued from the admin, in chunks of short transactions; '
+            'several workers can run side by side, and take over the jobs of workers that stopped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help='Orders moved per transaction (default: CHUNK_SIZE)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new jobs instead of exiting once none are pending')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait between polls with --loop')
+
+    def handle(self, *args, **options):
+        chunk_size = max(options['chunk_size'] or get_bulk_action_setting('CHUNK_SIZE'), 1)
+        self.stdout.write(self.style.MIGRATE_HEADING('Processing order transition jobs...'))
+        jobs = 0
+        try:
+            while True:
+                job = claim_job()
+                if job is None:
+                    if not options['loop']:
+                        break
+                    # Like the end of a request: drop connections past CONN_MAX_AGE or broken
+                    close_old_connections()
+                    time.sleep(options['interval'])
+                    continue
+
+                start = time.perf_counter()
+                with request_context(user=job.created_by):
+                    try:
+                        run_job(job, chunk_size=chunk_size, progress=self.report_progress)
+                    except JobLeaseLost as e:
+                        self.stderr.write(self.style.WARNING(str(e)))
+                        continue
+                    except Exception as e:
+                        self.stderr.write(self.style.ERROR(f'Job #{job.pk} failed: {e!r}'))
+                        continue
+                jobs += 1
+                # The job's counters, which include the chunks of a worker it was taken over from
+                self.stdout.write(self.style.SUCCESS(
+                    f'Job #{job.pk}: {job.changed} orders marked as {job.target}, {job.rejected} '
+                    f'rejected, {len(job.skipped_ids)} skipped as locked in {time.perf_counter() - start:.1f} s'
+                ))
+        except KeyboardInterrupt:
+            self.stdout.write('Interrupted')
+        self.stdout.write(self.style.SUCCESS(f'{jobs} jobs done'))
+
+    def report_progress(self, job):
+        self.stdout.write(f'  job #{job.pk}: {job.done} / {job.total}', ending='\r')
+        self.stdout.flush()
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import AuditLogEntry
+from orders.history import HISTORY_CONTENT_TYPES, ORDER_CHILD_MODELS, build_event
+from orders.models import Order, OrderHistoryEvent
+
+
+class Command(BaseCommand):
+    help = ('Backfill the order history timeline from audit entries written before it was '
+            'maintained, newest first; safe to interrupt and run again')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Audit entries converted per transaction')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Delete every history event first and rebuild the whole timeline')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            deleted, _ = OrderHistoryEvent.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} history events')
+
+        # Entries newer than the oldest event already have theirs, either
+        # written live or by an earlier (interrupted) run of this command
+        entries = AuditLogEntry.objects.filter(content_type__in=HISTORY_CONTENT_TYPES)
+        oldest = OrderHistoryEvent.objects.exclude(audit_entry_id=None).order_by('audit_entry_id').first()
+        if oldest:
+            entries = entries.filter(pk__lt=oldest.audit_entry_id)
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Backfilling order history...'))
+        created = skipped = 0
+        chunk_size = options['chunk_size']
+        before = None
+        while True:
+            chunk = entries if before is None else entries.filter(pk__lt=before)
+            chunk = list(chunk.order_by('-pk')[:chunk_size])
+            if not chunk:
+                break
+            events = self.build_events(chunk)
+            with transaction.atomic():
+                OrderHistoryEvent.objects.bulk_create(events)
+            created += len(events)
+            skipped += len(chunk) - len(events)
+            before = chunk[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f'Created {created} history events'))
+        if skipped:
+            self.stdout.write(f'Skipped {skipped} entries of addresses or notes that no longer exist')
+
+    def build_events(self, entries):
+        """Map a chunk of entries to their orders with one query per child model"""
+        order_ids = {}
+        for model in ORDER_CHILD_MODELS:
+            object_ids = [entry.object_id for entry in entries if entry.content_type == model.__name__]
+            if object_ids:
+                rows = model.objects.filter(pk__in=object_ids).values_list('pk', 'order_id')
+                order_ids.update({(model.__name__, str(pk)): order_id for pk, order_id in rows})
+
+        events = []
+        for entry in entries:
+            if entry.content_type == Order.__name__:
+                order_id = int(entry.object_id)
+            else:
+                order_id = order_ids.get((entry.content_type, entry.object_id))
+            if order_id is not None:
+                events.append(build_event(entry, order_id))
+        return events
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from orders.locations import refresh_locations
+from orders.models import Order
+
+CHUNK_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = ('Copy the pickup and dropoff cities and postal codes of the addresses onto their orders '
+            'where they differ, e.g. after address changes made with QuerySet.update()')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Range of order ids repaired per UPDATE and transaction')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING('Rebuilding order locations...'))
+        chunk_size = max(options['chunk_size'], 1)
+        bounds = Order.objects.aggregate(first=Min('pk'), last=Max('pk'))
+        repaired = 0
+        if bounds['first'] is not None:
+            for start in range(bounds['first'], bounds['last'] + 1, chunk_size):
+                with transaction.atomic():
+                    repaired += refresh_locations(Order.objects.filter(pk__gte=start, pk__lt=start + chunk_size))
+        self.stdout.write(self.style.SUCCESS(f'Repaired the locations of {repaired} orders'))
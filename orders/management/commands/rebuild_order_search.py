@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from orders.models import Order
+from orders.search import CHUNK_SIZE, refresh_search_documents
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the order search documents, e.g. after changes made without audit logging '
+            'or to the fields they cover')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Orders rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING('Rebuilding order search documents...'))
+        chunk_size = max(options['chunk_size'], 1)
+        order_ids = Order.objects.order_by('pk').values_list('pk', flat=True)
+        rebuilt = 0
+        after = 0
+        while True:
+            chunk = list(order_ids.filter(pk__gt=after)[:chunk_size])
+            if not chunk:
+                break
+            with transaction.atomic():
+                rebuilt += refresh_search_documents(chunk)
+            after = chunk[-1]
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} search documents'))
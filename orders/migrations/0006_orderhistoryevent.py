@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:41
+
+import core.fields
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_partner_company'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderHistoryEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(verbose_name='Timestamp')),
+                ('content_type', models.CharField(max_length=100, verbose_name='Content Type')),
+                ('object_id', models.CharField(max_length=50, verbose_name='Object ID')),
+                ('object_repr', models.CharField(max_length=255, verbose_name='Object Representation')),
+                ('action', models.CharField(choices=[('CREATE', 'Create'), ('UPDATE', 'Update'), ('DELETE', 'Delete')], max_length=10, verbose_name='Action')),
+                ('changes', core.fields.CompressedJSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Changes')),
+                ('audit_entry_id', models.BigIntegerField(blank=True, null=True, verbose_name='Audit Entry ID')),
+                ('order', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='history', to='orders.order')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Order History Event',
+                'verbose_name_plural': 'Order History Events',
+                'ordering': ['timestamp', 'id'],
+                'indexes': [models.Index(fields=['order', 'timestamp'], name='orders_history_order_idx')],
+            },
+        ),
+    ]
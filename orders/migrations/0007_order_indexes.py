@@ -0,0 +1,87 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+import core.operations
+
+
+def courier_index_names(schema_editor, model):
+    column = model._meta.get_field('assigned_courier').column
+    return schema_editor._constraint_names(model, [column], index=True)
+
+
+def drop_courier_index(apps, schema_editor):
+    """
+    Drop the single-column index Django created for the assigned_courier
+    foreign key; orders_courier_date_idx starts with the same column
+    """
+    Order = apps.get_model('orders', 'Order')
+    concurrently = 'CONCURRENTLY ' if core.operations.supports_concurrently(schema_editor) else ''
+    for name in courier_index_names(schema_editor, Order):
+        schema_editor.execute(f'DROP INDEX {concurrently}{schema_editor.quote_name(name)}')
+
+
+def create_courier_index(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    if not courier_index_names(schema_editor, Order):
+        kwargs = {'concurrently': True} if core.operations.supports_concurrently(schema_editor) else {}
+        schema_editor.execute(schema_editor._create_index_sql(
+            Order, fields=[Order._meta.get_field('assigned_courier')], **kwargs
+        ))
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('orders', '0006_orderhistoryevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['order_date', 'id'], name='orders_order_date_idx'),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['status', 'order_date', 'id'], name='orders_status_date_idx'),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('assigned_courier__isnull', True)), fields=['order_date', 'id'], name='orders_unassigned_date_idx'),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['assigned_courier', 'order_date', 'id'], name='orders_courier_date_idx'),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['partner_company', 'order_date', 'id'], name='orders_partner_date_idx'),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='orders_created_at_idx'),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['weight'], name='orders_weight_idx'),
+        ),
+        # Only once orders_courier_date_idx exists, so courier lookups and
+        # ON DELETE SET NULL from users always have an index to use
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='order',
+                    name='assigned_courier',
+                    field=models.ForeignKey(blank=True, db_index=False, limit_choices_to={'user_type': 'COURIER'}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='assigned_orders', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(drop_courier_index, create_courier_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+SEARCH_TABLE = 'orders_ordersearchdocument'
+FTS_TABLE = 'orders_ordersearch_fts'
+TSVECTOR_CONFIG = 'simple'
+
+# The document of orders.search as of this migration: these fields, then the notes
+DOCUMENT_FIELDS = (
+    'order_id', 'product_name', 'product_category',
+    'pickup_address__customer_name', 'pickup_address__postal_code', 'pickup_address__city',
+    'dropoff_address__customer_name', 'dropoff_address__postal_code', 'dropoff_address__city',
+)
+CHUNK_SIZE = 1000
+
+POSTGRESQL_FORWARDS = [
+    f"CREATE INDEX orders_search_tsv_idx ON {SEARCH_TABLE} USING gin (to_tsvector('{TSVECTOR_CONFIG}', document))",
+]
+# Only where the pg_trgm contrib module is installed; without it substring
+# searches still work, by scanning the documents table
+POSTGRESQL_TRIGRAM_FORWARDS = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    f'CREATE INDEX orders_search_trgm_idx ON {SEARCH_TABLE} USING gin (document gin_trgm_ops)',
+]
+POSTGRESQL_BACKWARDS = [
+    'DROP INDEX IF EXISTS orders_search_trgm_idx',
+    'DROP INDEX IF EXISTS orders_search_tsv_idx',
+]
+
+# External-content FTS5 table over the documents, kept in step by triggers
+SQLITE_FORWARDS = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(document, content='{SEARCH_TABLE}', "
+    f"content_rowid='order_id', tokenize='trigram')",
+    f"""CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {SEARCH_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.order_id, new.document);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {SEARCH_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.order_id, old.document);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE ON {SEARCH_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.order_id, old.document);
+        INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.order_id, new.document);
+    END""",
+]
+SQLITE_BACKWARDS = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def has_pg_trgm(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        statements = POSTGRESQL_FORWARDS + (POSTGRESQL_TRIGRAM_FORWARDS if has_pg_trgm(connection) else [])
+    elif connection.vendor == 'sqlite':
+        statements = SQLITE_FORWARDS
+    else:
+        statements = []
+    for sql in statements:
+        schema_editor.execute(sql, params=None)
+
+
+def drop_search_indexes(apps, schema_editor):
+    statements = {'postgresql': POSTGRESQL_BACKWARDS, 'sqlite': SQLITE_BACKWARDS}
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql, params=None)
+
+
+def build_documents(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderNote = apps.get_model('orders', 'OrderNote')
+    OrderSearchDocument = apps.get_model('orders', 'OrderSearchDocument')
+    order_ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(order_ids), CHUNK_SIZE):
+        chunk = order_ids[start:start + CHUNK_SIZE]
+        notes = {}
+        for order_id, content in OrderNote.objects.filter(order_id__in=chunk).order_by('pk').values_list(
+                'order_id', 'content'):
+            notes.setdefault(order_id, []).append(content)
+        documents = [
+            OrderSearchDocument(
+                order_id=pk,
+                document='\n'.join(str(value) for value in (*values, *notes.get(pk, ())) if value),
+            )
+            for pk, *values in Order.objects.filter(pk__in=chunk).order_by().values_list('pk', *DOCUMENT_FIELDS)
+        ]
+        OrderSearchDocument.objects.bulk_create(documents)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSearchDocument',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='orders.order')),
+                ('document', models.TextField(blank=True, verbose_name='Document')),
+            ],
+            options={
+                'verbose_name': 'Order Search Document',
+                'verbose_name_plural': 'Order Search Documents',
+            },
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+    ]
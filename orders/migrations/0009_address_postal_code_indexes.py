@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+import core.operations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('orders', '0008_ordersearchdocument'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        core.operations.AddIndexConcurrently(
+            model_name='dropoffaddress',
+            index=models.Index(fields=['postal_code'], name='orders_dropoff_postal_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='pickupaddress',
+            index=models.Index(fields=['postal_code'], name='orders_pickup_postal_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_address_postal_code_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTransitionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(choices=[('new', 'New'), ('canceled', 'Canceled'), ('accepted', 'Accepted'), ('shipped', 'Shipped'), ('disputed', 'Disputed'), ('completed', 'Completed'), ('expired', 'Expired'), ('delivered', 'Delivered')], max_length=20, verbose_name='Target Status')),
+                ('order_ids', models.JSONField(default=list, verbose_name='Order IDs')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Total')),
+                ('changed', models.PositiveIntegerField(default=0, verbose_name='Changed')),
+                ('rejected', models.PositiveIntegerField(default=0, verbose_name='Rejected')),
+                ('skipped_ids', models.JSONField(default=list, verbose_name='Skipped Order IDs')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Started At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Created By')),
+            ],
+            options={
+                'verbose_name': 'Order Transition Job',
+                'verbose_name_plural': 'Order Transition Jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
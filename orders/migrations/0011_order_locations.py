@@ -0,0 +1,49 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_locations(apps, schema_editor):
+    """Fill the new columns from the addresses, one UPDATE per address table"""
+    Order = apps.get_model('orders', 'Order')
+    for prefix in ('pickup', 'dropoff'):
+        Address = apps.get_model('orders', f'{prefix.capitalize()}Address')
+        addresses = Address.objects.filter(order=OuterRef('pk'))
+        Order.objects.filter(pk__in=Address.objects.values('order')).update(**{
+            f'{prefix}_city': Subquery(addresses.values('city')[:1]),
+            f'{prefix}_postal_code': Subquery(addresses.values('postal_code')[:1]),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_ordertransitionjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='dropoff_city',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Dropoff City'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='dropoff_postal_code',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20, verbose_name='Dropoff Postal Code'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='pickup_city',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Pickup City'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='pickup_postal_code',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20, verbose_name='Pickup Postal Code'),
+        ),
+        migrations.RunPython(copy_locations, migrations.RunPython.noop),
+    ]
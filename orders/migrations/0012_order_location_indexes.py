@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+import core.operations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('orders', '0011_order_locations'),
+    ]
+
+    operations = [
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['pickup_city'], name='orders_pickup_city_idx'),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['dropoff_city'], name='orders_dropoff_city_idx'),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['pickup_postal_code'], name='orders_pickup_code_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        core.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['dropoff_postal_code'], name='orders_dropoff_code_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+def set_heartbeat(apps, schema_editor):
+    # Running jobs have made progress no later than now; the lease timeout runs from their start
+    OrderTransitionJob = apps.get_model('orders', 'OrderTransitionJob')
+    OrderTransitionJob.objects.filter(status='running').update(heartbeat_at=models.F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0012_order_location_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordertransitionjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last Progress At'),
+        ),
+        migrations.RunPython(set_heartbeat, migrations.RunPython.noop),
+    ]
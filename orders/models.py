@@ -1,7 +1,10 @@
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from accounts.models import User, CustomerProfile, CourierProfile
-from core.models import AuditableMixin
+from core.fields import CompressedJSONField
+from core.models import AuditableMixin, AuditLogEntry, ChangeTrackingMixin
 from accounts.models import PartnerCompany
 
 class OrderState:
@@ -25,7 +28,28 @@ class OrderState:
         (DELIVERED, _("Delivered")),
     ]
 
-class Order(models.Model):
+    # The statuses an order can move to from each status (see orders.transitions)
+    TRANSITIONS = {
+        NEW: (ACCEPTED, CANCELED, EXPIRED),
+        ACCEPTED: (SHIPPED, CANCELED),
+        SHIPPED: (DELIVERED, DISPUTED),
+        DELIVERED: (COMPLETED, DISPUTED),
+        DISPUTED: (COMPLETED, CANCELED),
+        COMPLETED: (),
+        CANCELED: (),
+        EXPIRED: (),
+    }
+
+    @classmethod
+    def can_transition(cls, source, target):
+        return target in cls.TRANSITIONS.get(source, ())
+
+    @classmethod
+    def get_sources(cls, target):
+        """The statuses an order can move to target from"""
+        return [source for source, targets in cls.TRANSITIONS.items() if target in targets]
+
+class Order(ChangeTrackingMixin):
     """
     Model to store order information from Whoppah
     """
@@ -74,7 +98,8 @@ class Order(models.Model):
         null=True,
         blank=True,
         related_name="assigned_orders",
-        limit_choices_to={"user_type": User.Types.COURIER}
+        limit_choices_to={"user_type": User.Types.COURIER},
+        db_index=False,  # Covered by orders_courier_date_idx
     )
     
     # Partner Company Assignment - will be automatically set when courier is assigned
@@ -86,6 +111,16 @@ class Order(models.Model):
         blank=True,
     )
     
+    # Copies of the address cities and postal codes, so lists, searches and
+    # statistics need no joins; maintained by orders.locations
+    pickup_city = models.CharField(_("Pickup City"), max_length=100, blank=True, default='', editable=False)
+    pickup_postal_code = models.CharField(_("Pickup Postal Code"), max_length=20, blank=True, default='',
+                                          editable=False)
+    dropoff_city = models.CharField(_("Dropoff City"), max_length=100, blank=True, default='', editable=False)
+    dropoff_postal_code = models.CharField(_("Dropoff Postal Code"), max_length=20, blank=True, default='',
+                                           editable=False)
+    derived_fields = ('pickup_city', 'pickup_postal_code', 'dropoff_city', 'dropoff_postal_code')
+    
     # Audit Fields
     created_by = models.ForeignKey(
         User,
@@ -109,45 +144,43 @@ class Order(models.Model):
     def __str__(self):
         return f"Order #{self.order_id} - {self.product_name}"
     
+    def clean(self):
+        super().clean()
+        change = None if self._state.adding else self.get_changes().get('status')
+        if change and not OrderState.can_transition(change['old'], change['new']):
+            raise ValidationError({'status': _('An order cannot go from %(old)s to %(new)s.') % {
+                'old': change['old'], 'new': change['new'],
+            }})
+    
     class Meta:
         ordering = ['-order_date']
         verbose_name = _("Order")
         verbose_name_plural = _("Orders")
-    
-    def get_changes(self, old_instance=None):
-        """Get a dictionary of changed fields with old and new values"""
-        if not old_instance:
-            # For new instances, return all fields
-            return {
-                field.name: {
-                    'old': None,
-                    'new': getattr(self, field.name)
-                } for field in self._meta.fields
-                if not field.name.endswith('_ptr') and field.name not in ['created_at', 'updated_at']
-            }
-        
-        changes = {}
-        for field in self._meta.fields:
-            if field.name.endswith('_ptr') or field.name in ['created_at', 'updated_at']:
-                continue
-                
-            old_value = getattr(old_instance, field.name)
-            new_value = getattr(self, field.name)
-            
-            # Handle special cases like ForeignKey
-            if field.is_relation:
-                old_value = str(old_value) if old_value else None
-                new_value = str(new_value) if new_value else None
-            
-            if old_value != new_value:
-                changes[field.name] = {
-                    'old': old_value,
-                    'new': new_value
-                }
-        
-        return changes
+        # Built online by migration 0007; explain_order_queries checks the
+        # admin, dashboard and courier queries still use them
+        indexes = [
+            # Changelist order (-order_date, -pk) under each filter, so pages need no sort
+            models.Index(fields=['order_date', 'id'], name='orders_order_date_idx'),
+            models.Index(fields=['status', 'order_date', 'id'], name='orders_status_date_idx'),
+            models.Index(
+                fields=['order_date', 'id'],
+                name='orders_unassigned_date_idx',
+                condition=models.Q(assigned_courier__isnull=True),
+            ),
+            models.Index(fields=['assigned_courier', 'order_date', 'id'], name='orders_courier_date_idx'),
+            models.Index(fields=['partner_company', 'order_date', 'id'], name='orders_partner_date_idx'),
+            models.Index(fields=['created_at'], name='orders_created_at_idx'),
+            models.Index(fields=['weight'], name='orders_weight_idx'),
+            # Built by migration 0012
+            models.Index(fields=['pickup_city'], name='orders_pickup_city_idx'),
+            models.Index(fields=['dropoff_city'], name='orders_dropoff_city_idx'),
+            models.Index(fields=['pickup_postal_code'], name='orders_pickup_code_idx',
+                         opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['dropoff_postal_code'], name='orders_dropoff_code_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
 
-class PickupAddress(models.Model):
+class PickupAddress(ChangeTrackingMixin):
     """
     Model to store pickup address information for orders
     """
@@ -190,41 +223,12 @@ class PickupAddress(models.Model):
     class Meta:
         verbose_name = _("Pickup Address")
         verbose_name_plural = _("Pickup Addresses")
-    
-    def get_changes(self, old_instance=None):
-        """Get a dictionary of changed fields with old and new values"""
-        if not old_instance:
-            # For new instances, return all fields
-            return {
-                field.name: {
-                    'old': None,
-                    'new': getattr(self, field.name)
-                } for field in self._meta.fields
-                if not field.name.endswith('_ptr') and field.name not in ['created_at', 'updated_at']
-            }
-        
-        changes = {}
-        for field in self._meta.fields:
-            if field.name.endswith('_ptr') or field.name in ['created_at', 'updated_at']:
-                continue
-                
-            old_value = getattr(old_instance, field.name)
-            new_value = getattr(self, field.name)
-            
-            # Handle special cases like ForeignKey
-            if field.is_relation:
-                old_value = str(old_value) if old_value else None
-                new_value = str(new_value) if new_value else None
-            
-            if old_value != new_value:
-                changes[field.name] = {
-                    'old': old_value,
-                    'new': new_value
-                }
-        
-        return changes
+        indexes = [
+            # Pattern ops so postal code prefix searches can use it on PostgreSQL too
+            models.Index(fields=['postal_code'], name='orders_pickup_postal_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
-class DropoffAddress(models.Model):
+class DropoffAddress(ChangeTrackingMixin):
     """
     Model to store dropoff address information for orders
     """
@@ -267,41 +271,12 @@ class DropoffAddress(models.Model):
     class Meta:
         verbose_name = _("Dropoff Address")
         verbose_name_plural = _("Dropoff Addresses")
-    
-    def get_changes(self, old_instance=None):
-        """Get a dictionary of changed fields with old and new values"""
-        if not old_instance:
-            # For new instances, return all fields
-            return {
-                field.name: {
-                    'old': None,
-                    'new': getattr(self, field.name)
-                } for field in self._meta.fields
-                if not field.name.endswith('_ptr') and field.name not in ['created_at', 'updated_at']
-            }
-        
-        changes = {}
-        for field in self._meta.fields:
-            if field.name.endswith('_ptr') or field.name in ['created_at', 'updated_at']:
-                continue
-                
-            old_value = getattr(old_instance, field.name)
-            new_value = getattr(self, field.name)
-            
-            # Handle special cases like ForeignKey
-            if field.is_relation:
-                old_value = str(old_value) if old_value else None
-                new_value = str(new_value) if new_value else None
-            
-            if old_value != new_value:
-                changes[field.name] = {
-                    'old': old_value,
-                    'new': new_value
-                }
-        
-        return changes
+        indexes = [
+            # Pattern ops so postal code prefix searches can use it on PostgreSQL too
+            models.Index(fields=['postal_code'], name='orders_dropoff_postal_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
-class OrderNote(models.Model):
+class OrderNote(ChangeTrackingMixin):
     """
     Model to store notes related to orders
     """
@@ -337,36 +312,139 @@ class OrderNote(models.Model):
         ordering = ['-created_at']
         verbose_name = _("Order Note")
         verbose_name_plural = _("Order Notes")
+
+
+class OrderHistoryEventQuerySet(models.QuerySet):
+    def for_order(self, order):
+        """The whole history of an order, oldest first, in one indexed query"""
+        return self.filter(order=order).select_related('user').order_by('timestamp', 'id')
+
+
+class OrderHistoryEvent(models.Model):
+    """
+    Read model of an order's audit trail: one row per audit entry of the
+    order or one of its addresses and notes, keyed by the order id.
+    Maintained from the audit log as entries are written (see orders.history).
+    """
+    # No database constraint: the history outlives a deleted order
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name="history"
+    )
+    timestamp = models.DateTimeField(_('Timestamp'))
+    user = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name=_('User')
+    )
+    content_type = models.CharField(_('Content Type'), max_length=100)
+    object_id = models.CharField(_('Object ID'), max_length=50)
+    object_repr = models.CharField(_('Object Representation'), max_length=255)
+    action = models.CharField(_('Action'), max_length=10, choices=AuditLogEntry.ACTION_TYPES)
+    changes = CompressedJSONField(_('Changes'), default=dict, encoder=DjangoJSONEncoder)
+    # Plain id: the partitioned audit table cannot be the target of a foreign key
+    audit_entry_id = models.BigIntegerField(_('Audit Entry ID'), null=True, blank=True)
     
-    def get_changes(self, old_instance=None):
-        """Get a dictionary of changed fields with old and new values"""
-        if not old_instance:
-            # For new instances, return all fields
-            return {
-                field.name: {
-                    'old': None,
-                    'new': getattr(self, field.name)
-                } for field in self._meta.fields
-                if not field.name.endswith('_ptr') and field.name not in ['created_at', 'updated_at']
-            }
-        
-        changes = {}
-        for field in self._meta.fields:
-            if field.name.endswith('_ptr') or field.name in ['created_at', 'updated_at']:
-                continue
-                
-            old_value = getattr(old_instance, field.name)
-            new_value = getattr(self, field.name)
-            
-            # Handle special cases like ForeignKey
-            if field.is_relation:
-                old_value = str(old_value) if old_value else None
-                new_value = str(new_value) if new_value else None
-            
-            if old_value != new_value:
-                changes[field.name] = {
-                    'old': old_value,
-                    'new': new_value
-                }
-        
-        return changes
+    objects = OrderHistoryEventQuerySet.as_manager()
+    
+    def __str__(self):
+        return f"{self.get_action_display()} {self.object_repr}"
+    
+    def describe_changes(self):
+        """One-line summary of the changed fields"""
+        return ", ".join(
+            f"{field}: {change.get('old')} → {change.get('new')}" for field, change in self.changes.items()
+        )
+    
+    class Meta:
+        ordering = ['timestamp', 'id']
+        verbose_name = _("Order History Event")
+        verbose_name_plural = _("Order History Events")
+        indexes = [
+            models.Index(fields=['order', 'timestamp'], name='orders_history_order_idx'),
+        ]
+
+
+
+class OrderSearchDocument(models.Model):
+    """
+    Denormalized search text of an order: its product, customer names,
+    cities, postal codes and notes, rebuilt by orders.search whenever one of
+    them changes. Indexed with GIN tsvector and pg_trgm indexes on PostgreSQL
+    and an FTS5 trigram table on SQLite (see migration 0008).
+    """
+    order = models.OneToOneField(
+        Order,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="search_document"
+    )
+    document = models.TextField(_('Document'), blank=True)
+    
+    def __str__(self):
+        return f"Search document for order {self.order_id}"
+    
+    class Meta:
+        verbose_name = _("Order Search Document")
+        verbose_name_plural = _("Order Search Documents")
+
+
+class OrderTransitionJob(models.Model):
+    """
+    A status change of a large selection of orders, queued from the admin
+    and carried out in chunks by process_order_transitions (see
+    orders.transitions). Its counters are updated after every chunk.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    ]
+    
+    target = models.CharField(_('Target Status'), max_length=20, choices=OrderState.CHOICES)
+    # Primary keys of the selected orders, frozen when the job is queued
+    order_ids = models.JSONField(_('Order IDs'), default=list)
+    status = models.CharField(_('Status'), max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    total = models.PositiveIntegerField(_('Total'), default=0)
+    changed = models.PositiveIntegerField(_('Changed'), default=0)
+    rejected = models.PositiveIntegerField(_('Rejected'), default=0)
+    # Orders locked by another transaction (or deleted) when their chunk ran
+    skipped_ids = models.JSONField(_('Skipped Order IDs'), default=list)
+    error = models.TextField(_('Error'), blank=True)
+    created_by = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name=_('Created By')
+    )
+    created_at = models.DateTimeField(_('Created At'), auto_now_add=True)
+    # When the worker running the job took it, and last saved its progress
+    started_at = models.DateTimeField(_('Started At'), null=True, blank=True)
+    heartbeat_at = models.DateTimeField(_('Last Progress At'), null=True, blank=True)
+    finished_at = models.DateTimeField(_('Finished At'), null=True, blank=True)
+    
+    def __str__(self):
+        return f"Mark {self.total} orders as {self.target} (#{self.pk})"
+    
+    @property
+    def done(self):
+        return self.changed + self.rejected + len(self.skipped_ids)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = _("Order Transition Job")
+        verbose_name_plural = _("Order Transition Jobs")
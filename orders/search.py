@@ -0,0 +1,203 @@
+"""
+Order search over OrderSearchDocument.
+
+Each order has one denormalized document holding the text the admin searches
+on, so a search is one indexed lookup in a single table instead of an OR of
+LIKE '%..%' scans over orders and both address tables. Documents are rebuilt
+from the audit log's entries_committed signal, batched per flush, whenever a
+committed change to an order, one of its addresses or a note touches the
+document's text (DOCUMENT_SOURCE_FIELDS); rebuild_order_search rebuilds them
+all.
+
+Like the admin's own search, every whitespace-separated term (or "quoted
+phrase") must occur somewhere in the document, case-insensitively:
+
+- PostgreSQL: substring match through a pg_trgm GIN index. Terms shorter
+  than three characters have no trigrams; they match whole words through a
+  GIN index on to_tsvector('simple', document) instead.
+- SQLite: substring match through an FTS5 trigram table kept in step by
+  triggers, with a LIKE scan for terms shorter than three characters.
+
+Most searches are a pasted order ID or postal code though. Those are first
+tried as indexed equality and prefix lookups on Order.order_id and the
+order's postal code columns (see find_exact_matches); the document search only
+runs when they find nothing.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.text import smart_split, unescape_string_literal
+
+from .history import get_order_id
+from .models import DropoffAddress, Order, OrderNote, OrderSearchDocument, PickupAddress
+
+SEARCH_TABLE = OrderSearchDocument._meta.db_table
+FTS_TABLE = 'orders_ordersearch_fts'
+TSVECTOR_CONFIG = 'simple'
+MIN_TRIGRAM_LENGTH = 3
+
+DOCUMENT_FIELDS = (
+    'order_id', 'product_name', 'product_category',
+    'pickup_address__customer_name', 'pickup_address__postal_code', 'pickup_address__city',
+    'dropoff_address__customer_name', 'dropoff_address__postal_code', 'dropoff_address__city',
+)
+
+# One token with at least one digit, optionally pasted with the "#" of Order.__str__
+ORDER_ID_RE = re.compile(r'^#?(?=.*\d)([\w./-]{3,50})$', re.ASCII)
+# Dutch "1015CJ" / "1015 CJ", or the 4-5 digits of most other European postal codes
+DUTCH_POSTAL_CODE_RE = re.compile(r'^(\d{4})\s?([a-z]{2})$', re.ASCII | re.IGNORECASE)
+NUMERIC_POSTAL_CODE_RE = re.compile(r'^\d{4,5}$', re.ASCII)
+
+# Orders rebuilt per query by refresh_search_documents
+CHUNK_SIZE = 1000
+
+
+def get_document_source_fields():
+    """{audited model name: its fields that end up in the document}"""
+    fields = {model.__name__: set() for model in (Order, PickupAddress, DropoffAddress)}
+    fields[OrderNote.__name__] = {'content'}
+    for path in DOCUMENT_FIELDS:
+        relation, _sep, name = path.rpartition('__')
+        model = Order._meta.get_field(relation).related_model if relation else Order
+        fields[model.__name__].add(name)
+    return fields
+
+
+DOCUMENT_SOURCE_FIELDS = get_document_source_fields()
+
+
+def build_document(values, notes=()):
+    """Join the non-empty values of DOCUMENT_FIELDS and the note contents of an order"""
+    return '\n'.join(str(value) for value in (*values, *notes) if value)
+
+
+def iter_documents(order_ids):
+    """Yield (order pk, document) for the given orders with two queries per CHUNK_SIZE orders"""
+    order_ids = list(order_ids)
+    for start in range(0, len(order_ids), CHUNK_SIZE):
+        chunk = order_ids[start:start + CHUNK_SIZE]
+        notes = {}
+        for order_id, content in OrderNote.objects.filter(order_id__in=chunk).order_by('pk').values_list(
+                'order_id', 'content'):
+            notes.setdefault(order_id, []).append(content)
+        rows = Order.objects.filter(pk__in=chunk).order_by().values_list('pk', *DOCUMENT_FIELDS)
+        for pk, *values in rows:
+            yield pk, build_document(values, notes.get(pk, ()))
+
+
+def refresh_search_documents(order_ids):
+    """Create or update the search documents of the given orders"""
+    documents = [OrderSearchDocument(order_id=pk, document=document) for pk, document in iter_documents(order_ids)]
+    OrderSearchDocument.objects.bulk_create(
+        documents,
+        batch_size=CHUNK_SIZE,
+        update_conflicts=True,
+        unique_fields=['order'],
+        update_fields=['document'],
+    )
+    return len(documents)
+
+
+def changes_document(entry):
+    """Whether an audit entry can change the search document of its order"""
+    fields = DOCUMENT_SOURCE_FIELDS.get(entry.content_type)
+    if fields is None:
+        return False
+    # Creates and deletes add or drop the text of the whole object
+    return entry.action != 'UPDATE' or not fields.isdisjoint(entry.changes or {})
+
+
+def refresh_on_order_changes(sender, entries, **kwargs):
+    """entries_committed receiver rebuilding the documents of the orders a batch of entries touched"""
+    order_ids = {get_order_id(entry) for entry in entries if changes_document(entry)} - {None}
+    if order_ids:
+        # A deleted order takes its document with it
+        refresh_search_documents(order_ids)
+
+
+def get_search_terms(search_term):
+    """Split a search the way the admin does: on whitespace, keeping "quoted phrases" together"""
+    terms = []
+    for bit in smart_split(search_term):
+        if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+            bit = unescape_string_literal(bit)
+        if bit:
+            terms.append(bit)
+    return terms
+
+
+def get_term_condition(term, connection):
+    """Return (sql, params) selecting search documents containing term"""
+    if connection.vendor == 'postgresql':
+        if len(term) >= MIN_TRIGRAM_LENGTH:
+            return "document ILIKE %s ESCAPE '\\'", [f'%{connection.ops.prep_for_like_query(term)}%']
+        return (f"to_tsvector('{TSVECTOR_CONFIG}', document) @@ plainto_tsquery('{TSVECTOR_CONFIG}', %s)",
+                [term])
+    if connection.vendor == 'sqlite' and len(term) >= MIN_TRIGRAM_LENGTH:
+        # A quoted FTS5 string matches the characters literally
+        return (f'order_id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)',
+                ['"' + term.replace('"', '""') + '"'])
+    return "document LIKE %s ESCAPE '\\'", [f'%{connection.ops.prep_for_like_query(term)}%']
+
+
+def filter_postal_code(queryset, search_term):
+    """
+    Filter on postal-code-shaped searches, or return None: a full Dutch
+    postal code in its spellings, or orders whose postal code starts with
+    the digits given
+    """
+    dutch = DUTCH_POSTAL_CODE_RE.match(search_term)
+    if dutch:
+        digits, letters = dutch.groups()
+        lookup, value = 'in', {search_term, f'{digits}{letters.upper()}', f'{digits} {letters.upper()}'}
+    elif NUMERIC_POSTAL_CODE_RE.match(search_term):
+        lookup, value = 'startswith', search_term
+    else:
+        return None
+    # The orders' own indexed copies of the address postal codes, no joins
+    return queryset.filter(
+        Q(**{f'pickup_postal_code__{lookup}': value}) | Q(**{f'dropoff_postal_code__{lookup}': value})
+    )
+
+
+def find_exact_matches(queryset, search_term):
+    """
+    Answer an order-ID or postal-code-shaped search with indexed lookups, in
+    order: exact order ID, postal code, order ID prefix. Returns the first of
+    those with results, or None when the general search is needed.
+    """
+    search_term = search_term.strip()
+    match = ORDER_ID_RE.match(search_term)
+    order_id = match.group(1) if match else None
+    if order_id:
+        exact = queryset.filter(order_id=order_id)
+        if exact.exists():
+            return exact
+    postal = filter_postal_code(queryset, search_term)
+    if postal is not None and postal.exists():
+        return postal
+    if order_id:
+        prefix = queryset.filter(order_id__startswith=order_id)
+        if prefix.exists():
+            return prefix
+    return None
+
+
+def search_orders(queryset, search_term):
+    """Filter an Order queryset down to the orders matching a search"""
+    matches = find_exact_matches(queryset, search_term)
+    if matches is not None:
+        return matches
+    terms = get_search_terms(search_term)
+    if not terms:
+        return queryset
+    connection = connections[queryset.db]
+    conditions, params = [], []
+    for term in terms:
+        sql, term_params = get_term_condition(term, connection)
+        conditions.append(sql)
+        params.extend(term_params)
+    sql = f'SELECT order_id FROM {SEARCH_TABLE} WHERE {" AND ".join(conditions)}'
+    return queryset.filter(pk__in=RawSQL(sql, params))
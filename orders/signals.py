@@ -1,6 +1,32 @@
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import Order
+from core.audit import entries_committed, entries_written
+from core.signals import audit_registry
+from .history import record_order_history
+from .locations import clear_location_on_delete, copy_location_on_save
+from .search import refresh_on_order_changes
+from .statistics import invalidate_on_order_changes
+from .models import Order, PickupAddress, DropoffAddress, OrderNote
+
+# Write every change to these models to the audit log
+audit_registry.register(Order, PickupAddress, DropoffAddress, OrderNote)
+
+# Keep the per-order history timeline in step with the audit log: written
+# with the audit entries, and lost with them
+entries_written.connect(record_order_history, dispatch_uid='orders_record_order_history')
+
+# Cached admin statistics are dropped once order changes are committed
+entries_committed.connect(invalidate_on_order_changes, dispatch_uid='orders_invalidate_statistics')
+
+# Rebuild the search documents of changed orders
+entries_committed.connect(refresh_on_order_changes, dispatch_uid='orders_refresh_search_documents')
+
+# Copy address cities and postal codes onto their orders
+for address_model in (PickupAddress, DropoffAddress):
+    post_save.connect(copy_location_on_save, sender=address_model,
+                      dispatch_uid=f'orders_copy_location_{address_model._meta.model_name}')
+    post_delete.connect(clear_location_on_delete, sender=address_model,
+                        dispatch_uid=f'orders_clear_location_{address_model._meta.model_name}')
 
 
 @receiver(pre_save, sender=Order)
@@ -0,0 +1,92 @@
+"""
+Order statistics for the admin, computed in a single aggregate query and
+cached until an order changes.
+
+Invalidation bumps a generation number stored in the cache, so every
+cached date-range/partner combination is dropped at once. It runs on
+commit of any audited change to an order (save, delete or
+audited_update). Use a shared cache backend (CACHE_URL) when running
+several processes; STATISTICS_CACHE_TIMEOUT bounds staleness for writes
+that bypass the audit trail.
+"""
+import uuid
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils.translation import gettext_lazy as _
+
+from core.views import day_start
+
+from .models import Order, OrderState
+
+WEIGHT_CLASSES = (
+    ('light', _('Light (0-5kg)'), Q(weight__lte=5)),
+    ('medium', _('Medium (5-20kg)'), Q(weight__gt=5, weight__lte=20)),
+    ('heavy', _('Heavy (20-50kg)'), Q(weight__gt=20, weight__lte=50)),
+    ('very_heavy', _('Very Heavy (50kg+)'), Q(weight__gt=50)),
+)
+
+GENERATION_KEY = 'orders:statistics:generation'
+STATISTICS_CACHE_TIMEOUT = 60 * 15
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.set(GENERATION_KEY, generation, None)
+    return generation
+
+
+def invalidate_order_statistics():
+    """Drop every cached statistics result"""
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def compute_order_counts(queryset):
+    """Status, weight class and 2-man counts of a queryset in one aggregate query"""
+    aggregates = {'total': Count('pk'), 'two_man_delivery': Count('pk', filter=Q(two_man_delivery=True))}
+    for code, _label in OrderState.CHOICES:
+        aggregates[f'status_{code}'] = Count('pk', filter=Q(status=code))
+    for code, _label, condition in WEIGHT_CLASSES:
+        aggregates[f'weight_{code}'] = Count('pk', filter=condition)
+    return queryset.aggregate(**aggregates)
+
+
+def filter_orders(queryset, date_from=None, date_to=None, partner_company=None):
+    """The orders the statistics count; explain_order_queries checks the indexes they use"""
+    # Plain order_date ranges, which the order_date indexes can serve, unlike __date
+    if date_from:
+        queryset = queryset.filter(order_date__gte=day_start(date_from))
+    if date_to:
+        queryset = queryset.filter(order_date__lt=day_start(date_to + timedelta(days=1)))
+    if partner_company:
+        queryset = queryset.filter(partner_company=partner_company)
+    return queryset
+
+
+def get_order_statistics(date_from=None, date_to=None, partner_company=None):
+    """
+    Return the order statistics, optionally limited to orders placed
+    between date_from and date_to (inclusive dates) and to one partner company
+    """
+    key = f'orders:statistics:{get_generation()}:{date_from}:{date_to}:{partner_company}'
+    counts = cache.get(key)
+    if counts is None:
+        counts = compute_order_counts(filter_orders(Order.objects.all(), date_from, date_to, partner_company))
+        cache.set(key, counts, STATISTICS_CACHE_TIMEOUT)
+
+    # Labels are added after the cache lookup so they follow the active language
+    return {
+        'total': counts['total'],
+        'orders_by_status': {label: counts[f'status_{code}'] for code, label in OrderState.CHOICES},
+        'orders_by_weight': {label: counts[f'weight_{code}'] for code, label, _condition in WEIGHT_CLASSES},
+        'two_man_delivery_count': counts['two_man_delivery'],
+    }
+
+
+def invalidate_on_order_changes(sender, entries, **kwargs):
+    """entries_committed receiver invalidating the statistics when orders changed"""
+    if any(entry.content_type == Order.__name__ for entry in entries):
+        invalidate_order_statistics()
@@ -1,3 +1,488 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import unittest
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from time import monotonic, sleep
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.admin.utils import lookup_field
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import PartnerCompany, User
+from core.audit import audit_writer
+from core.diff import get_tracked_fields
+from core.models import AuditLogEntry
+from core.testing import ChangelistQueryCountMixin
+
+from .exports import iter_order_csv
+from .imports import ImportRowError, OrderImporter
+from .management.commands.explain_order_queries import get_checked_queries
+from .locations import LOCATION_COLUMNS, refresh_locations
+from .models import (
+    DropoffAddress, Order, OrderHistoryEvent, OrderSearchDocument, OrderState, OrderTransitionJob, PickupAddress,
+)
+from .search import find_exact_matches, refresh_on_order_changes, refresh_search_documents, search_orders
+from .transitions import (
+    JobLeaseLost, TransitionResult, claim_job, queue_transition, run_job, save_progress, transition_orders,
+)
+from .statistics import filter_orders, get_order_statistics, invalidate_order_statistics
+
+
+def create_order(n=1, **values):
+    values = {
+        'order_date': timezone.now(),
+        'order_id': f'TEST-{n}',
+        'product_name': f'Test product {n}',
+        'total_price': Decimal('100.00'),
+        **values,
+    }
+    return Order.objects.create(**values)
+
+
+def create_address(model, order, **values):
+    values = {
+        'customer_name': 'Test Customer',
+        'address': 'Keizersgracht 1',
+        'postal_code': '1015CJ',
+        'city': 'Amsterdam',
+        'country': 'Netherlands',
+        'email': 'customer@example.com',
+        'phone_number': '+31201234567',
+        **values,
+    }
+    return model.objects.create(order=order, **values)
+
+
+class OrderExportActionTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin@example.com', 'password'))
+        self.order = create_order()
+        create_address(PickupAddress, self.order)
+        create_address(DropoffAddress, self.order, city='Utrecht')
+
+    def export(self, action):
+        response = self.client.post(reverse('admin:orders_order_changelist'), {
+            'action': action, '_selected_action': [self.order.pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        if response['Content-Type'] == 'application/gzip':
+            content = gzip.decompress(content)
+        return response, list(csv.DictReader(io.StringIO(content.decode('utf-8'))))
+
+    def test_compression_and_addresses_are_separate_options(self):
+        for action, compressed, with_addresses in [
+            ('export_as_csv', False, False),
+            ('export_as_csv_gz', True, False),
+            ('export_with_addresses_as_csv', False, True),
+            ('export_with_addresses_as_csv_gz', True, True),
+        ]:
+            with self.subTest(action):
+                response, rows = self.export(action)
+                self.assertEqual(response['Content-Type'], 'application/gzip' if compressed else 'text/csv')
+                self.assertEqual(response['Content-Disposition'].endswith('.csv.gz"'), compressed)
+                self.assertEqual(len(rows), 1)
+                self.assertEqual(rows[0]['order_id'], 'TEST-1')
+                self.assertEqual('dropoff_city' in rows[0], with_addresses)
+                if with_addresses:
+                    self.assertEqual(rows[0]['dropoff_city'], 'Utrecht')
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        courier = User.objects.create_user('courier@example.com', user_type=User.Types.COURIER)
+        for n in range(30):
+            order = create_order(n, assigned_courier=courier, created_by=courier)
+            create_address(PickupAddress, order)
+            create_address(DropoffAddress, order, city='Utrecht')
+
+    def export(self, queryset, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            chunks = list(iter_order_csv(queryset, **kwargs))
+        return chunks, len(context.captured_queries)
+
+    def test_query_count_does_not_grow_with_the_rows(self):
+        for include_addresses in [False, True]:
+            with self.subTest(include_addresses=include_addresses):
+                _chunks, one = self.export(Order.objects.filter(order_id='TEST-0'),
+                                           include_addresses=include_addresses)
+                chunks, many = self.export(Order.objects.all(), include_addresses=include_addresses)
+                self.assertEqual(many, one)
+                rows = list(csv.DictReader(io.StringIO(''.join(chunks))))
+                self.assertEqual(len(rows), 30)
+                self.assertEqual(rows[0]['assigned_courier'], 'courier@example.com')
+                if include_addresses:
+                    self.assertEqual(rows[0]['dropoff_city'], 'Utrecht')
+
+    def test_rows_are_streamed_in_chunks(self):
+        chunks, _queries = self.export(Order.objects.all(), chunk_size=10)
+        # The header, then one chunk per 10 rows
+        self.assertEqual([chunk.count('\n') for chunk in chunks], [1, 10, 10, 10])
+
+
+class OrderAdminQueryCountTests(ChangelistQueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin@example.com', 'password')
+        for i in range(25):
+            courier = User.objects.create_user(f'courier{i}@example.com', user_type=User.Types.COURIER)
+            order = create_order(i, assigned_courier=courier, created_by=cls.user)
+            create_address(PickupAddress, order)
+            create_address(DropoffAddress, order)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_changelist_queries(self):
+        self.assertChangelistQueriesConstant(Order)
+
+    def test_city_columns_show_a_dash_without_an_address(self):
+        order = create_order(99)
+        model_admin = admin.site._registry[Order]
+        for name in ('pickup_city_display', 'dropoff_city_display'):
+            with self.subTest(name):
+                self.assertIn(name, model_admin.list_display)
+                # How the changelist reads a column: model fields take precedence over admin methods
+                _field, _attr, value = lookup_field(name, order, model_admin)
+                self.assertEqual(value, '-')
+
+
+class OrderStatisticsTests(TestCase):
+    def test_date_range_includes_whole_days_in_the_current_time_zone(self):
+        def local(day, at):
+            return timezone.make_aware(datetime.combine(day, at))
+
+        create_order(1, order_date=local(date(2025, 3, 9), time(23, 59)))
+        create_order(2, order_date=local(date(2025, 3, 10), time.min))
+        create_order(3, order_date=local(date(2025, 3, 12), time(23, 59, 59)))
+        create_order(4, order_date=local(date(2025, 3, 13), time.min))
+        invalidate_order_statistics()
+
+        self.assertEqual(get_order_statistics(date(2025, 3, 10), date(2025, 3, 12))['total'], 2)
+        self.assertEqual(get_order_statistics(date(2025, 3, 10))['total'], 3)
+        self.assertEqual(get_order_statistics(date_to=date(2025, 3, 12))['total'], 3)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'index usage is only binding on PostgreSQL')
+class OrderQueryPlanTests(TestCase):
+    def setUp(self):
+        with connection.cursor() as cursor:
+            # The empty test tables are cheaper to scan; rolled back with the test's transaction
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_hot_order_queries_use_their_planned_index(self):
+        for description, queryset, index in get_checked_queries():
+            with self.subTest(description):
+                self.assertIn(index, queryset.explain())
+
+    def test_statistics_date_range_is_an_index_condition(self):
+        queryset = filter_orders(Order.objects.order_by(), date(2025, 3, 10), date(2025, 3, 12),
+                                 PartnerCompany.values[0])
+        plan = queryset.explain()
+        conditions = [line for line in plan.splitlines() if 'Index Cond' in line]
+        self.assertTrue(any('order_date >=' in line and 'order_date <' in line for line in conditions), plan)
+
+
+class SearchDocumentRefreshTests(TestCase):
+    def setUp(self):
+        self.order = create_order()
+        self.pickup = create_address(PickupAddress, self.order)
+
+    def entry(self, instance, action, changes=None):
+        entry = AuditLogEntry(content_type=type(instance).__name__, object_id=str(instance.pk), action=action,
+                              changes=changes or {})
+        entry.instance = instance
+        return entry
+
+    def test_changes_outside_the_document_do_not_rebuild_it(self):
+        entries = [
+            self.entry(self.order, 'UPDATE', {'status': {'old': OrderState.NEW, 'new': OrderState.ACCEPTED}}),
+            self.entry(self.pickup, 'UPDATE', {'phone_number': {'old': '+31201234567', 'new': '+31207654321'}}),
+        ]
+        with self.assertNumQueries(0):
+            refresh_on_order_changes(sender=None, entries=entries)
+
+    def test_document_changes_rebuild_it(self):
+        for entry in [
+            self.entry(self.order, 'CREATE'),
+            self.entry(self.order, 'UPDATE', {'product_name': {'old': 'Old', 'new': 'Test product 1'}}),
+            self.entry(self.pickup, 'UPDATE', {'city': {'old': 'Utrecht', 'new': 'Amsterdam'}}),
+        ]:
+            with self.subTest(entry.content_type, action=entry.action):
+                OrderSearchDocument.objects.all().delete()
+                refresh_on_order_changes(sender=None, entries=[entry])
+                self.assertIn('Amsterdam', OrderSearchDocument.objects.get(order=self.order).document)
+
+
+class OrderLocationTests(TestCase):
+    def setUp(self):
+        self.order = create_order()
+        self.pickup = create_address(PickupAddress, self.order)
+        self.dropoff = create_address(DropoffAddress, self.order, city='Utrecht', postal_code='3511AA')
+
+    def get_location(self):
+        return Order.objects.values_list(*LOCATION_COLUMNS).get(pk=self.order.pk)
+
+    def test_address_saves_are_copied_onto_the_order(self):
+        self.assertEqual(self.get_location(), ('Amsterdam', '1015CJ', 'Utrecht', '3511AA'))
+        self.pickup.city = 'Haarlem'
+        self.pickup.save()
+        self.assertEqual(self.get_location(), ('Haarlem', '1015CJ', 'Utrecht', '3511AA'))
+        # The loaded order is kept in step
+        self.assertEqual(self.pickup.order.pickup_city, 'Haarlem')
+
+    def test_deleted_address_is_cleared_from_the_order(self):
+        self.dropoff.delete()
+        self.assertEqual(self.get_location(), ('Amsterdam', '1015CJ', '', ''))
+
+    def test_refresh_repairs_orders_left_stale_by_bulk_updates(self):
+        PickupAddress.objects.filter(pk=self.pickup.pk).update(city='Leiden')
+        self.assertEqual(refresh_locations(Order.objects.all()), 1)
+        self.assertEqual(self.get_location()[0], 'Leiden')
+        self.assertEqual(refresh_locations(Order.objects.all()), 0)
+
+    def test_saving_a_stale_order_keeps_the_newer_location(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        address = PickupAddress.objects.get(pk=self.pickup.pk)
+        address.city = 'Haarlem'
+        address.save()
+
+        stale.product_name = 'Renamed product'
+        stale.save()
+        self.assertEqual(self.get_location()[0], 'Haarlem')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).product_name, 'Renamed product')
+
+    def test_locations_are_not_audited(self):
+        self.assertEqual(set(Order.derived_fields), set(LOCATION_COLUMNS))
+        tracked = {name for name, _attname in get_tracked_fields(Order)}
+        self.assertFalse(tracked & set(LOCATION_COLUMNS))
+        order = Order.objects.get(pk=self.order.pk)
+        order.pickup_city = 'Haarlem'
+        self.assertEqual(order.get_changes(), {})
+
+
+class AuditReadModelTests(TransactionTestCase):
+    """
+    Statistics and search documents follow committed order changes in every
+    audit log MODE; the history follows the audit rows it is built from.
+    """
+
+    def setUp(self):
+        self.order = create_order()
+
+    def change_order(self):
+        with audit_writer.buffering(), transaction.atomic():
+            order = Order.objects.get(pk=self.order.pk)
+            order.status = OrderState.ACCEPTED
+            order.product_name = 'Renamed product'
+            order.save()
+
+    def get_accepted(self):
+        return get_order_statistics()['orders_by_status'][dict(OrderState.CHOICES)[OrderState.ACCEPTED]]
+
+    def get_document(self):
+        return OrderSearchDocument.objects.get(order=self.order).document
+
+    def get_history(self):
+        return OrderHistoryEvent.objects.filter(order=self.order, action='UPDATE').count()
+
+    def wait_for(self, condition):
+        deadline = monotonic() + 5
+        while not condition():
+            self.assertLess(monotonic(), deadline, 'timed out waiting for the background flusher')
+            sleep(0.01)
+
+    def test_committed_changes_are_followed_in_every_mode(self):
+        for mode in ['buffered', 'background', 'sync']:
+            with self.subTest(mode), override_settings(AUDIT_LOG={'MODE': mode, 'FLUSH_INTERVAL': 0}):
+                Order.objects.filter(pk=self.order.pk).update(status=OrderState.NEW, product_name='Test product 1')
+                OrderHistoryEvent.objects.all().delete()
+                invalidate_order_statistics()
+                self.assertEqual(self.get_accepted(), 0)
+
+                self.change_order()
+                self.assertEqual(self.get_accepted(), 1)
+                self.assertIn('Renamed product', self.get_document())
+                self.wait_for(lambda: self.get_history() == 1)
+
+    @override_settings(AUDIT_LOG={'MODE': 'sync'})
+    def test_rolled_back_changes_are_not_followed(self):
+        self.assertEqual(self.get_accepted(), 0)
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.change_order()
+            raise ValueError
+        self.assertEqual(self.get_accepted(), 0)
+        self.assertNotIn('Renamed product', self.get_document())
+        self.assertEqual(self.get_history(), 0)
+
+    @override_settings(AUDIT_LOG={'MODE': 'background', 'FLUSH_INTERVAL': 0})
+    def test_failed_background_write_loses_only_the_history(self):
+        self.assertEqual(self.get_accepted(), 0)
+        with mock.patch.object(AuditLogEntry.objects, 'bulk_create', side_effect=DatabaseError('disk full')) as write, \
+                self.assertLogs('core.audit', 'ERROR'):
+            self.change_order()
+            self.assertEqual(self.get_accepted(), 1)
+            self.assertIn('Renamed product', self.get_document())
+            self.wait_for(lambda: write.called)
+        self.assertEqual(self.get_history(), 0)
+
+
+class OrderSearchTests(TestCase):
+    def setUp(self):
+        self.orders = {}
+        for n, (order_id, pickup_code, dropoff_code) in enumerate([
+            ('1015', '2000AB', '3511AA'),
+            ('WH-101500', '1015CJ', '3511AA'),
+            ('WH-200000', '3511AA', '1015 CJ'),
+            ('1015CJ-9', '2000AB', '2000AB'),
+        ]):
+            order = create_order(n, order_id=order_id)
+            create_address(PickupAddress, order, postal_code=pickup_code, city='Haarlem')
+            create_address(DropoffAddress, order, postal_code=dropoff_code, city='Utrecht')
+            self.orders[order_id] = order
+
+    def find(self, search_term):
+        matches = find_exact_matches(Order.objects.all(), search_term)
+        return None if matches is None else sorted(matches.values_list('order_id', flat=True))
+
+    def test_exact_order_id_comes_first(self):
+        # Also the start of a postal code and of another order ID
+        self.assertEqual(self.find('1015'), ['1015'])
+        self.assertEqual(self.find(' #WH-101500 '), ['WH-101500'])
+
+    def test_postal_code_comes_before_order_id_prefixes(self):
+        self.assertEqual(self.find('1015CJ'), ['WH-101500', 'WH-200000'])
+        self.assertEqual(self.find('3511'), ['1015', 'WH-101500', 'WH-200000'])
+
+    def test_dutch_postal_codes_match_in_every_spelling(self):
+        for search_term in ['1015CJ', '1015 CJ', '1015cj', '1015 cj']:
+            with self.subTest(search_term=search_term):
+                self.assertEqual(self.find(search_term), ['WH-101500', 'WH-200000'])
+
+    def test_order_id_prefix(self):
+        self.assertEqual(self.find('WH-10'), ['WH-101500'])
+        self.assertEqual(self.find('1015CJ-'), ['1015CJ-9'])
+
+    def test_other_searches_fall_back_to_the_documents(self):
+        refresh_search_documents([order.pk for order in self.orders.values()])
+        for search_term in ['Haarlem', 'WH-3', '9999']:
+            with self.subTest(search_term=search_term):
+                self.assertIsNone(self.find(search_term))
+        self.assertEqual(search_orders(Order.objects.all(), 'Haarlem').count(), 4)
+        matches = search_orders(Order.objects.all(), '"Test product 3"')
+        self.assertEqual(list(matches.values_list('order_id', flat=True)), ['1015CJ-9'])
+
+
+class OrderImportTests(TestCase):
+    def row(self, **values):
+        return {'order_id': 'IMPORT-1', 'order_date': '2025-03-10 12:00:00', 'product_name': 'Imported product',
+                'total_price': '100.00', **values}
+
+    def test_values_outside_the_field_choices_are_rejected(self):
+        importer = OrderImporter()
+        for status in ['BOGUS', 'NEW']:
+            with self.subTest(status=status), self.assertRaisesMessage(ImportRowError, 'status:'):
+                importer.parse_row(self.row(status=status))
+
+    def test_invalid_rows_are_reported_and_valid_rows_imported(self):
+        importer = OrderImporter()
+        importer.run([(2, self.row(status='BOGUS')), (3, self.row(order_id='IMPORT-2', status=OrderState.ACCEPTED))])
+        self.assertEqual([line for line, _message in importer.result.errors], [2])
+        self.assertEqual(list(Order.objects.values_list('order_id', 'status')), [('IMPORT-2', OrderState.ACCEPTED)])
+
+    def test_values_longer_than_the_column_are_rejected(self):
+        with self.assertRaisesMessage(ImportRowError, 'pickup_postal_code:'):
+            OrderImporter().parse_row(self.row(pickup_postal_code='1' * 100))
+
+
+class OrderTransitionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('staff@example.com')
+        self.orders = [create_order(n) for n in range(6)]
+        Order.objects.filter(pk=self.orders[0].pk).update(status=OrderState.DELIVERED)
+
+    def test_allowed_orders_move_and_are_audited(self):
+        result = transition_orders(Order.objects.all(), OrderState.ACCEPTED, user=self.user)
+        self.assertEqual(result.rejected, [self.orders[0].pk])
+        self.assertEqual(sorted(result.changed), [order.pk for order in self.orders[1:]])
+        self.assertEqual(Order.objects.filter(status=OrderState.ACCEPTED, updated_by=self.user).count(), 5)
+        entry = AuditLogEntry.objects.get(object_id=str(self.orders[1].pk))
+        self.assertEqual(entry.changes['status'], {'old': OrderState.NEW, 'new': OrderState.ACCEPTED})
+
+    def test_orders_changed_between_chunks_are_rejected(self):
+        progress = []
+
+        def on_progress(result):
+            if not progress:
+                # Delivered elsewhere while the first chunk was being committed
+                Order.objects.filter(pk=self.orders[3].pk).update(status=OrderState.DELIVERED)
+            progress.append((len(result.changed), len(result.rejected)))
+
+        result = transition_orders(Order.objects.all(), OrderState.ACCEPTED, user=self.user, chunk_size=2,
+                                   progress=on_progress)
+        self.assertEqual(progress, [(1, 1), (2, 2), (4, 2)])
+        self.assertEqual(sorted(result.rejected), [self.orders[0].pk, self.orders[3].pk])
+        self.assertEqual(result.skipped, [])
+        self.assertEqual(Order.objects.get(pk=self.orders[3].pk).status, OrderState.DELIVERED)
+        self.assertFalse(AuditLogEntry.objects.filter(object_id=str(self.orders[3].pk)).exists())
+
+    def test_query_count_does_not_grow_with_the_orders(self):
+        with CaptureQueriesContext(connection) as one:
+            transition_orders(Order.objects.filter(pk=self.orders[1].pk), OrderState.ACCEPTED, user=self.user)
+        with CaptureQueriesContext(connection) as many:
+            transition_orders(Order.objects.exclude(pk=self.orders[1].pk), OrderState.ACCEPTED, user=self.user)
+        self.assertEqual(len(many), len(one))
+
+
+class OrderTransitionJobTests(TestCase):
+    def setUp(self):
+        self.orders = [create_order(n) for n in range(5)]
+        self.job = queue_transition(Order.objects.all(), OrderState.ACCEPTED)
+
+    def test_progress_is_saved_with_every_chunk(self):
+        job = claim_job()
+        progress = []
+
+        def on_progress(job):
+            if not progress:
+                Order.objects.filter(pk=self.orders[3].pk).update(status=OrderState.DELIVERED)
+            saved = OrderTransitionJob.objects.get(pk=job.pk)
+            progress.append((job.changed, job.rejected, saved.changed, saved.rejected))
+
+        result = run_job(job, chunk_size=2, progress=on_progress)
+        self.assertEqual(progress, [(2, 0, 2, 0), (3, 1, 3, 1), (4, 1, 4, 1)])
+        self.assertEqual(result.rejected, [self.orders[3].pk])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.changed, job.rejected), (OrderTransitionJob.DONE, 4, 1))
+
+    def test_job_left_running_is_taken_over_after_the_lease_timeout(self):
+        job = claim_job()
+        self.assertEqual(job, self.job)
+        self.assertIsNone(claim_job(lease_timeout=60))
+
+        # The worker moved the first two orders, then died
+        first = sorted(job.order_ids)[:2]
+        result = TransitionResult(job.target)
+        transition = transition_orders(Order.objects.filter(pk__in=first), job.target)
+        result.changed = transition.changed
+        save_progress(job, result)
+        OrderTransitionJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+
+        taken_over = claim_job(lease_timeout=60)
+        self.assertEqual(taken_over, self.job)
+        with self.assertRaises(JobLeaseLost):
+            save_progress(job, result)
+
+        result = run_job(taken_over, chunk_size=2)
+        self.assertEqual(len(result.changed), 3)
+        taken_over.refresh_from_db()
+        self.assertEqual((taken_over.status, taken_over.changed, taken_over.rejected),
+                         (OrderTransitionJob.DONE, 5, 0))
+        self.assertFalse(Order.objects.exclude(status=OrderState.ACCEPTED).exists())
@@ -0,0 +1,199 @@
+"""
+Set-based status transitions of orders, following OrderState.TRANSITIONS.
+
+transition_orders() moves any number of orders with a constant number of
+queries: one SELECT ... FOR UPDATE reads and locks (id, status) of the
+selected rows, then core.signals.audited_update moves the ones that may
+with one UPDATE and writes their audit entries with one bulk_create. Orders
+whose status does not allow the move are left alone and reported as
+rejected.
+
+Large selections are better moved in chunks (chunk_size): CHUNK_SIZE orders
+at a time in ascending primary key order, each chunk in its own short
+transaction, so webhook and courier writes to the same orders wait for one
+chunk at most. Chunks lock with SKIP LOCKED: an order locked by another
+transaction (or deleted meanwhile) is skipped, reported in
+TransitionResult.skipped, rather than waited for. Chunks only commit
+separately outside of an atomic block.
+
+The admin queues selections above BACKGROUND_THRESHOLD as an
+OrderTransitionJob, which process_order_transitions runs (run_job()). A
+job's progress is saved in the transaction of each chunk; a job left
+running by a worker that died is taken over once it has made no progress
+for LEASE_TIMEOUT seconds, and resumes after its last saved chunk.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.context import get_current_user
+from core.signals import audited_update
+
+from .models import Order, OrderState, OrderTransitionJob
+
+ORDER_BULK_ACTIONS_DEFAULTS = {
+    'CHUNK_SIZE': 500,
+    'BACKGROUND_THRESHOLD': 5000,
+    'LEASE_TIMEOUT': 600,
+}
+
+
+def get_bulk_action_setting(name):
+    """Return an order bulk action setting, falling back to the defaults"""
+    return getattr(settings, 'ORDER_BULK_ACTIONS', {}).get(name, ORDER_BULK_ACTIONS_DEFAULTS[name])
+
+
+class TransitionResult:
+    """Ids of the orders a transition changed, rejected and skipped as locked"""
+
+    def __init__(self, target, changed=(), rejected=(), skipped=()):
+        self.target = target
+        self.changed = list(changed)
+        self.rejected = list(rejected)
+        self.skipped = list(skipped)
+
+
+def iter_pk_chunks(queryset, chunk_size):
+    """Yield the primary keys of queryset in ascending lists of at most chunk_size, by keyset"""
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    chunk = list(pks[:chunk_size])
+    while chunk:
+        yield chunk
+        chunk = list(pks.filter(pk__gt=chunk[-1])[:chunk_size])
+
+
+def transition_orders(queryset, target, user=None, chunk_size=None, progress=None):
+    """
+    Move the orders of queryset to status target where OrderState allows
+    it, recording the change for user (the current user by default).
+    Without chunk_size all orders move in one transaction, waiting for rows
+    locked by others; with it, see the module docstring. progress(result)
+    is called after every chunk. Returns a TransitionResult.
+    """
+    if target not in OrderState.TRANSITIONS:
+        raise ValueError(f'Unknown order status: {target}')
+    user = user or get_current_user()
+    result = TransitionResult(target)
+    manager = Order._base_manager.using(queryset.db)
+    if chunk_size is None:
+        apply_transition(manager.filter(pk__in=queryset.order_by().values('pk')), result, user)
+        return result
+    for pks in iter_pk_chunks(queryset, chunk_size):
+        apply_transition(manager.filter(pk__in=pks), result, user, expected=pks)
+        if progress:
+            progress(result)
+    return result
+
+
+def apply_transition(selected, result, user, expected=None):
+    """
+    Move the orders of selected to result.target in one transaction, adding
+    their ids to result. With expected (the pks of selected), rows locked by
+    others are skipped and added to result.skipped.
+    """
+    target = result.target
+    sources = OrderState.get_sources(target)
+    with transaction.atomic(using=selected.db):
+        # Locked in pk order, so concurrent transitions cannot deadlock
+        rows = list(selected.order_by('pk').select_for_update(skip_locked=expected is not None).values_list(
+            'pk', 'status'
+        ))
+        changed = [pk for pk, status in rows if status in sources]
+        result.changed += changed
+        result.rejected += [pk for pk, status in rows if status not in sources]
+        if expected is not None:
+            locked = {pk for pk, _status in rows}
+            result.skipped += [pk for pk in expected if pk not in locked]
+        if not changed:
+            return
+
+        values = {'status': target}
+        if user is not None:
+            values['updated_by'] = user
+        # Only the rows we hold: the others would block the UPDATE
+        audited_update(selected.model._base_manager.using(selected.db).filter(pk__in=changed), **values)
+
+
+def queue_transition(queryset, target, user=None):
+    """Queue an OrderTransitionJob moving the orders of queryset to target"""
+    if target not in OrderState.TRANSITIONS:
+        raise ValueError(f'Unknown order status: {target}')
+    order_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    return OrderTransitionJob.objects.create(
+        target=target, order_ids=order_ids, total=len(order_ids), created_by=user or get_current_user()
+    )
+
+
+class JobLeaseLost(Exception):
+    """Raised when a job was taken over by another worker while running"""
+
+
+def claim_job(lease_timeout=None):
+    """
+    Mark the oldest pending job, or running job without progress for
+    lease_timeout seconds, running and return it; None when there is none
+    """
+    if lease_timeout is None:
+        lease_timeout = get_bulk_action_setting('LEASE_TIMEOUT')
+    now = timezone.now()
+    stale = Q(status=OrderTransitionJob.RUNNING, heartbeat_at__lt=now - timedelta(seconds=lease_timeout))
+    with transaction.atomic():
+        job = OrderTransitionJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status=OrderTransitionJob.PENDING) | stale
+        ).order_by('pk').first()
+        if job is not None:
+            job.status = OrderTransitionJob.RUNNING
+            # A new lease: the worker that had it can no longer save progress
+            job.started_at = job.heartbeat_at = now
+            job.save(update_fields=['status', 'started_at', 'heartbeat_at'])
+    return job
+
+
+def run_job(job, chunk_size=None, progress=None):
+    """
+    Carry out a claimed job chunk by chunk, from where it was left off,
+    saving its progress with each; progress(job) is called after each.
+    Returns the TransitionResult of this run.
+    """
+    chunk_size = chunk_size or get_bulk_action_setting('CHUNK_SIZE')
+    result = TransitionResult(job.target)
+    # Chunks run in pk order and every order counts once, so the first `done` are behind us
+    order_ids = sorted(job.order_ids)[job.done:]
+    resumed = (job.changed, job.rejected, list(job.skipped_ids))
+    manager = Order._base_manager
+    try:
+        for start in range(0, len(order_ids), chunk_size):
+            pks = order_ids[start:start + chunk_size]
+            with transaction.atomic():
+                apply_transition(manager.filter(pk__in=pks), result, job.created_by, expected=pks)
+                save_progress(job, result, resumed)
+            if progress:
+                progress(job)
+    except JobLeaseLost:
+        raise
+    except Exception as e:
+        save_progress(job, result, resumed, status=OrderTransitionJob.FAILED, error=repr(e))
+        raise
+    save_progress(job, result, resumed, status=OrderTransitionJob.DONE)
+    return result
+
+
+def save_progress(job, result, resumed=(0, 0, ()), status=None, error=''):
+    """Save the job's counters, raising JobLeaseLost if another worker has taken it over"""
+    changed, rejected, skipped_ids = resumed
+    job.changed = changed + len(result.changed)
+    job.rejected = rejected + len(result.rejected)
+    job.skipped_ids = [*skipped_ids, *result.skipped]
+    job.heartbeat_at = timezone.now()
+    fields = ['changed', 'rejected', 'skipped_ids', 'heartbeat_at']
+    if status:
+        job.status, job.error, job.finished_at = status, error, timezone.now()
+        fields += ['status', 'error', 'finished_at']
+    updated = OrderTransitionJob.objects.filter(pk=job.pk, started_at=job.started_at).update(
+        **{field: getattr(job, field) for field in fields}
+    )
+    if not updated:
+        raise JobLeaseLost(f'Job #{job.pk} was taken over by another worker')
@@ -57,6 +57,7 @@ INSTALLED_APPS = [
     'accounts',
     'orders',
     'core',
+    'integration',
 ]
 
 MIDDLEWARE = [
@@ -65,6 +66,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.RequestContextMiddleware',  # Request/user context for auditing and partner scoping
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',  # Debug Toolbar middleware
@@ -107,6 +109,13 @@ DATABASES = {
     }
 }
 
+# Cache
+# Shared between processes in production (e.g. redis://host:6379/1) so cache
+# invalidation, such as for the order statistics, reaches every worker
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -189,6 +198,47 @@ INTERNAL_IPS = [
     'localhost',
 ]
 
+# Audit Log Settings
+# MODE: 'buffered' (bulk write per request/transaction), 'background'
+# (daemon flusher thread with a bounded queue) or 'sync' (one write per entry)
+AUDIT_LOG = {
+    'MODE': env('AUDIT_LOG_MODE', default='buffered'),
+    'FLUSH_SIZE': env.int('AUDIT_LOG_FLUSH_SIZE', default=500),
+    'FLUSH_INTERVAL': env.float('AUDIT_LOG_FLUSH_INTERVAL', default=2.0),
+    'QUEUE_SIZE': env.int('AUDIT_LOG_QUEUE_SIZE', default=10000),
+    # Older months are exported to MEDIA_ROOT/ARCHIVE_DIR by archive_audit_log
+    'RETENTION_DAYS': env.int('AUDIT_LOG_RETENTION_DAYS', default=365),
+    'ARCHIVE_DIR': env('AUDIT_LOG_ARCHIVE_DIR', default='audit_archive'),
+    # Store changes payloads of at least this many bytes zlib-compressed (0 = off)
+    'COMPRESS_THRESHOLD': env.int('AUDIT_LOG_COMPRESS_THRESHOLD', default=0),
+}
+
+# Whoppah CMS API Settings (see integration.api_client)
+WHOPPAH_API = {
+    'URL': env('WHOPPAH_API_URL', default='https://api.whoppah.com'),
+    'KEY': env('WHOPPAH_API_KEY', default=''),
+    'SECRET': env('WHOPPAH_API_SECRET', default=''),
+    'TIMEOUT': env.float('WHOPPAH_API_TIMEOUT', default=30.0),
+    # Pooled keep-alive connections, and pages fetched concurrently
+    'MAX_CONNECTIONS': env.int('WHOPPAH_API_MAX_CONNECTIONS', default=8),
+    'MAX_RETRIES': env.int('WHOPPAH_API_MAX_RETRIES', default=3),
+    'PAGE_SIZE': env.int('WHOPPAH_API_PAGE_SIZE', default=100),
+    # Key of the HMAC-SHA256 signature of incoming webhooks
+    'WEBHOOK_SECRET': env('WHOPPAH_WEBHOOK_SECRET', default=''),
+    # Seconds a webhook event waits so later events of the same order can be merged into it
+    'WEBHOOK_COALESCE_WINDOW': env.float('WHOPPAH_WEBHOOK_COALESCE_WINDOW', default=5.0),
+}
+
+# Order Bulk Action Settings (see orders.transitions)
+ORDER_BULK_ACTIONS = {
+    # Orders moved per transaction by the admin status actions
+    'CHUNK_SIZE': env.int('ORDER_BULK_CHUNK_SIZE', default=500),
+    # Larger selections are queued for process_order_transitions (0 = never)
+    'BACKGROUND_THRESHOLD': env.int('ORDER_BULK_BACKGROUND_THRESHOLD', default=5000),
+    # Seconds without progress after which a running job is taken over by another worker
+    'LEASE_TIMEOUT': env.int('ORDER_BULK_LEASE_TIMEOUT', default=600),
+}
+
 # Unfold Admin Settings
 UNFOLD = {
     "SITE_TITLE": "WhoppahBridge",
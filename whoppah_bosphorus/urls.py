@@ -29,6 +29,7 @@ urlpatterns = [
     path('', index, name='index'),
     path('admin/', admin.site.urls),
     path('', include('core.urls')),  # Include core URLs (for dashboard)
+    path('', include('integration.urls')),  # Whoppah CMS webhooks
 ]
 
 # Add debug toolbar URLs if in debug mode